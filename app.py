@@ -1,11 +1,61 @@
 import streamlit as st # for web
-import pandas as pd # For JSON file
-import gspread # Link spread sheet
-from google.oauth2 import service_account
 from datetime import date, datetime, timedelta
-import plotly.express as px # fore pie
 import base64 # Added for image encoding
 import os # Added for file path checking
+import json # Archive manifests
+import threading # Guards the local archive against concurrent sessions
+import shutil # Archive rebuilds
+import re # Tokenizing free text for search
+import bisect # Prefix lookups in the search vocabulary
+import math # BM25 scoring
+import time # Search timing
+import io # Reading uploaded files
+import hashlib # Fingerprinting static assets
+import collections # Rolling timing windows
+import contextlib # Timing context manager
+import uuid # Session tags for API accounting
+import weakref # Shared frames tracked without keeping them alive
+import sys # Session state sizes
+import importlib # Deferred imports of the heavy modules
+import logging # Quieting Streamlit's per-call warning in background threads
+import http.server # Local aggregates endpoint
+import urllib.parse # Query strings of the aggregates endpoint
+import unicodedata # Normalizing free-text names
+import difflib # Fuzzy matching of name spellings
+
+# -------------------- DEFERRED IMPORTS --------------------
+# pandas, plotly, gspread and google-auth are only needed once a user is logged in.
+# They are bound to proxies that import the real module on first attribute access,
+# so a cold start renders the login page without loading them. While the user
+# types their credentials, a background thread warms them (warm_heavy_imports).
+class LazyModule:
+    """Stands in for a module until one of its attributes is first used."""
+
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            module = importlib.import_module(self._name) # Thread-safe; a no-op once imported
+            if self._on_load:
+                self._on_load(module)
+            self._module = module
+        return getattr(self._module, attr)
+
+def _configure_pandas(pandas):
+    if int(pandas.__version__.split(".")[0]) < 3:
+        pandas.set_option("mode.copy_on_write", True) # Shared frames rely on it; always on from pandas 3
+        with contextlib.suppress(KeyError): # pandas < 2.1 has no Arrow-backed default strings
+            pandas.set_option("future.infer_string", True) # Text columns as Arrow strings; the default from pandas 3
+
+pd = LazyModule("pandas", on_load=_configure_pandas) # For JSON file
+gspread = LazyModule("gspread") # Link spread sheet
+service_account = LazyModule("google.oauth2.service_account")
+px = LazyModule("plotly.express") # fore pie
+pq = LazyModule("pyarrow.parquet") # Schemas of sealed segments, for reading only some columns
+HEAVY_MODULES = ("pandas", "plotly.express", "gspread", "google.oauth2.service_account")
 
 # -------------------- USER LOGIN --------------------
 USER_CREDENTIALS = {
@@ -21,12 +71,105 @@ EQUIPMENT_URL = "https://docs.google.com/spreadsheets/d/1KbjDWkdG4Ce9fSDs3tCZsky
 HEAVY_EQUIP_TAB = "Heavy Equipment"
 HEAVY_VEHICLE_TAB = "Heavy Vehicles"
 
-# --- MASTER SITE LIST ---
-ALL_SITES = [
-    "1858", "1969", "1972", "2433", "2447", "2485",
-    "2534", "2549", "2553", "2516", "2556", "2575", "2566","2570","HRDH Laydown","2595"
+# -------------------- SHEET HEADERS --------------------
+# MODIFIED: Removed "F.E TP expiry" from the headers list
+HEAVY_EQUIP_HEADERS = [
+    "Equipment type", "Make", "Palte No.", "Asset code", "Owner", "T.P inspection date", "T.P Expiry date",
+    "Insurance expiry date", "Operator Name", "Iqama NO", "T.P Card type", "T.P Card Number",
+    "T.P Card expiry date", "Q.R code", "PWAS status",
+    "FA box Status", "Documents", "Record ID"
 ]
-# ------------------------
+
+HEAVY_VEHICLE_HEADERS = [
+    "Vehicle Type", "Make", "Plate No", "Asset Code", "Owner", "MVPI Expiry date", "Insurance Expiry",
+    "Driver Name", "Iqama No", "Licence Expiry", "Q.R code", "F.A Box",
+    "PWAS Status", "Seat belt damaged", "Tyre Condition",
+    "Suspension Systems", "Remarks", "Record ID"
+]
+
+# Column order written by show_permit_form
+PERMIT_HEADERS = [
+    "DATE", "DRILL SITE", "WORK LOCATION", "PERMIT NO", "TYPE OF PERMIT",
+    "ACTIVITY", "PERMIT RECEIVER", "PERMIT ISSUER"
+]
+
+# -------------------- FORM VOCABULARIES --------------------
+# Fixed answer sets of the forms. Site-specific lists (wells, people, locations,
+# equipment types...) are reference data, see below.
+TP_CARD_TYPES = ["SPSP", "Aramco", "PAX", "N/A"]
+PWAS_OPTIONS = ["Working", "Not Working", "Alarm Not Audible", "Faulty Camera/Monitor", "N/A"]
+FA_BOX_OPTIONS = ["Available", "Not Available", "Expired", "Inadequate Medicine"]
+SEATBELT_OPTIONS = ["Yes", "No", "N/A"]
+TYRE_OPTIONS = ["Good", "Worn Out", "Damaged", "Needs Replacement", "N/A"]
+SUSPENSION_OPTIONS = ["Good", "Faulty", "Needs Repair", "DamDamaged", "N/A"]
+
+# -------------------- REFERENCE DATA --------------------
+# Sites, people and site-specific lists live in reference_data.json (or the file
+# named by APP_REFERENCE_FILE), so adding a well is a file edit, not a redeploy.
+# The file is loaded once per process and stamped with a version (a hash of its
+# content); edits are picked up in place within REFERENCE_CHECK_INTERVAL seconds
+# without clearing any data caches. A bad edit is reported and the previous
+# version kept.
+REFERENCE_FILE = os.environ.get("APP_REFERENCE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference_data.json"))
+REFERENCE_CHECK_INTERVAL = 15 # Seconds between checks of the file for edits
+REFERENCE_KEYS = (
+    "sites", "work_locations", "areas", "observers", "categories", "supervisor_trades",
+    "permit_types", "permit_issuers", "permit_receivers", "permit_activities", "equipment_types", "vehicle_types",
+)
+
+class ReferenceStore:
+    """The current reference lists and their version, shared by all sessions."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None    # dict of the lists plus "version"; replaced, never mutated
+        self.loaded_at = None
+        self.error = None   # Why the last edit was not applied
+        self.mtime = None
+        self.checked = 0.0
+
+    def current(self):
+        if time.time() - self.checked >= REFERENCE_CHECK_INTERVAL or self.data is None:
+            with self.lock:
+                if time.time() - self.checked >= REFERENCE_CHECK_INTERVAL or self.data is None:
+                    self._reload_if_changed()
+                    self.checked = time.time()
+        if self.data is None:
+            raise RuntimeError(f"Reference data could not be loaded: {self.error}")
+        return self.data
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(REFERENCE_FILE).st_mtime_ns
+            if mtime == self.mtime:
+                return
+            with open(REFERENCE_FILE, "rb") as f:
+                raw = f.read()
+            data = json.loads(raw)
+            missing = [key for key in REFERENCE_KEYS if key not in data]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+        except (OSError, ValueError) as e:
+            self.error = f"{os.path.basename(REFERENCE_FILE)}: {e}"
+            return
+        self.mtime, self.error = mtime, None
+        version = hashlib.sha1(raw).hexdigest()[:8]
+        if self.data is None or self.data["version"] != version:
+            self.data = {**data, "version": version}
+            self.loaded_at = datetime.now()
+
+@st.cache_resource(show_spinner=False)
+def get_reference_store():
+    return ReferenceStore()
+
+def reference():
+    """The current reference lists, e.g. reference()["sites"]. Treat as read-only."""
+    return get_reference_store().current()
+
+@st.cache_resource(show_spinner=False)
+def site_dtype(version, _sites):
+    """Ordered categorical of the wells, built once per reference-data version."""
+    return pd.CategoricalDtype(_sites, ordered=True)
 
 # -------------------- UTILITIES --------------------
 def get_img_as_base64(file):
@@ -38,20 +181,45 @@ def get_img_as_base64(file):
         data = f.read()
     return base64.b64encode(data).decode()
 
+# Try parsing the new format first, then fall back to the old one for existing data
+DATE_FORMATS = ("%d-%b-%Y", "%Y-%m-%d")
+
 def parse_date(s):
     """Safely parses a string into a date object, trying multiple formats."""
     if isinstance(s, (date, datetime)):
         return s.date() if isinstance(s, datetime) else s
-    # Try parsing the new format first, then fall back to the old one for existing data
-    for fmt in ("%d-%b-%Y", "%Y-%m-%d"):
+    for fmt in DATE_FORMATS:
         try:
             return datetime.strptime(str(s).split(' ')[0], fmt).date()
         except (ValueError, TypeError):
             continue
     return None
 
+def parse_dates(series):
+    """Vectorized parse_date: returns a datetime64 Series, NaT where no format matches."""
+    text = series.astype(str).str.strip().str.split(' ').str[0]
+    parsed = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    for fmt in DATE_FORMATS:
+        parsed = parsed.fillna(pd.to_datetime(text, format=fmt, errors='coerce'))
+    return parsed
+
+def as_date(d):
+    """A datetime.date from either representation parse_dates feeds on: a date32 value (the
+    fleet expiry columns) or a Timestamp (datetime64, e.g. a log's DATE). None for a null."""
+    if d is None or pd.isna(d): # NaT passes isinstance(d, date)
+        return None
+    if isinstance(d, datetime):
+        return d.date()
+    return d if isinstance(d, date) else None
+
+def observed_counts(series):
+    """value_counts() without the zero rows a categorical reports for its unused categories."""
+    counts = series.value_counts()
+    return counts[counts > 0]
+
 def badge_expiry(d, expiry_days=30):
     """Creates a visual badge for expiry dates."""
+    d = as_date(d)
     if d is None:
         return "⚪ Not Set"
     today = date.today()
@@ -64,7 +232,9 @@ def badge_expiry(d, expiry_days=30):
         return f"✅ Valid ({date_str})"
 
 def ensure_headers_match(worksheet, expected_headers):
-    """Checks and overwrites the header row of a worksheet if it doesn't match the expected list."""
+    """Checks and overwrites the header row of a worksheet if it doesn't match the expected list.
+    Returns whether it did. It runs inside the cached get_worksheet, which must not call Streamlit
+    elements, so the outcome is queued for show_sheet_notices."""
     try:
         current_header = worksheet.row_values(1)
         # Check if the current header matches the expected header list exactly
@@ -74,89 +244,2906 @@ def ensure_headers_match(worksheet, expected_headers):
             # Clear any cells after the new header in the first row
             if len(current_header) > len(expected_headers):
                  worksheet.batch_clear([f'{chr(ord("A") + len(expected_headers))}1:Z1'])
-            st.toast(f"✅ Headers updated successfully in '{worksheet.title}'. Reloading data...", icon="🚨")
-            # Force cache clear and rerun to immediately use the correct data schema
-            st.cache_resource.clear()
-            st.rerun()
+            st.session_state.setdefault("sheet_notices", []).append(("toast", f"✅ Headers updated successfully in '{worksheet.title}'."))
+            return True
     except Exception as e:
-        st.error(f"Failed to verify/fix headers in {worksheet.title}: {e}")
+        st.session_state.setdefault("sheet_notices", []).append(("error", f"Failed to verify/fix headers in {worksheet.title}: {e}"))
+    return False
+
+def show_sheet_notices():
+    """Shows what ensure_headers_match queued while the worksheets were opened."""
+    for kind, message in st.session_state.pop("sheet_notices", []):
+        if kind == "toast":
+            st.toast(message, icon="🚨")
+        else:
+            st.error(message)
+
+# -------------------- PERFORMANCE INSTRUMENTATION --------------------
+# Rolling per-stage timings for Sheets I/O, cleaning, filtering, figures and rendering.
+# Admins see them with ?perf=1 in the URL; they are also written in Prometheus text
+# format to METRICS_FILE (for node_exporter's textfile collector) every few seconds.
+PERF_WINDOW = 500 # Samples kept per stage for the rolling percentiles
+PERF_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PERF_EXPORT_INTERVAL = 15 # Seconds between Prometheus file writes
+METRICS_FILE = os.environ.get("APP_METRICS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".metrics", "onsite_app.prom"))
+
+class PerfRegistry:
+    """Process-wide stage timings: a rolling window per stage plus cumulative Prometheus histograms."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}   # stage -> deque of recent durations (seconds)
+        self.buckets = {}   # stage -> cumulative count per PERF_BUCKETS bound
+        self.sums = {}
+        self.counts = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = collections.deque(maxlen=PERF_WINDOW)
+                self.buckets[stage] = [0] * len(PERF_BUCKETS)
+                self.sums[stage] = 0.0
+                self.counts[stage] = 0
+            self.samples[stage].append(seconds)
+            self.sums[stage] += seconds
+            self.counts[stage] += 1
+            for i, bound in enumerate(PERF_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[stage][i] += 1
+
+    def summary(self):
+        """Rolling-window statistics per stage, in milliseconds."""
+        with self.lock:
+            windows = {stage: list(samples) for stage, samples in self.samples.items()}
+            counts = dict(self.counts)
+        rows = []
+        for stage, values in sorted(windows.items()):
+            values.sort()
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+            rows.append({
+                "Stage": stage, "Calls": counts[stage], "Window": len(values),
+                "p50 (ms)": pick(0.50), "p95 (ms)": pick(0.95), "p99 (ms)": pick(0.99),
+                "Max (ms)": values[-1] * 1000, "Mean (ms)": sum(values) / len(values) * 1000,
+            })
+        return pd.DataFrame(rows)
+
+    def window(self, stage):
+        with self.lock:
+            return list(self.samples.get(stage, ()))
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP onsite_stage_seconds Duration of instrumented app stages.",
+            "# TYPE onsite_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage in sorted(self.samples):
+                label = stage.replace("\\", "\\\\").replace('"', '\\"')
+                for bound, count in zip(PERF_BUCKETS, self.buckets[stage]):
+                    lines.append(f'onsite_stage_seconds_bucket{{stage="{label}",le="{bound}"}} {count}')
+                lines.append(f'onsite_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {self.counts[stage]}')
+                lines.append(f'onsite_stage_seconds_sum{{stage="{label}"}} {self.sums[stage]:.6f}')
+                lines.append(f'onsite_stage_seconds_count{{stage="{label}"}} {self.counts[stage]}')
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource(show_spinner=False)
+def get_perf_registry():
+    registry = PerfRegistry()
+
+    def export_loop():
+        while True:
+            time.sleep(PERF_EXPORT_INTERVAL)
+            try:
+                os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+                with open(METRICS_FILE + ".tmp", "w") as f:
+                    f.write(registry.prometheus_text())
+                os.replace(METRICS_FILE + ".tmp", METRICS_FILE)
+            except OSError:
+                pass # Metrics export must never break the app
+
+    threading.Thread(target=export_loop, name="metrics-export", daemon=True).start()
+    return registry
+
+@contextlib.contextmanager
+def timed(stage):
+    """Records the duration of the enclosed block under `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_perf_registry().observe(stage, time.perf_counter() - start)
+
+class StageClock:
+    """Lap timer for the stages of one dashboard tab.
+
+    `lap(name)` records the time since the previous lap; chart and table renders
+    go through `chart` / `table`, are recorded as their own stages and excluded
+    from the surrounding lap.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.registry = get_perf_registry()
+        self.last = time.perf_counter()
+        self.excluded = 0.0
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.registry.observe(f"{self.prefix}.{stage}", now - self.last - self.excluded)
+        self.last, self.excluded = now, 0.0
+
+    def _render(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.registry.observe(f"{self.prefix}.{stage}", elapsed)
+        self.excluded += elapsed
+
+    def chart(self, fig):
+        self._render("render_chart", st.plotly_chart, fig, use_container_width=True)
+
+    def table(self, df):
+        self._render("render_table", st.dataframe, df, use_container_width=True, hide_index=True)
+
+def page_slug(page):
+    """'📊 Dashboard' -> 'dashboard', for metric labels."""
+    return re.sub(r"[^a-z0-9]+", "_", page.lower()).strip("_") or "page"
+
+def show_performance_panel():
+    """Hidden admin panel (append ?perf=1 to the URL)."""
+    registry = get_perf_registry()
+    st.markdown("---")
+    st.subheader("⏱️ Performance (rolling window)")
+    summary = registry.summary()
+    if summary.empty:
+        st.info("No timings recorded yet.")
+        return
+    st.dataframe(summary.style.format(precision=1), use_container_width=True, hide_index=True)
+    stage = st.selectbox("Stage histogram", summary["Stage"], key="perf_stage")
+    samples_ms = pd.DataFrame({"ms": [v * 1000 for v in registry.window(stage)]})
+    st.plotly_chart(px.histogram(samples_ms, x="ms", nbins=40, labels={"ms": "Duration (ms)"}), use_container_width=True)
+    st.download_button("Download Prometheus metrics", registry.prometheus_text(), file_name="onsite_app.prom")
+    st.caption(f"Also written every {PERF_EXPORT_INTERVAL}s to `{METRICS_FILE}`.")
+
+# -------------------- SHEETS API ACCOUNTING --------------------
+# Every Google Sheets / Drive HTTP call made through the gspread client is tagged
+# with the session, user, page and operation type that caused it. Reads are
+# throttled per user with a sliding one-minute budget.
+API_LEDGER_RETENTION = 3600 # Seconds of call history kept in memory
+API_WINDOWS = {"Last minute": 60, "Last 5 minutes": 300, "Last 15 minutes": 900, "Last hour": 3600}
+API_READ_OPS = ("read", "metadata")
+# Reads per user per minute (0 = unlimited). Override per user in secrets:
+#   [sheets_read_budgets]
+#   Rahul = 300
+API_READ_BUDGET_DEFAULT = int(os.environ.get("SHEETS_READ_BUDGET_PER_MIN", "120"))
+
+@st.cache_resource(show_spinner=False)
+def read_budget_exceeded():
+    """The exception class for an exhausted read budget. It subclasses gspread's base
+    exception so pages handle it like any API error; it is built on first use so that
+    gspread is not imported for the login page."""
+    class ReadBudgetExceeded(gspread.exceptions.GSpreadException):
+        """Raised instead of calling the API when a user has used up their read budget."""
+    return ReadBudgetExceeded
+
+def classify_api_call(method, url):
+    """Maps an HTTP request of the Sheets / Drive API to an operation type."""
+    method = method.upper()
+    if "googleapis.com/drive" in url:
+        return "drive"
+    if ":append" in url:
+        return "append"
+    if "values:batchGet" in url or (method == "GET" and "/values/" in url):
+        return "read"
+    if "values:batchClear" in url or url.endswith(":clear"):
+        return "clear"
+    if "values:batchUpdate" in url or (method == "PUT" and "/values/" in url):
+        return "write"
+    if ":batchUpdate" in url:
+        return "structure"
+    return "metadata" if method == "GET" else "other"
+
+class ApiLedger:
+    """Sliding-window log of API calls with per-user read counters for budgeting."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = collections.deque() # (ts, session, user, page, op, bytes_sent, bytes_received)
+        self.user_reads = {}              # user -> deque of read timestamps within the last minute
+        self.context = threading.local()  # Streamlit runs each session's script in its own thread
+
+    def set_context(self, session, user, page):
+        self.context.tags = (session, user, page)
+
+    def tags(self):
+        return getattr(self.context, "tags", ("background", "system", "background"))
+
+    def _trim(self, now):
+        while self.events and self.events[0][0] < now - API_LEDGER_RETENTION:
+            self.events.popleft()
+
+    def check_budget(self, user, op):
+        if op not in API_READ_OPS or user == "system":
+            return
+        budget = read_budget(user)
+        if not budget:
+            return
+        now = time.time()
+        with self.lock:
+            reads = self.user_reads.setdefault(user, collections.deque())
+            while reads and reads[0] < now - 60:
+                reads.popleft()
+            if len(reads) >= budget:
+                self.events.append((now, *self.tags(), "throttled", 0, 0))
+                raise read_budget_exceeded()(
+                    f"Google Sheets read budget exceeded for '{user}' ({budget} reads/min). Please wait a minute."
+                )
+
+    def record(self, op, bytes_sent, bytes_received):
+        now = time.time()
+        session, user, page = self.tags()
+        with self.lock:
+            self.events.append((now, session, user, page, op, bytes_sent, bytes_received))
+            if op in API_READ_OPS:
+                self.user_reads.setdefault(user, collections.deque()).append(now)
+            self._trim(now)
+
+    def frame(self, seconds):
+        """Calls of the last `seconds` as a DataFrame."""
+        cutoff = time.time() - seconds
+        with self.lock:
+            rows = [e for e in self.events if e[0] >= cutoff]
+        return pd.DataFrame(rows, columns=["ts", "Session", "User", "Page", "Operation", "Bytes Sent", "Bytes Received"])
+
+    def reads_last_minute(self, user):
+        cutoff = time.time() - 60
+        with self.lock:
+            return sum(1 for ts in self.user_reads.get(user, ()) if ts >= cutoff)
+
+@st.cache_resource(show_spinner=False)
+def get_api_ledger():
+    return ApiLedger()
+
+def read_budget(user):
+    try:
+        overrides = st.secrets.get("sheets_read_budgets", {})
+    except Exception: # No secrets file (e.g. in tests)
+        overrides = {}
+    return int(overrides.get(user, API_READ_BUDGET_DEFAULT))
+
+def instrument_client(client):
+    """Routes every HTTP request of a gspread client through the API ledger."""
+    ledger = get_api_ledger()
+    http = client.http_client
+    send = http.request
+
+    def accounted_request(method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        op = classify_api_call(method, endpoint)
+        ledger.check_budget(ledger.tags()[1], op)
+        bytes_sent = len(data or b"") + (len(_json_dumps(json)) if json is not None else 0)
+        try:
+            response = send(method, endpoint, params=params, data=data, json=json, files=files, headers=headers)
+        except gspread.exceptions.APIError as e:
+            ledger.record(op, bytes_sent, len(e.response.content or b""))
+            raise
+        ledger.record(op, bytes_sent, len(response.content or b""))
+        return response
+
+    http.request = accounted_request
+    return client
+
+def _json_dumps(body):
+    return json.dumps(body, default=str).encode()
+
+def set_api_context(page):
+    """Tags the API calls of this rerun with the session, user and page."""
+    session = st.session_state.setdefault("session_tag", uuid.uuid4().hex[:8])
+    get_api_ledger().set_context(session, st.session_state.get("username", "anonymous"), page)
+
+# -------------------- PROJECTS --------------------
+# One deployment serves every rig project. A project is a set of workbooks and the
+# service-account secret that opens them, listed in projects.json (or the file
+# named by APP_PROJECTS_FILE):
+#   {"rig-12": {"name": "Rig 12", "observation": "<url>", "permit": "<url>", "equipment": "<url>",
+#               "credentials": "gcp_service_account_rig12", "users": ["user"]}}
+# "credentials" names an st.secrets entry (default gcp_service_account) and "users"
+# limits who may open the project (admins open all). Without the file the app
+# serves one "default" project, the workbooks above. Each session works in one
+# project, chosen in the sidebar; every cached loader takes the project as its
+# first argument so projects never share rows and each can be evicted alone.
+PROJECTS_FILE = os.environ.get("APP_PROJECTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "projects.json"))
+DEFAULT_PROJECT = "default"
+DEFAULT_CREDENTIALS = "gcp_service_account"
+PROJECT_WORKBOOKS = ("observation", "permit", "equipment")
+
+class ProjectRegistry:
+    """The configured projects, and the project each script thread is working in."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.context = threading.local() # Like the API ledger tags: one project per running script
+        self.last_used = {}              # project -> last time a session worked in it
+        try:
+            with open(PROJECTS_FILE) as f:
+                self.projects = json.load(f)
+        except FileNotFoundError:
+            self.projects = {DEFAULT_PROJECT: {
+                "name": "Default", "observation": OBSERVATION_URL, "permit": PERMIT_URL, "equipment": EQUIPMENT_URL,
+            }}
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"Projects could not be loaded: {os.path.basename(PROJECTS_FILE)}: {e}")
+        for project, spec in self.projects.items():
+            missing = [workbook for workbook in PROJECT_WORKBOOKS if not spec.get(workbook)]
+            if not re.fullmatch(r"[a-z0-9_-]+", project) or missing:
+                raise RuntimeError(f"Projects could not be loaded: '{project}' needs a lower-case id and {', '.join(PROJECT_WORKBOOKS)}")
+
+    def name(self, project):
+        return self.projects[project].get("name", project)
+
+    def available(self, user, role):
+        """The projects `user` may open, in file order."""
+        return [
+            project for project, spec in self.projects.items()
+            if role == "admin" or "users" not in spec or user in spec["users"]
+        ]
+
+    def current(self):
+        return getattr(self.context, "project", next(iter(self.projects)))
+
+    def use(self, project):
+        """Makes `project` the current one of this thread; returns the previous one."""
+        previous = getattr(self.context, "project", None)
+        self.context.project = project
+        return previous
+
+    def touch(self, project):
+        with self.lock:
+            self.last_used[project] = time.time()
+
+    def in_use(self, project):
+        """Whether a session has worked in `project` recently (see MEMORY_SESSION_RETENTION)."""
+        with self.lock:
+            return time.time() - self.last_used.get(project, 0) < MEMORY_SESSION_RETENTION
+
+@st.cache_resource(show_spinner=False)
+def get_project_registry():
+    return ProjectRegistry()
+
+def current_project():
+    return get_project_registry().current()
+
+@contextlib.contextmanager
+def project_scope(project):
+    """Runs a block against `project`, e.g. in a background thread or for a rollup."""
+    registry = get_project_registry()
+    previous = registry.use(project)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del registry.context.project
+        else:
+            registry.use(previous)
+
+def select_project():
+    """The project of this session: its sidebar choice among the projects the user may
+    open. Returns None when the user may open none."""
+    registry = get_project_registry()
+    projects = registry.available(st.session_state.get("username"), st.session_state.get("role"))
+    if not projects:
+        return None
+    if st.session_state.get("project") not in projects:
+        st.session_state["project"] = projects[0]
+    if len(projects) > 1:
+        st.sidebar.selectbox("Project", projects, format_func=registry.name, key="project", on_change=leave_project)
+    registry.use(st.session_state["project"])
+    registry.touch(st.session_state["project"])
+    return st.session_state["project"]
+
+def leave_project():
+    """A form submission waiting for a duplicate decision belongs to the project it was made in."""
+    for key in [key for key in st.session_state.keys() if str(key).startswith("pending_")]:
+        del st.session_state[key]
+
+def show_api_usage():
+    st.header("📡 Google Sheets API Usage")
+    window_label = st.radio("Window", list(API_WINDOWS), horizontal=True, key="api_window")
+    group_by = st.multiselect("Group by", ["User", "Page", "Operation", "Session"], default=["User", "Page", "Operation"], key="api_group")
+
+    @st.fragment(run_every=5)
+    def live_usage():
+        ledger = get_api_ledger()
+        df = ledger.frame(API_WINDOWS[window_label])
+        if df.empty:
+            st.info("No API calls in this window.")
+            return
+        calls = df[df["Operation"] != "throttled"]
+        kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+        kpi1.metric("API Calls", len(calls))
+        kpi2.metric("Reads", int(calls["Operation"].isin(API_READ_OPS).sum()))
+        kpi3.metric("MB Transferred", f"{(calls['Bytes Sent'].sum() + calls['Bytes Received'].sum()) / 1e6:.2f}")
+        kpi4.metric("Throttled", int((df["Operation"] == "throttled").sum()))
+
+        if group_by:
+            usage = df.groupby(group_by).agg(
+                Calls=("Operation", "size"), Bytes_Sent=("Bytes Sent", "sum"), Bytes_Received=("Bytes Received", "sum")
+            ).reset_index().sort_values("Calls", ascending=False)
+            st.dataframe(usage, use_container_width=True, hide_index=True)
+
+        per_minute = calls.assign(Minute=pd.to_datetime(calls["ts"], unit="s").dt.floor("min"))
+        per_minute = per_minute.groupby(["Minute", "User"]).size().reset_index(name="count")
+        fig = px.bar(per_minute, x="Minute", y="count", color="User", labels={"count": "API Calls"})
+        st.plotly_chart(fig, use_container_width=True)
+
+        st.write("**Read budgets (sliding minute)**")
+        users = sorted(set(USER_CREDENTIALS) | set(df["User"]) - {"system"})
+        st.dataframe(pd.DataFrame([
+            {"User": u, "Reads (last min)": ledger.reads_last_minute(u), "Budget / min": read_budget(u) or "unlimited"}
+            for u in users
+        ]), use_container_width=True, hide_index=True)
+
+    live_usage()
 
 # -------------------- GOOGLE SHEETS CONNECTION --------------------
+# Worksheets are opened one at a time, on demand, and cached separately, so a
+# page only connects to the workbooks it uses: the Permit form never opens the
+# equipment workbook. dataset -> (project workbook, tab or None for the first sheet, headers)
+WORKSHEETS = {
+    "observation": ("observation", None, None),
+    "permit": ("permit", None, None),
+    "equipment": ("equipment", HEAVY_EQUIP_TAB, HEAVY_EQUIP_HEADERS),
+    "vehicle": ("equipment", HEAVY_VEHICLE_TAB, HEAVY_VEHICLE_HEADERS),
+}
+
 @st.cache_resource(ttl=600) # Cache for 10 minutes
-def get_sheets():
-    """Connects to Google Sheets and returns worksheet objects."""
+def get_sheets_client(credentials=DEFAULT_CREDENTIALS):
+    """One authorized client per service account, shared by every session and every
+    project that uses that account."""
     creds = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"],
+        st.secrets[credentials],
         scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
     )
-    client = gspread.authorize(creds)
-
-    obs_sheet = client.open_by_url(OBSERVATION_URL).sheet1
-    permit_sheet = client.open_by_url(PERMIT_URL).sheet1
-    wb = client.open_by_url(EQUIPMENT_URL)
-
-    def get_or_create(ws_title, headers=None):
+    return instrument_client(gspread.authorize(creds))
+
+@st.cache_resource(ttl=600)
+def get_workbook(credentials, url):
+    return get_sheets_client(credentials).open_by_url(url)
+
+def project_workbook(project, dataset):
+    """The workbook holding `dataset` in `project`."""
+    spec = get_project_registry().projects[project]
+    return get_workbook(spec.get("credentials", DEFAULT_CREDENTIALS), spec[WORKSHEETS[dataset][0]])
+
+@st.cache_resource(ttl=600)
+def get_worksheet(project, dataset):
+    """Opens the worksheet of a dataset, creating a missing tab and fixing its header row."""
+    _, tab, headers = WORKSHEETS[dataset]
+    with timed(f"sheets.connect.{dataset}"):
+        if tab is None:
+            return list_shards(project, dataset)[-1] # Logs write to their newest shard
+        wb = project_workbook(project, dataset)
         try:
-            ws = wb.worksheet(ws_title)
+            ws = wb.worksheet(tab)
         except gspread.exceptions.WorksheetNotFound:
             # Create sheet if it doesn't exist and append headers
-            ws = wb.add_worksheet(title=ws_title, rows="1000", cols="40")
-            if headers:
-                ws.append_row(headers)
+            ws = wb.add_worksheet(title=tab, rows="1000", cols="40")
+            ws.append_row(headers)
+        # FIX: Ensure headers are correct for existing sheets
+        if ensure_headers_match(ws, headers):
+            # Only this sheet's cached read was made with the old header; nothing else is cleared
+            load_sheet_frame.clear(None, project, dataset)
         return ws
-    
-    # MODIFIED: Removed "F.E TP expiry" from the headers list
-    heavy_equip_headers = [
-        "Equipment type", "Make", "Palte No.", "Asset code", "Owner", "T.P inspection date", "T.P Expiry date",
-        "Insurance expiry date", "Operator Name", "Iqama NO", "T.P Card type", "T.P Card Number",
-        "T.P Card expiry date", "Q.R code", "PWAS status",
-        "FA box Status", "Documents"
-    ]
 
-    heavy_vehicle_headers = [
-        "Vehicle Type", "Make", "Plate No", "Asset Code", "Owner", "MVPI Expiry date", "Insurance Expiry",
-        "Driver Name", "Iqama No", "Licence Expiry", "Q.R code", "F.A Box",
-        "PWAS Status", "Seat belt damaged", "Tyre Condition",
-        "Suspension Systems", "Remarks"
-    ]
+def get_sheets(*datasets):
+    """Worksheets of the current project for the given datasets, in the same order."""
+    sheets = [get_worksheet(current_project(), dataset) for dataset in datasets]
+    show_sheet_notices()
+    return sheets
+
+# -------------------- LOG SHARDS --------------------
+# The observation and permit logs roll over to a new tab of their workbook
+# ("Observation 2026-Q4", ...) once the active one holds SHARD_MAX_ROWS rows, as
+# reads and writes slow down as a sheet grows. The new tab copies the header row.
+# Closed shards are read once more, sealed whole into the local archive and never
+# fetched again; only the small active shard is re-read. Row keys stay unique
+# across shards: row r of shard k is k * SHARD_ROW_STRIDE + r (shard 0 is the
+# first sheet, so its keys are plain sheet rows).
+SHARD_MAX_ROWS = int(os.environ.get("APP_SHARD_MAX_ROWS", "50000"))
+SHARD_PERIOD = os.environ.get("APP_SHARD_PERIOD", "quarter") # "quarter" or "year": how new tabs are named
+SHARD_ROW_STRIDE = 10_000_000 # Well above the rows a Google Sheet can hold
+
+@st.cache_resource(ttl=600)
+def list_shards(project, dataset):
+    """The worksheets of a log, oldest first: the workbook's first sheet, then its
+    rollover tabs. The last one is the active shard."""
+    pattern = re.compile(rf"^{dataset.title()} (\d{{4}})(?:-Q(\d))?(?: \((\d+)\))?$")
+    worksheets = project_workbook(project, dataset).worksheets()
+    rolled = []
+    for ws in worksheets[1:]:
+        match = pattern.match(ws.title)
+        if match:
+            year, quarter, copy = match.groups()
+            rolled.append(((int(year), int(quarter or 0), int(copy or 1)), ws))
+    return [worksheets[0]] + [ws for _, ws in sorted(rolled, key=lambda item: item[0])]
+
+def shard_title(dataset, shards):
+    """Title for a new shard of the current period, e.g. 'Permit 2026-Q4' or 'Permit 2026 (2)'."""
+    today = date.today()
+    title = f"{dataset.title()} {today.year}"
+    if SHARD_PERIOD == "quarter":
+        title += f"-Q{(today.month - 1) // 3 + 1}"
+    taken = {ws.title for ws in shards}
+    copy = 1
+    candidate = title
+    while candidate in taken:
+        copy += 1
+        candidate = f"{title} ({copy})"
+    return candidate
+
+def split_row(row):
+    """(shard, sheet row) of a row key."""
+    return divmod(int(row), SHARD_ROW_STRIDE)
+
+def row_label(dataset, row):
+    """A row key as users see it: the sheet row, plus the tab for rolled-over shards."""
+    shard, sheet_row = split_row(row)
+    if not shard:
+        return str(sheet_row)
+    shards = list_shards(current_project(), dataset)
+    return f"{sheet_row} of '{shards[shard].title}'" if shard < len(shards) else str(sheet_row)
+
+def writable_sheet(sheet, dataset, n_rows=1):
+    """The worksheet `n_rows` new rows should be appended to: `sheet`, unless they
+    would take the active shard of a log past SHARD_MAX_ROWS."""
+    if dataset not in LOG_DATASETS:
+        return sheet
+    manifest, tail = sync_log(sheet, dataset)
+    active = active_shard(dataset, manifest) # `sheet` may be a tab closed since it was opened
+    used_rows = split_row(tail.index.max())[1] if len(tail) else manifest["rows_archived"] + 1
+    if used_rows <= 1 or used_rows + n_rows <= SHARD_MAX_ROWS:
+        return active # An empty shard takes any import, however large
+    return roll_over(active, dataset)
+
+def active_shard(dataset, manifest):
+    """The shard the archive's high-water mark is in, which sync_log keeps the newest."""
+    project = current_project()
+    shards = list_shards(project, dataset)
+    if manifest["shard"] >= len(shards): # Listed before another session rolled over
+        list_shards.clear(project, dataset)
+        shards = list_shards(project, dataset)
+    return shards[manifest["shard"]]
+
+def roll_over(sheet, dataset):
+    """Opens a new shard with the header of `sheet` and returns it."""
+    project = current_project()
+    with archive_lock():
+        list_shards.clear(project, dataset)
+        try:
+            shards = list_shards(project, dataset)
+            if shards[-1].title != sheet.title:
+                return shards[-1] # Another session rolled over already
+            header = sheet.row_values(1)
+            with timed(f"sheets.write.{dataset}"):
+                ws = project_workbook(project, dataset).add_worksheet(
+                    title=shard_title(dataset, shards), rows="1000", cols=str(len(header))
+                )
+                ws.append_row(header)
+                # The cell limit is per workbook: the closed tab gives back its unused columns
+                if sheet.col_count > len(header):
+                    sheet.resize(cols=len(header))
+            return ws
+        finally:
+            # Whatever failed above, no cached handle may keep pointing at a closed tab
+            list_shards.clear(project, dataset)
+            get_worksheet.clear(project, dataset)
+
+# -------------------- SHARED FRAMES & MEMORY BUDGET --------------------
+# Loaded sheets and archive partitions are held once per process (st.cache_resource)
+# and are read-only. Sessions work on shallow copy-on-write views of them, so a
+# column assigned by one page is copied alone and never reaches the shared frame.
+# Frames derived from them (a date range, a filtered log, a cleaned register) are
+# shared too, through a byte-sized LRU that is trimmed under memory pressure.
+MEMORY_BUDGET_MB = int(os.environ.get("APP_MEMORY_BUDGET_MB", "1536")) # Process RSS above which derived frames are evicted
+DERIVED_CACHE_MB = int(os.environ.get("APP_DERIVED_CACHE_MB", "256"))  # Cap on all cached derived frames
+SESSION_DERIVED_MB = int(os.environ.get("APP_SESSION_DERIVED_MB", "64")) # Derived frames used by one session alone
+MEMORY_SESSION_RETENTION = 3600 # Seconds an idle session stays in the memory view
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+def shared_view(df):
+    """A session's handle on a shared frame; writing to it copies only what is written."""
+    return df.copy(deep=False)
+
+def process_rss_bytes():
+    """Resident memory of the server process (0 where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+class DerivedCache:
+    """Process-wide LRU of frames derived from shared frames, sized in bytes.
+
+    An entry stays valid while the frames it was computed from (`sources`) are
+    still the cached ones, so re-reading a sheet invalidates what was derived
+    from it. Keys are scoped to the current project. Each entry remembers which
+    sessions used it, for the memory view and the per-session budget.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict() # key -> {"frame", "sources", "bytes", "sessions"}
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, sources, compute):
+        key = (current_project(), *key)
+        session = get_api_ledger().tags()[0]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and all(ref() is src for ref, src in zip(entry["sources"], sources)):
+                self.entries.move_to_end(key)
+                entry["sessions"][session] = time.time()
+                self.hits += 1
+                return shared_view(entry["frame"])
+        frame = compute()
+        with self.lock:
+            self.misses += 1
+            self._drop(key)
+            self.entries[key] = {
+                "frame": frame,
+                "sources": [weakref.ref(src) for src in sources],
+                "bytes": frame_bytes(frame),
+                "sessions": {session: time.time()},
+            }
+            self.bytes += self.entries[key]["bytes"]
+            self._evict(key, session)
+        return shared_view(frame)
+
+    def drop_source(self, frame):
+        """Drops the entries derived from `frame`, after it was patched in place."""
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if any(ref() is frame for ref in e["sources"])]:
+                self._drop(key)
+
+    def drop_project(self, project):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == project]:
+                self._drop(key)
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry["bytes"]
+        return entry
+
+    def _evict(self, keep, session):
+        """Trims the cache after an insert, oldest entries first: stale entries, then what
+        only this session uses beyond its share, then everything beyond the overall cap
+        (half the cap while the process is over its memory budget)."""
+        for key, entry in list(self.entries.items()):
+            if any(ref() is None for ref in entry["sources"]):
+                self._drop(key)
+        own = [k for k, e in self.entries.items() if k != keep and list(e["sessions"]) == [session]]
+        own_bytes = sum(self.entries[k]["bytes"] for k in own) + self.entries[keep]["bytes"]
+        for key in own:
+            if own_bytes <= SESSION_DERIVED_MB * 1e6:
+                break
+            own_bytes -= self._drop(key)["bytes"]
+            self.evictions += 1
+        limit = DERIVED_CACHE_MB * 1e6
+        if MEMORY_BUDGET_MB and process_rss_bytes() > MEMORY_BUDGET_MB * 1e6:
+            limit /= 2
+        for key in [k for k in self.entries if k != keep]:
+            if self.bytes <= limit:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.evictions += len(self.entries)
+            self.entries.clear()
+            self.bytes = 0
+
+    def session_bytes(self):
+        """session -> (bytes of entries only it uses, bytes of entries it shares with others)."""
+        usage = collections.defaultdict(lambda: [0, 0])
+        with self.lock:
+            for entry in self.entries.values():
+                for session in entry["sessions"]:
+                    usage[session][0 if len(entry["sessions"]) == 1 else 1] += entry["bytes"]
+        return usage
+
+class MemoryLedger:
+    """Shared frames by name, and the session-state footprint of each session."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shared = weakref.WeakValueDictionary() # name -> frame held by a cache_resource
+        self.sessions = {} # session -> (user, page, state bytes, last seen)
+
+    def register(self, name, df):
+        with self.lock:
+            self.shared[f"{current_project()} · {name}"] = df
+        return df
+
+    def record_session(self, state_bytes):
+        session, user, page = get_api_ledger().tags()
+        now = time.time()
+        with self.lock:
+            self.sessions[session] = (user, page, state_bytes, now)
+            for stale in [s for s, v in self.sessions.items() if v[3] < now - MEMORY_SESSION_RETENTION]:
+                del self.sessions[stale]
+
+@st.cache_resource(show_spinner=False)
+def get_derived_cache():
+    return DerivedCache()
+
+@st.cache_resource(show_spinner=False)
+def get_memory_ledger():
+    return MemoryLedger()
+
+def session_state_bytes():
+    """Approximate size of what this session keeps in st.session_state."""
+    total = 0
+    for key in list(st.session_state.keys()):
+        value = st.session_state[key]
+        is_frame = "pandas" in sys.modules and isinstance(value, pd.DataFrame) # Never imports pandas just to measure
+        total += frame_bytes(value) if is_frame else sys.getsizeof(value)
+    return total
+
+def show_memory_usage():
+    st.header("🧠 Memory Usage")
+    ledger, derived = get_memory_ledger(), get_derived_cache()
+    with ledger.lock:
+        shared = [(name, len(df), frame_bytes(df)) for name, df in list(ledger.shared.items())]
+        sessions = dict(ledger.sessions)
+    rss = process_rss_bytes()
+
+    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+    kpi1.metric("Process RSS", f"{rss / 1e6:.0f} MB", delta=f"budget {MEMORY_BUDGET_MB} MB", delta_color="off")
+    kpi2.metric("Shared Frames", f"{sum(s[2] for s in shared) / 1e6:.1f} MB")
+    kpi3.metric("Derived Cache", f"{derived.bytes / 1e6:.1f} MB", delta=f"cap {DERIVED_CACHE_MB} MB", delta_color="off")
+    kpi4.metric("Active Sessions", len(sessions))
+    st.caption(f"Derived cache: {derived.hits} hits · {derived.misses} misses · {derived.evictions} evictions")
+
+    st.write("**Sessions**")
+    derived_usage = derived.session_bytes()
+    st.dataframe(pd.DataFrame([
+        {
+            "Session": session, "User": user, "Page": page,
+            "Session State (MB)": round(state / 1e6, 3),
+            "Derived, Own (MB)": round(derived_usage[session][0] / 1e6, 2),
+            "Derived, Shared (MB)": round(derived_usage[session][1] / 1e6, 2),
+            "Last Seen": datetime.fromtimestamp(seen).strftime("%H:%M:%S"),
+        }
+        for session, (user, page, state, seen) in sorted(sessions.items(), key=lambda s: -s[1][3])
+    ]), use_container_width=True, hide_index=True)
+
+    col_shared, col_derived = st.columns(2)
+    with col_shared:
+        st.write("**Shared frames**")
+        st.dataframe(pd.DataFrame(shared, columns=["Frame", "Rows", "Bytes"]).sort_values("Bytes", ascending=False),
+                     use_container_width=True, hide_index=True)
+    with col_derived:
+        st.write("**Derived frames**")
+        with derived.lock:
+            entries = [(" · ".join(map(str, key)), e["bytes"], len(e["sessions"])) for key, e in derived.entries.items()]
+        st.dataframe(pd.DataFrame(entries, columns=["Key", "Bytes", "Sessions"]), use_container_width=True, hide_index=True)
+        if st.button("Evict derived frames"):
+            derived.clear()
+            st.rerun()
 
-    heavy_equip_sheet = get_or_create(HEAVY_EQUIP_TAB, headers=heavy_equip_headers)
-    heavy_vehicle_sheet = get_or_create(HEAVY_VEHICLE_TAB, headers=heavy_vehicle_headers)
+    registry = get_project_registry()
+    if len(registry.projects) > 1:
+        col_project, col_evict = st.columns([3, 1])
+        project = col_project.selectbox("Project caches", list(registry.projects), format_func=registry.name)
+        if col_evict.button("Evict project"):
+            evict_project(project)
+            project_rollup.clear(project)
+            st.rerun()
 
-    # FIX: Ensure headers are correct for existing sheets
-    ensure_headers_match(heavy_equip_sheet, heavy_equip_headers)
-    ensure_headers_match(heavy_vehicle_sheet, heavy_vehicle_headers)
+# -------------------- DATA CACHE & LOCAL ARCHIVE --------------------
+# The observation and permit logs are stored locally in monthly partitions.
+# Closed months are sealed into compressed, immutable parquet segments and are
+# never fetched from Google Sheets again; only the "hot" tail of the sheet
+# (rows after the last sealed row) is re-read. Frames are indexed by their
+# row key: the sheet row number, offset by the shard (see LOG SHARDS). Each
+# project keeps its own archive under .archive/projects/<project> (the default
+# project's stays at the top level).
+ARCHIVE_DIR = os.environ.get("APP_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".archive"))
+ARCHIVE_VERSION = 1
+SEAL_GRACE_DAYS = 3 # Late entries for last month can still arrive in the first days of a new month
+DATA_TTL = 300 # Seconds before the hot tail / fleet sheets are re-read
+
+LOG_DATASETS = ("observation", "permit")
+# Low-cardinality log columns, held as categoricals: a small code per row instead of
+# a string, sent to the browser as Arrow dictionary columns
+LOG_CATEGORY_COLUMNS = [
+    "WELL NO", "AREA", "OBSERVER NAME", "SUPERVISOR NAME", "DISCIPLINE", "CATEGORY", "CLASSIFICATION", "STATUS",
+    "DRILL SITE", "WORK LOCATION", "TYPE OF PERMIT", "PERMIT RECEIVER", "PERMIT ISSUER", "ACTIVITY",
+]
 
+@st.cache_resource
+def archive_lock():
+    """Process-wide lock for archive writes (module globals are re-created on every rerun)."""
+    return threading.Lock()
 
-    return obs_sheet, permit_sheet, heavy_equip_sheet, heavy_vehicle_sheet
-    
-# -------------------- LOGIN PAGE --------------------
-def login():
-    
-    # This assumes "login_bg.jpg" is in the SAME folder as "app.py"
-    IMG_PATH = "login_bg.jpg" 
+def project_dir():
+    """Local data of the current project."""
+    project = current_project()
+    return ARCHIVE_DIR if project == DEFAULT_PROJECT else os.path.join(ARCHIVE_DIR, "projects", project)
 
-    img_base64 = get_img_as_base64(IMG_PATH) # Try to get the image
-    
-    background_css = ""
-    if img_base64:
-        # Auto-detect file type
-        file_extension = os.path.splitext(IMG_PATH)[1].lower()
-        mime_type = file_extension[1:] # remove the dot
-        if mime_type == "jpg":
-            mime_type = "jpeg"
-
-        # Create the CSS for the background
-        background_css = f"""
+def _archive_path(dataset, *parts):
+    return os.path.join(project_dir(), dataset, *parts)
+
+def load_manifest(dataset):
+    """Returns the archive manifest of a dataset, or an empty one."""
+    try:
+        with open(_archive_path(dataset, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == ARCHIVE_VERSION:
+            manifest.setdefault("shard", 0) # Archives from before shards cover the first sheet
+            manifest.setdefault("rejected", [])
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": ARCHIVE_VERSION, "shard": 0, "rows_archived": 0, "partitions": {}, "rejected": []}
+
+def save_manifest(dataset, manifest):
+    """Writes the manifest atomically so readers never see a half-written file."""
+    os.makedirs(_archive_path(dataset), exist_ok=True)
+    tmp_path = _archive_path(dataset, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, _archive_path(dataset, "manifest.json"))
+
+def rows_to_frame(header, rows, first_row=2):
+    """Builds a DataFrame of Arrow-backed strings from raw sheet values, indexed by sheet row number."""
+    columns = [str(col).strip().upper() for col in header]
+    width = len(columns)
+    padded = [(list(r) + [""] * width)[:width] for r in rows]
+    index = pd.RangeIndex(first_row, first_row + len(padded), name="ROW")
+    return pd.DataFrame(padded, columns=columns, index=index)
+
+def clean_log_frame(df):
+    """Parses DATE, normalizes the categorical text columns of a log and encodes them."""
+    if 'DATE' not in df.columns:
+        return df
+    df['DATE'] = pd.to_datetime(df['DATE'], errors='coerce')
+    df.dropna(subset=['DATE'], inplace=True)
+    if 'CLASSIFICATION' in df.columns:
+        df['CLASSIFICATION'] = df['CLASSIFICATION'].str.strip().str.upper()
+    if 'STATUS' in df.columns:
+        df['STATUS'] = df['STATUS'].str.strip().str.capitalize()
+    for col in LOG_CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+def concat_logs(frames):
+    """pd.concat of log frames that keeps the categorical columns categorical.
+
+    Each partition has its own categories (and older ones plain strings), which
+    pd.concat would turn back into strings; they are recoded to the union first.
+    Empty frames (a hot tail with every row sealed, a new shard) add no rows and are
+    left out; their categories are object-typed where parquet's are strings.
+    """
+    frames = [df for df in frames if len(df)] or frames[-1:]
+    if len(frames) == 1:
+        return frames[0]
+    for col in LOG_CATEGORY_COLUMNS:
+        if not all(col in df.columns for df in frames):
+            continue
+        cats = [df[col].astype("category") for df in frames]
+        cats = [c.cat.rename_categories(c.cat.categories.astype(str)) for c in cats] # union_categoricals needs one category dtype
+        dtype = pd.CategoricalDtype(pd.api.types.union_categoricals(cats).categories)
+        frames = [df.assign(**{col: df[col].astype(dtype)}) for df in frames]
+    return pd.concat(frames)
+
+@st.cache_resource(ttl=DATA_TTL, show_spinner=False)
+def fetch_tail(_sheet, project, dataset, first_row, shard=0):
+    """Fetches the header and every row from sheet row `first_row` down, in one API
+    call. `_sheet` is shard number `shard` of the log. Returns (frame, rows read, raw
+    rows without a readable DATE); the frames are shared by all sessions.
+
+    The range starts one row early (the last archived row, or the header) so it
+    never begins outside the sheet's grid; that overlap row is dropped.
+    """
+    last_col = gspread.utils.rowcol_to_a1(1, _sheet.col_count).rstrip("1")
+    with timed(f"sheets.read.{dataset}"):
+        header, rows = _sheet.batch_get(["1:1", f"A{first_row - 1}:{last_col}"])
+    header = header[0] if header else []
+    rows = rows[1:]
+    with timed(f"{dataset}.clean"):
+        raw = rows_to_frame(header, rows, shard * SHARD_ROW_STRIDE + first_row)
+        df = clean_log_frame(shared_view(raw))
+        rejected = raw.loc[raw.index.difference(df.index)] # Quarantined, see DATA QUALITY
+    return get_memory_ledger().register(f"{dataset} · tail", df), len(rows), rejected
+
+@st.cache_resource(show_spinner=False)
+def read_partition(project, dataset, filename):
+    """Reads a sealed partition segment. Segments are immutable, so this is process-wide."""
+    with timed(f"{dataset}.read_partition"):
+        return get_memory_ledger().register(f"{dataset} · {filename}", pd.read_parquet(_archive_path(dataset, filename)))
+
+def read_segment(dataset, filename, columns=None):
+    """Reads a sealed segment, or only those of `columns` it has, without caching it: the
+    row indexes read each segment once, and keep their counts rather than the frame."""
+    path = _archive_path(dataset, filename)
+    if columns is not None:
+        names = set(pq.read_schema(path).names)
+        columns = [col for col in dict.fromkeys(columns) if col in names]
+    with timed(f"{dataset}.read_segment"):
+        return pd.read_parquet(path, columns=columns)
+
+def _sealed_month_cutoff():
+    """Months strictly before this 'YYYY-MM' key are considered closed."""
+    return (date.today() - timedelta(days=SEAL_GRACE_DAYS)).replace(day=1).strftime("%Y-%m")
+
+def seal_closed_months(dataset, manifest, tail, rejected, n_rows, shard_closed=False):
+    """Moves the leading run of closed-month rows from the hot tail into sealed partitions.
+
+    Only a prefix of the tail can be sealed, because the archive is tracked by a
+    single (shard, sheet row) high-water mark. The tail of a closed shard takes no
+    more rows, so it is sealed whole and the mark moves on to the next shard.
+    `rejected` rows (no readable DATE) below the mark are kept in their own segments.
+    Returns the updated manifest.
+    """
+    shard, rows_archived = manifest["shard"], manifest["rows_archived"]
+    first_row = shard * SHARD_ROW_STRIDE + rows_archived + 2
+    if shard_closed:
+        boundary = first_row + n_rows
+    elif n_rows == 0 or 'DATE' not in tail.columns:
+        return manifest
+    else:
+        open_rows = tail.index[tail['DATE'].dt.strftime("%Y-%m") >= _sealed_month_cutoff()]
+        boundary = int(open_rows[0]) if len(open_rows) else first_row + n_rows
+        if boundary == first_row:
+            return manifest
+
+    with archive_lock():
+        manifest = load_manifest(dataset)
+        if (manifest["shard"], manifest["rows_archived"]) != (shard, rows_archived):
+            return manifest # Another session sealed these rows already
+        sealed = tail[tail.index < boundary]
+        if 'DATE' not in sealed.columns:
+            sealed = sealed.iloc[:0].assign(DATE=pd.NaT) # A closed shard without a DATE header has nothing readable
+        for month, part in sealed.groupby(sealed['DATE'].dt.strftime("%Y-%m")):
+            segments = manifest["partitions"].setdefault(month, [])
+            filename = f"{month}.{len(segments)}.parquet"
+            os.makedirs(_archive_path(dataset), exist_ok=True)
+            part.to_parquet(_archive_path(dataset, filename), compression="zstd")
+            segments.append({
+                "file": filename,
+                "rows": len(part),
+                "min": part['DATE'].min().strftime("%Y-%m-%d"),
+                "max": part['DATE'].max().strftime("%Y-%m-%d"),
+                "first_row": int(part.index.min()), # Row keys held, so an edit opens only its segment
+                "last_row": int(part.index.max()),
+            })
+        unreadable = rejected[rejected.index < boundary]
+        if len(unreadable):
+            filename = f"rejected.{len(manifest['rejected'])}.parquet"
+            os.makedirs(_archive_path(dataset), exist_ok=True)
+            unreadable.to_parquet(_archive_path(dataset, filename), compression="zstd")
+            manifest["rejected"].append({"file": filename, "rows": len(unreadable)})
+        if shard_closed:
+            manifest["shard"], manifest["rows_archived"] = shard + 1, 0
+        else:
+            manifest["rows_archived"] = boundary - shard * SHARD_ROW_STRIDE - 2
+        save_manifest(dataset, manifest)
+    return manifest
+
+def sync_log(sheet, dataset):
+    """Brings the local archive up to date and returns (manifest, hot tail frame)."""
+    return sync_log_with_rejected(sheet, dataset)[:2]
+
+def sync_log_with_rejected(sheet, dataset):
+    """sync_log, plus the hot tail's rows without a readable DATE (see DATA QUALITY);
+    those below the archive's mark are in the manifest's "rejected" segments.
+
+    Shards closed since the last sync are read one last time and sealed. The hot
+    tail is read from the shard the manifest points at, not from `sheet`: a handle
+    opened before a rollover is a closed tab, and reading it as the active shard
+    would seal its rows a second time.
+    """
+    manifest = load_manifest(dataset)
+    project = current_project()
+    shards = list_shards(project, dataset)
+    while manifest["shard"] < len(shards) - 1:
+        closed = shards[manifest["shard"]]
+        tail, n_rows, rejected = fetch_tail(closed, project, dataset, manifest["rows_archived"] + 2, manifest["shard"])
+        manifest = seal_closed_months(dataset, manifest, tail, rejected, n_rows, shard_closed=True)
+    active = active_shard(dataset, manifest)
+    tail, n_rows, rejected = fetch_tail(active, project, dataset, manifest["rows_archived"] + 2, manifest["shard"])
+    sealed_manifest = seal_closed_months(dataset, manifest, tail, rejected, n_rows)
+    if sealed_manifest["rows_archived"] != manifest["rows_archived"]:
+        first_row = sealed_manifest["shard"] * SHARD_ROW_STRIDE + sealed_manifest["rows_archived"] + 2
+        tail, rejected = tail[tail.index >= first_row], rejected[rejected.index >= first_row]
+    return sealed_manifest, tail, rejected
+
+def log_date_bounds(manifest, tail):
+    """Earliest and latest dates across sealed partitions and the hot tail."""
+    mins, maxs = [], []
+    for segments in manifest["partitions"].values():
+        for seg in segments:
+            mins.append(date.fromisoformat(seg["min"]))
+            maxs.append(date.fromisoformat(seg["max"]))
+    if not tail.empty:
+        mins.append(tail['DATE'].min().date())
+        maxs.append(tail['DATE'].max().date())
+    if not mins:
+        return None, None
+    return min(mins), max(maxs)
+
+def load_log_range(dataset, manifest, tail, start, end):
+    """Returns the rows dated within [start, end], reading only overlapping partitions.
+
+    Sessions asking for the same range share one frame (see DerivedCache).
+    """
+    files = tuple(
+        seg["file"] for segments in manifest["partitions"].values() for seg in segments
+        if seg["max"] >= start.isoformat() and seg["min"] <= end.isoformat()
+    )
+
+    def compute():
+        df = concat_logs([read_partition(current_project(), dataset, f) for f in files] + [tail])
+        mask = (df['DATE'] >= pd.to_datetime(start)) & (df['DATE'] <= pd.to_datetime(end))
+        return df[mask].sort_values(by='DATE', ascending=False)
+
+    return get_derived_cache().get((dataset, "range", start, end, files), [tail], compute)
+
+def recent_log(sheet, dataset, days):
+    """(start, end, rows) of the last `days` days up to a log's latest entry: the
+    dashboard's default range. start and end are None for an empty log."""
+    manifest, tail = sync_log(sheet, dataset)
+    start, end = log_date_bounds(manifest, tail) if 'DATE' in tail.columns else (None, None)
+    if start is None:
+        return None, None, tail.iloc[:0]
+    start = max(start, end - timedelta(days=days))
+    return start, end, load_log_range(dataset, manifest, tail, start, end)
+
+@st.cache_resource(ttl=DATA_TTL, show_spinner=False)
+def load_sheet_frame(_sheet, project, dataset):
+    """Loads a whole (small) worksheet such as the equipment registers. The frame is
+    shared by all sessions and must not be modified; see load_fleet_frame."""
+    with timed(f"sheets.read.{dataset}"):
+        values = _sheet.get_all_values()
+    if not values:
+        return pd.DataFrame()
+    with timed(f"{dataset}.clean"):
+        return get_memory_ledger().register(f"{dataset} · sheet", rows_to_frame(values[0], values[1:]))
+
+# MODIFIED: Removed "F.E TP EXPIRY" from the equipment date columns
+FLEET_DATE_COLUMNS = {
+    "equipment": ["T.P EXPIRY DATE", "INSURANCE EXPIRY DATE", "T.P CARD EXPIRY DATE"],
+    "vehicle": ["MVPI EXPIRY DATE", "INSURANCE EXPIRY", "LICENCE EXPIRY"],
+}
+FLEET_CATEGORY_COLUMNS = {
+    "vehicle": ["PWAS STATUS", "TYRE CONDITION", "SUSPENSION SYSTEMS", "F.A BOX", "SEAT BELT DAMAGED", "VEHICLE TYPE"],
+}
+
+def load_fleet_frame(sheet, dataset):
+    """The equipment / vehicle register with parsed expiry dates and tidied categories."""
+    raw = load_sheet_frame(sheet, current_project(), dataset)
+
+    def clean():
+        df = shared_view(raw)
+        for col in FLEET_DATE_COLUMNS[dataset]:
+            if col in df.columns:
+                df[col] = parse_dates(df[col]).astype("date32[pyarrow]")
+        for col in FLEET_CATEGORY_COLUMNS.get(dataset, []):
+            if col in df.columns:
+                df[col] = df[col].str.strip().str.capitalize()
+        for col, namespace in CANONICAL_NAME_COLUMNS.items():
+            if col in df.columns:
+                df[col] = canonical_names(df[col], namespace)
+        return df
+
+    df = get_derived_cache().get((dataset, "clean", get_name_canonicalizer().version), [raw], clean)
+    record_compliance_snapshot(dataset, df)
+    return df
+
+def invalidate_dataset(dataset):
+    """Drops the current project's cached sheet read after a write so the next rerun sees the new row."""
+    project = current_project()
+    if dataset in LOG_DATASETS:
+        manifest = load_manifest(dataset)
+        fetch_tail.clear(None, project, dataset, manifest["rows_archived"] + 2, manifest["shard"])
+    else:
+        load_sheet_frame.clear(None, project, dataset)
+
+def evict_dataset(dataset):
+    """Drops the current project's worksheet, cached reads, partitions and row indexes of a dataset."""
+    project = current_project()
+    get_worksheet.clear(project, dataset)
+    list_shards.clear(project, dataset)
+    invalidate_dataset(dataset)
+    manifest = load_manifest(dataset)
+    for seg in [seg for segments in manifest["partitions"].values() for seg in segments] + manifest["rejected"]:
+        read_partition.clear(project, dataset, seg["file"])
+    for get_index in (get_record_locator, get_key_index, get_unique_key_index, get_asset_registry, get_site_day_index, get_trend_index, get_kpi_index, get_search_index):
+        get_index.clear(project, dataset)
+
+def evict_project(project):
+    """Drops everything cached from one project's data; other projects keep theirs."""
+    with project_scope(project):
+        for dataset in WORKSHEETS:
+            evict_dataset(dataset)
+    get_derived_cache().drop_project(project)
+
+def rebuild_archive(dataset):
+    """Discards the local archive of a dataset; it is rebuilt on the next sync."""
+    with archive_lock():
+        evict_dataset(dataset)
+        shutil.rmtree(_archive_path(dataset), ignore_errors=True)
+
+# -------------------- NAME CANONICALIZATION --------------------
+# Owners, operators / drivers and makes are typed freely in the fleet forms, so
+# "ABC Co.", "abc co" and "ABC CO " would be three owners. Each spelling is
+# normalized (case, accents, punctuation, legal-form suffixes, and word order
+# except in people's names) and maps to the first spelling seen of that key. A new
+# key that is merely close to a known one (a typo, "ABC Trading" vs "ABD Trading",
+# or a person's name with its words reordered, "Ali Ahmed" vs "Ahmed Ali") is not
+# merged: it is suggested, and an admin merges it or keeps it apart. The mapping is kept in
+# memory and in NAMES_FILE, so a sync only processes spellings never seen before.
+# The cleaned fleet frames carry the canonical names; the sheets keep what was typed.
+# NAMES_FILE is one file for every project, not one per project archive: the same
+# owners, operators and makes recur across projects, and a merge confirmed (or kept
+# apart) in one project applies to all of them.
+NAMES_FILE = os.path.join(ARCHIVE_DIR, "canonical_names.json")
+NAMES_VERSION = 3 # Bumped when name_key changes; older mappings are rebuilt from the sheets
+CANONICAL_NAME_COLUMNS = {"OWNER": "owner", "OPERATOR NAME": "person", "DRIVER NAME": "person", "MAKE": "make"}
+LEGAL_FORM_SUFFIXES = {"co", "company", "ltd", "limited", "llc", "wll", "inc", "corp", "plc"} # Not "trading", "contracting": they tell firms apart
+NAME_SUGGEST_CUTOFF = 0.9 # difflib ratio for two keys to be suggested as one entity
+NAME_MATCH_MIN_LENGTH = 6 # Shorter keys are never suggested
+
+def name_key(value, namespace):
+    """'ABC Co. ' -> 'abc'; 'ABC Trading W.L.L.' -> 'abc trading'; 'Trading ABC' -> 'abc trading';
+    a person's words keep their order, as 'Ali Ahmed' and 'Ahmed Ali' are two people: 'AHMED, Ali' -> 'ahmed ali'."""
+    text = unicodedata.normalize("NFKD", str(value)).encode("ascii", "ignore").decode().casefold()
+    words = re.sub(r"[^a-z0-9]+", " ", text.replace(".", "")).split() # "W.L.L." is one word
+    if namespace == "owner":
+        while len(words) > 1 and words[-1] in LEGAL_FORM_SUFFIXES:
+            words.pop()
+    return " ".join(words if namespace == "person" else sorted(words))
+
+class NameCanonicalizer:
+    """Spelling -> canonical name per namespace, memoized and persisted."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0 # Bumped on every confirmed merge; keys the cleaned fleet frames
+        try:
+            with open(NAMES_FILE) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        self.namespaces = saved.get("namespaces", {}) if saved.get("version") == NAMES_VERSION else {}
+        # namespace -> {"entities": {key: canonical name}, "spellings": {spelling: key},
+        #               "aliases": {merged key: key}, "suggestions": {key: key it looks like}}
+
+    def _space(self, namespace):
+        space = self.namespaces.setdefault(namespace, {})
+        for part in ("entities", "spellings", "aliases", "suggestions"):
+            space.setdefault(part, {})
+        return space
+
+    def resolve(self, namespace, spellings):
+        """{spelling: canonical name} for the given spellings."""
+        with self.lock:
+            space = self._space(namespace)
+            entities, known = space["entities"], space["spellings"]
+            added = False
+            for spelling in spellings:
+                if spelling in known:
+                    continue
+                key = name_key(spelling, namespace) or str(spelling).strip() # e.g. "-" has no words
+                key = space["aliases"].get(key, key)
+                if key not in entities:
+                    # The same words in another order (only people's names keep it)
+                    match = [k for k in entities if sorted(k.split()) == sorted(key.split())][:1]
+                    if not match and len(key) >= NAME_MATCH_MIN_LENGTH:
+                        match = difflib.get_close_matches(key, [k for k in entities if len(k) >= NAME_MATCH_MIN_LENGTH], n=1, cutoff=NAME_SUGGEST_CUTOFF)
+                    if match:
+                        space["suggestions"][key] = match[0]
+                entities.setdefault(key, " ".join(str(spelling).split()))
+                known[spelling] = key
+                added = True
+            if added:
+                self._save()
+            return {spelling: entities[known[spelling]] for spelling in spellings}
+
+    def suggestions(self):
+        """Keys that look like a known entity: rows of (namespace, key, name, target key, target name)."""
+        with self.lock:
+            return [
+                (namespace, key, space["entities"][key], target, space["entities"][target])
+                for namespace, space in self.namespaces.items()
+                for key, target in space.get("suggestions", {}).items()
+                if key in space["entities"] and target in space["entities"]
+            ]
+
+    def merge(self, namespace, key, target):
+        """Folds entity `key` into `target`, for its spellings now and any typed later."""
+        with self.lock:
+            space = self._space(namespace)
+            space["suggestions"].pop(key, None)
+            if key == target or target not in space["entities"]:
+                return
+            for spelling, k in space["spellings"].items():
+                if k == key:
+                    space["spellings"][spelling] = target
+            for merged, k in space["aliases"].items():
+                if k == key:
+                    space["aliases"][merged] = target
+            space["aliases"][key] = target
+            space["entities"].pop(key, None)
+            for other, k in list(space["suggestions"].items()):
+                if k == key:
+                    space["suggestions"][other] = target
+                if space["suggestions"][other] == other:
+                    del space["suggestions"][other]
+            self.version += 1
+            self._save()
+
+    def keep_apart(self, namespace, key):
+        with self.lock:
+            self._space(namespace)["suggestions"].pop(key, None)
+            self._save()
+
+    def _save(self):
+        with contextlib.suppress(OSError): # The mapping is rebuilt from the sheets if lost
+            os.makedirs(os.path.dirname(NAMES_FILE), exist_ok=True)
+            with open(NAMES_FILE + ".tmp", "w") as f:
+                json.dump({"version": NAMES_VERSION, "namespaces": self.namespaces}, f)
+            os.replace(NAMES_FILE + ".tmp", NAMES_FILE)
+
+    def merged(self):
+        """Entities written more than one way: rows of (namespace, canonical name, spellings)."""
+        with self.lock:
+            rows = []
+            for namespace, space in self.namespaces.items():
+                groups = collections.defaultdict(list)
+                for spelling, key in space["spellings"].items():
+                    groups[key].append(spelling)
+                rows += [(namespace, space["entities"][key], spellings) for key, spellings in groups.items() if len(spellings) > 1]
+            return rows
+
+@st.cache_resource(show_spinner=False)
+def get_name_canonicalizer():
+    return NameCanonicalizer()
+
+def canonical_names(series, namespace):
+    """`series` with each spelling replaced by its entity's canonical name (blanks stay blank)."""
+    spellings = [s for s in series.dropna().unique() if str(s).strip()]
+    mapping = get_name_canonicalizer().resolve(namespace, spellings)
+    return series.map(lambda value: mapping.get(value, value))
+
+def show_merged_names():
+    """Admin view of the spellings folded together, to check the matching, and of the
+    suggested merges waiting for a decision."""
+    canonicalizer = get_name_canonicalizer()
+    rows, suggestions = canonicalizer.merged(), canonicalizer.suggestions()
+    label = f"🔤 Merged name spellings ({len(rows)})" + (f" · {len(suggestions)} to confirm" if suggestions else "")
+    with st.expander(label):
+        for namespace, key, name, target, target_name in suggestions:
+            col_text, col_merge, col_apart = st.columns([4, 1, 1])
+            col_text.markdown(f"{namespace.title()} **{name}** looks like **{target_name}**")
+            if col_merge.button("Merge", key=f"name_merge_{namespace}_{key}"):
+                canonicalizer.merge(namespace, key, target)
+                st.rerun()
+            if col_apart.button("Keep apart", key=f"name_apart_{namespace}_{key}"):
+                canonicalizer.keep_apart(namespace, key)
+                st.rerun()
+        if not rows:
+            st.info("No names have been written more than one way yet.")
+            return
+        st.dataframe(pd.DataFrame(
+            [(namespace.title(), name, " | ".join(sorted(spellings))) for namespace, name, spellings in sorted(rows)],
+            columns=["Kind", "Shown as", "Spellings"]
+        ), use_container_width=True, hide_index=True)
+
+# -------------------- FLEET COMPLIANCE HISTORY --------------------
+# Once a day, on the first load of a fleet register that day, the document expiry
+# dates of every asset are compared with the previous snapshot and only the changes
+# are appended to compliance/<dataset>.jsonl in the project's archive. Whether a
+# document was expired on a past date follows from the expiry dates in force on
+# that date, so any day is reconstructed by replaying the deltas up to it; no daily
+# copies of the registers are kept.
+EXPIRING_SOON_DAYS = 30
+
+def _compliance_path(dataset):
+    return os.path.join(project_dir(), "compliance", f"{dataset}.jsonl")
+
+def compliance_state(df, dataset):
+    """{asset: {document: 'YYYY-MM-DD' or None}} of a cleaned register. Assets are keyed
+    by plate, else asset code, else sheet row; a plate entered twice keeps its last row."""
+    fields = REGISTRY_FIELDS[dataset]
+    blank = pd.Series("", index=df.index)
+    plates = df[fields["plate"]].map(normalize_key) if fields["plate"] in df.columns else blank
+    assets = df[fields["asset"]].map(normalize_key) if fields["asset"] in df.columns else blank
+    docs = [col for col in FLEET_DATE_COLUMNS[dataset] if col in df.columns]
+    state = {}
+    for row, plate, asset, *expiries in zip(df.index, plates, assets, *(df[col] for col in docs)):
+        expiries = [as_date(d) for d in expiries] # A Timestamp's isoformat() would add "T00:00:00"
+        state[plate or asset or f"ROW {row}"] = {doc: d.isoformat() if d else None for doc, d in zip(docs, expiries)}
+    return state
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _read_compliance_deltas(path, mtime_ns):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def load_compliance_deltas(dataset):
+    """The day-by-day changes recorded for a register, oldest first. Treat as read-only."""
+    try:
+        path = _compliance_path(dataset)
+        return _read_compliance_deltas(path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        return []
+
+def apply_compliance_delta(state, delta):
+    for asset in delta["drop"]:
+        state.pop(asset, None)
+    for asset, docs in delta["set"].items():
+        state[asset] = {**state.get(asset, {}), **docs}
+
+def record_compliance_snapshot(dataset, df):
+    """Appends the changes since the last snapshot to the compliance history, at most once a day."""
+    today_key = date.today().isoformat()
+    deltas = load_compliance_deltas(dataset)
+    if deltas and deltas[-1]["date"] >= today_key:
+        return
+    with archive_lock():
+        deltas = load_compliance_deltas(dataset)
+        if deltas and deltas[-1]["date"] >= today_key:
+            return # Another session recorded today's snapshot already
+        previous = {}
+        for delta in deltas:
+            apply_compliance_delta(previous, delta)
+        current = compliance_state(df, dataset)
+        changed = {}
+        for asset, docs in current.items():
+            before = previous.get(asset, {})
+            diff = {doc: value for doc, value in docs.items() if doc not in before or before[doc] != value}
+            if diff:
+                changed[asset] = diff
+        delta = {"date": today_key, "set": changed, "drop": sorted(previous.keys() - current.keys())}
+        os.makedirs(os.path.dirname(_compliance_path(dataset)), exist_ok=True)
+        # One line per day, even when nothing changed, marks the day as recorded
+        with open(_compliance_path(dataset), "a") as f:
+            f.write(json.dumps(delta, separators=(",", ":")) + "\n")
+
+def compliance_trend(dataset, as_of_dates):
+    """Expired and expiring-soon documents per document type on each of `as_of_dates`
+    (ascending), replayed from the deltas. Dates before the first snapshot are skipped."""
+    deltas = load_compliance_deltas(dataset)
+    state, rows, i = {}, [], 0
+    for as_of in as_of_dates:
+        key = as_of.isoformat()
+        while i < len(deltas) and deltas[i]["date"] <= key:
+            apply_compliance_delta(state, deltas[i])
+            i += 1
+        if i == 0:
+            continue
+        soon_key = (as_of + timedelta(days=EXPIRING_SOON_DAYS)).isoformat()
+        counts = collections.defaultdict(lambda: [0, 0])
+        for docs in state.values():
+            for doc, expiry in docs.items():
+                if expiry is None:
+                    continue
+                counts[doc][0] += expiry < key
+                counts[doc][1] += key <= expiry <= soon_key
+        rows += [(pd.Timestamp(as_of), doc, expired, soon, len(state)) for doc, (expired, soon) in counts.items()]
+    return pd.DataFrame(rows, columns=["DATE", "DOCUMENT", "EXPIRED", "EXPIRING SOON", "ASSETS"])
+
+def show_compliance_history(dataset, label):
+    """Trend of expired documents on the 1st of each month (or every day), for audits."""
+    deltas = load_compliance_deltas(dataset)
+    st.subheader("📈 Compliance History")
+    if not deltas:
+        st.info(f"No {label} compliance snapshots recorded yet; the first is taken today.")
+        return
+    first_day, today = date.fromisoformat(deltas[0]["date"]), date.today()
+    col_range, col_step = st.columns(2)
+    history_range = col_range.date_input(
+        "History range", (max(first_day, today - timedelta(days=365)), today),
+        min_value=first_day, max_value=today, key=f"{dataset}_history_range"
+    )
+    step = col_step.radio("Points", ["1st of each month", "Every day"], horizontal=True, key=f"{dataset}_history_step")
+    start, end = history_range if len(history_range) == 2 else (first_day, today)
+    days = pd.date_range(start, end, freq="D" if step == "Every day" else "MS").date
+    if step != "Every day":
+        days = sorted({start, end, *days})
+
+    trend = compliance_trend(dataset, days)
+    if trend.empty:
+        st.info("No snapshots fall within the selected range.")
+        return
+    fig_history = px.line(
+        trend, x='DATE', y='EXPIRED', color='DOCUMENT', markers=True,
+        title=f"Expired {label} Documents Over Time",
+        labels={'EXPIRED': 'Expired Documents', 'DATE': 'As of', 'DOCUMENT': 'Document'}
+    )
+    st.plotly_chart(fig_history, use_container_width=True)
+    table = trend.pivot_table(index='DATE', columns='DOCUMENT', values=['EXPIRED', 'EXPIRING SOON'], aggfunc='sum')
+    table.columns = [f"{doc} · {'expired' if kind == 'EXPIRED' else 'expiring ≤30d'}" for kind, doc in table.columns]
+    table.insert(0, "ASSETS", trend.groupby('DATE')['ASSETS'].first())
+    table.index = table.index.strftime("%d-%b-%Y")
+    st.dataframe(table.rename_axis("AS OF").reset_index(), use_container_width=True, hide_index=True)
+    st.caption(f"Reconstructed from {len(deltas)} daily snapshots of changes since {first_day:%d-%b-%Y}.")
+
+# -------------------- ROW INDEXES --------------------
+class RowIndex:
+    """Base for process-wide indexes over a dataset, keyed by sheet row number.
+
+    Subclasses turn each row into a hashable document (`_docs`) and implement
+    `_add` / `_remove`. Sealed partitions are indexed once per process, reading only
+    the columns `_docs` uses (`_source_columns`) and without caching the frame; rows
+    of the hot tail, or of a whole small sheet, are re-indexed only when they change.
+    """
+
+    def __init__(self):
+        self.segments = set()   # sealed partition files already indexed
+        self.live_docs = {}     # row -> document of hot-tail / small-sheet rows currently indexed
+        self.lock = threading.RLock()
+
+    def _docs(self, df):
+        raise NotImplementedError
+
+    def _add(self, row, doc):
+        raise NotImplementedError
+
+    def _remove(self, row):
+        raise NotImplementedError
+
+    def _source_columns(self):
+        """Columns `_docs` reads (None for all)."""
+        return None
+
+    def sync(self, dataset, manifest, tail):
+        """Indexes new sealed segments of a log and any hot-tail rows that changed."""
+        with self.lock:
+            for segments in manifest["partitions"].values():
+                for seg in segments:
+                    if seg["file"] in self.segments:
+                        continue
+                    try:
+                        part = read_segment(dataset, seg["file"], self._source_columns())
+                    except FileNotFoundError: # Just replaced by an edit; indexed under its new name next sync
+                        continue
+                    for row, doc in self._docs(part).items():
+                        self.live_docs.pop(row, None)
+                        self._remove(row)
+                        self._add(row, doc)
+                    self.segments.add(seg["file"])
+            self.sync_frame(tail)
+
+    def update_rows(self, df):
+        """Re-indexes rows that were edited in place, whether sealed or in the hot tail."""
+        with self.lock:
+            for row, doc in self._docs(df).items():
+                self._remove(row)
+                self._add(row, doc)
+                if row in self.live_docs:
+                    self.live_docs[row] = doc
+
+    def rename_segment(self, old, new):
+        """A sealed segment rewritten under a new name (see patch_cached_rows) stays indexed."""
+        with self.lock:
+            if old in self.segments:
+                self.segments.discard(old)
+                self.segments.add(new)
+
+    def sync_frame(self, df):
+        """Re-indexes the rows of `df` that changed and drops rows no longer present."""
+        with self.lock:
+            docs = self._docs(df)
+            current = dict(zip(docs.index, docs.values))
+            for row in [r for r in self.live_docs if r not in current]:
+                self._remove(row)
+                del self.live_docs[row]
+            for row, doc in current.items():
+                if self.live_docs.get(row) != doc:
+                    self._remove(row)
+                    self._add(row, doc)
+                    self.live_docs[row] = doc
+
+# -------------------- FULL-TEXT SEARCH --------------------
+SEARCH_COLUMNS = ["OBSERVATION DETAILS", "RECOMMENDED ACTION"]
+MAX_PREFIX_EXPANSION = 50 # Cap on vocabulary terms a single prefix may expand to
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+class SearchIndex(RowIndex):
+    """Inverted index (BM25-ranked) over the free-text columns of a log."""
+    K1, B = 1.2, 0.75
+
+    def __init__(self):
+        super().__init__()
+        self.postings = {}      # term -> {row: term frequency}
+        self.doc_tokens = {}    # row -> token list (phrase checks and removal)
+        self.total_len = 0
+        self._vocab = None      # sorted vocabulary for prefix lookups, rebuilt lazily
+
+    def _add(self, row, text):
+        tokens = tokenize(text)
+        self.doc_tokens[row] = tokens
+        self.total_len += len(tokens)
+        for tok in tokens:
+            docs = self.postings.get(tok)
+            if docs is None:
+                docs = self.postings[tok] = {}
+                self._vocab = None
+            docs[row] = docs.get(row, 0) + 1
+
+    def _remove(self, row):
+        tokens = self.doc_tokens.pop(row, None)
+        if tokens is None:
+            return
+        self.total_len -= len(tokens)
+        for tok in set(tokens):
+            docs = self.postings.get(tok)
+            if docs is not None:
+                docs.pop(row, None)
+
+    def _source_columns(self):
+        return SEARCH_COLUMNS
+
+    def _docs(self, df):
+        cols = [c for c in SEARCH_COLUMNS if c in df.columns]
+        if not cols:
+            return pd.Series("", index=df.index)
+        texts = df[cols[0]].astype(str)
+        return texts.str.cat([df[c].astype(str) for c in cols[1:]], sep=" ") if len(cols) > 1 else texts
+
+    def _expand(self, term):
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        start = bisect.bisect_left(self._vocab, term)
+        matches = []
+        for tok in self._vocab[start:start + MAX_PREFIX_EXPANSION]:
+            if not tok.startswith(term):
+                break
+            matches.append(tok)
+        return matches
+
+    def _bm25(self, docs, scores):
+        n_docs = max(len(self.doc_tokens), 1)
+        avg_len = self.total_len / n_docs or 1
+        idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+        for row, tf in docs.items():
+            dl = len(self.doc_tokens[row])
+            scores[row] = scores.get(row, 0.0) + idf * tf * (self.K1 + 1) / (
+                tf + self.K1 * (1 - self.B + self.B * dl / avg_len))
+
+    def search(self, query):
+        """Returns a Series of BM25 scores indexed by row, best match first.
+
+        Terms are ANDed. `"quoted text"` matches a phrase, `term*` matches a
+        prefix, and the last bare term is always treated as a prefix.
+        """
+        parts = re.findall(r'"([^"]*)"|(\S+)', query)
+        with self.lock:
+            candidates, scores = None, {}
+            for i, (phrase, word) in enumerate(parts):
+                if phrase:
+                    tokens = tokenize(phrase)
+                    if not tokens:
+                        continue
+                    rows = None
+                    for tok in tokens:
+                        docs = self.postings.get(tok, {})
+                        rows = set(docs) if rows is None else rows & docs.keys()
+                    rows = {r for r in rows if self._has_phrase(self.doc_tokens[r], tokens)}
+                    for tok in tokens:
+                        self._bm25({r: tf for r, tf in self.postings.get(tok, {}).items() if r in rows}, scores)
+                else:
+                    tokens = tokenize(word)
+                    if not tokens:
+                        continue
+                    is_prefix = word.endswith("*") or (i == len(parts) - 1 and not query.endswith(" "))
+                    rows = set()
+                    for j, tok in enumerate(tokens):
+                        terms = self._expand(tok) if is_prefix and j == len(tokens) - 1 else [tok]
+                        term_rows = set()
+                        for term in terms:
+                            docs = self.postings.get(term, {})
+                            term_rows |= docs.keys()
+                            self._bm25(docs, scores)
+                        rows = term_rows if j == 0 else rows & term_rows
+                candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return pd.Series(dtype=float)
+            return pd.Series({r: scores[r] for r in candidates}).sort_values(ascending=False)
+
+    @staticmethod
+    def _has_phrase(tokens, phrase):
+        n = len(phrase)
+        return any(tokens[i:i + n] == phrase for i in range(len(tokens) - n + 1))
+
+@st.cache_resource(show_spinner=False)
+def get_search_index(project, dataset):
+    """One search index per dataset, shared by every session of this process."""
+    return SearchIndex()
+
+# -------------------- DUPLICATE KEY INDEXES --------------------
+# Columns that identify a record; a new submission repeating any of them is a likely duplicate.
+# Not the Iqama number: one operator / driver is recorded on several assets.
+DUPLICATE_KEYS = {
+    "equipment": ["PALTE NO.", "ASSET CODE"],
+    "vehicle": ["PLATE NO", "ASSET CODE"],
+    "permit": ["PERMIT NO"],
+}
+# A fleet submission matching an asset but with another inspection date is a re-inspection, a
+# new record. Vehicles have no inspection date column: a new MVPI (periodic inspection) expiry
+# stands for one.
+INSPECTION_DATE_COLUMNS = {"equipment": "T.P INSPECTION DATE", "vehicle": "MVPI EXPIRY DATE"}
+
+def normalize_key(value):
+    """'abc-1234 ' and 'ABC 1234' are the same plate / asset / permit number."""
+    return re.sub(r"[\s\-]+", "", str(value)).upper()
+
+class KeyIndex(RowIndex):
+    """Hash index from normalized key values to the sheet rows holding them."""
+
+    def __init__(self, columns):
+        super().__init__()
+        self.columns = columns
+        self.keys = {col: {} for col in columns} # column -> {normalized value: set of rows}
+        self.row_keys = {}
+
+    def _source_columns(self):
+        return self.columns
+
+    def _docs(self, df):
+        values = [
+            df[col].map(normalize_key) if col in df.columns else pd.Series("", index=df.index)
+            for col in self.columns
+        ]
+        return pd.Series(list(zip(*values)), index=df.index, dtype=object)
+
+    def _add(self, row, doc):
+        self.row_keys[row] = doc
+        for col, value in zip(self.columns, doc):
+            if value:
+                self.keys[col].setdefault(value, set()).add(row)
+
+    def _remove(self, row):
+        doc = self.row_keys.pop(row, None)
+        if doc is None:
+            return
+        for col, value in zip(self.columns, doc):
+            rows = self.keys[col].get(value)
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self.keys[col][value]
+
+    def lookup(self, record):
+        """Returns [(column, value, sorted rows)] for every key of `record` already present."""
+        with self.lock:
+            matches = []
+            for col in self.columns:
+                value = normalize_key(record.get(col, ""))
+                rows = self.keys[col].get(value) if value else None
+                if rows:
+                    matches.append((col, record[col], sorted(rows)))
+            return matches
+
+@st.cache_resource(show_spinner=False)
+def get_key_index(project, dataset):
+    return KeyIndex(DUPLICATE_KEYS[dataset])
+
+def find_duplicates(sheet, dataset, record):
+    """Checks a record against the key index, brought up to date from the cached data.
+    Rows of the same asset inspected on another date are not duplicates."""
+    index = get_key_index(current_project(), dataset)
+    if dataset in LOG_DATASETS:
+        manifest, tail = sync_log(sheet, dataset)
+        index.sync(dataset, manifest, tail)
+        return index.lookup(record)
+    frame = load_sheet_frame(sheet, current_project(), dataset)
+    index.sync_frame(frame)
+    matches = index.lookup(record)
+    col = INSPECTION_DATE_COLUMNS.get(dataset)
+    if col in frame.columns and parse_date(record.get(col, "")):
+        inspected = parse_date(record[col])
+        matches = [(key, value, [row for row in rows if parse_date(frame.at[row, col]) == inspected]) for key, value, rows in matches]
+        matches = [match for match in matches if match[2]]
+    return matches
+
+# -------------------- ASSET REGISTRY --------------------
+# Fields copied from the latest row of an asset into the entry form: sheet column -> form widget key
+REGISTRY_FIELDS = {
+    "equipment": {
+        "plate": "PALTE NO.", "asset": "ASSET CODE",
+        "prefill": {
+            "EQUIPMENT TYPE": "eq_type", "MAKE": "eq_make", "PALTE NO.": "eq_plate", "ASSET CODE": "eq_asset",
+            "OWNER": "eq_owner", "OPERATOR NAME": "eq_operator", "IQAMA NO": "eq_iqama",
+        },
+    },
+    "vehicle": {
+        "plate": "PLATE NO", "asset": "ASSET CODE",
+        "prefill": {
+            "VEHICLE TYPE": "veh_type", "MAKE": "veh_make", "PLATE NO": "veh_plate", "ASSET CODE": "veh_asset",
+            "OWNER": "veh_owner", "DRIVER NAME": "veh_driver", "IQAMA NO": "veh_iqama",
+        },
+    },
+}
+MAX_SUGGESTIONS = 20
+
+class AssetRegistry(RowIndex):
+    """Latest record per plate number, with a sorted prefix index over plates and asset codes."""
+
+    def __init__(self, plate_col, asset_col, columns):
+        super().__init__()
+        self.plate_col, self.asset_col, self.columns = plate_col, asset_col, columns
+        self.records = {}   # row -> record dict
+        self.by_plate = {}  # normalized plate -> set of rows
+        self.by_key = {}    # normalized plate or asset code -> set of normalized plates
+        self._sorted_keys = None
+
+    def _source_columns(self):
+        return self.columns
+
+    def _docs(self, df):
+        values = [df[col].astype(str) if col in df.columns else pd.Series("", index=df.index) for col in self.columns]
+        return pd.Series(list(zip(*values)), index=df.index, dtype=object)
+
+    def _add(self, row, doc):
+        record = dict(zip(self.columns, doc))
+        plate = normalize_key(record.get(self.plate_col, ""))
+        if not plate:
+            return
+        self.records[row] = record
+        self.by_plate.setdefault(plate, set()).add(row)
+        for key in (plate, normalize_key(record.get(self.asset_col, ""))):
+            if key:
+                if key not in self.by_key:
+                    self._sorted_keys = None
+                self.by_key.setdefault(key, set()).add(plate)
+
+    def _remove(self, row):
+        record = self.records.pop(row, None)
+        if record is None:
+            return
+        plate = normalize_key(record.get(self.plate_col, ""))
+        rows = self.by_plate.get(plate, set())
+        rows.discard(row)
+        if not rows:
+            self.by_plate.pop(plate, None)
+        asset = normalize_key(record.get(self.asset_col, ""))
+        still_has_asset = any(normalize_key(self.records[r].get(self.asset_col, "")) == asset for r in rows)
+        for key, keep in ((plate, bool(rows)), (asset, still_has_asset)):
+            plates = self.by_key.get(key)
+            if plates is not None and not keep:
+                plates.discard(plate)
+                if not plates:
+                    del self.by_key[key]
+                    self._sorted_keys = None
+
+    def latest(self, plate):
+        rows = self.by_plate.get(plate)
+        return self.records[max(rows)] if rows else None
+
+    def complete(self, prefix, limit=MAX_SUGGESTIONS):
+        """Latest records whose plate number or asset code starts with `prefix`."""
+        prefix = normalize_key(prefix)
+        with self.lock:
+            if self._sorted_keys is None:
+                self._sorted_keys = sorted(self.by_key)
+            plates = []
+            for key in self._sorted_keys[bisect.bisect_left(self._sorted_keys, prefix):]:
+                if not key.startswith(prefix) or len(plates) >= limit:
+                    break
+                plates.extend(p for p in sorted(self.by_key[key]) if p not in plates)
+            return [self.latest(p) for p in plates[:limit]]
+
+@st.cache_resource(show_spinner=False)
+def get_asset_registry(project, dataset):
+    fields = REGISTRY_FIELDS[dataset]
+    return AssetRegistry(fields["plate"], fields["asset"], list(fields["prefill"]))
+
+def show_asset_lookup(sheet, dataset, type_options):
+    """Plate / asset code autocomplete that prefills the entry form below it."""
+    fields = REGISTRY_FIELDS[dataset]
+    registry = get_asset_registry(current_project(), dataset)
+    try:
+        registry.sync_frame(load_sheet_frame(sheet, current_project(), dataset))
+    except Exception as e:
+        st.caption(f"Asset lookup unavailable: {e}")
+        return
+
+    def prefill():
+        record = st.session_state.get(f"{dataset}_lookup_choice")
+        if not record:
+            return
+        for col, key in fields["prefill"].items():
+            value = record.get(col, "")
+            if key.endswith("_type") and value not in type_options:
+                continue
+            st.session_state[key] = value
+
+    with st.expander("🔎 Repeat inspection? Find an existing asset to prefill the form"):
+        query = st.text_input("Plate No. or Asset code starts with", key=f"{dataset}_lookup_query")
+        matches = registry.complete(query) if query.strip() else []
+        if query.strip() and not matches:
+            st.caption("No matching asset in the register.")
+        elif matches:
+            st.selectbox(
+                "Matching assets", matches, index=None, key=f"{dataset}_lookup_choice",
+                format_func=lambda r: " · ".join(v for v in (r[fields["plate"]], r[fields["asset"]], r.get("MAKE", ""), r.get("OWNER", "")) if v),
+                on_change=prefill, placeholder="Choose an asset to prefill the form"
+            )
+
+# -------------------- DATA QUALITY --------------------
+# Rows the app cannot use are quarantined and reported instead of dropped without
+# a trace: log rows whose DATE does not parse (fetch_tail keeps them aside, and
+# they go to rejected.<n>.parquet segments as the rows around them are sealed), values
+# outside the reference lists, blank required fields, unreadable expiry dates and
+# repeated record IDs or permit numbers. The rules are vectorized and run once per revision of a
+# frame: a sealed partition once per process, the hot tail and the registers when
+# they are re-read or edited, and everything again after a reference data edit.
+QUALITY_REQUIRED = {
+    "observation": ["WELL NO", "OBSERVATION DETAILS", "CLASSIFICATION"],
+    "permit": ["DRILL SITE", "PERMIT NO", "TYPE OF PERMIT"],
+    "equipment": ["EQUIPMENT TYPE", "PALTE NO."],
+    "vehicle": ["VEHICLE TYPE", "PLATE NO"],
+}
+QUALITY_VOCABULARIES = { # column -> reference list its values come from
+    "observation": {"WELL NO": "sites", "AREA": "areas", "CATEGORY": "categories"},
+    "permit": {"DRILL SITE": "sites", "WORK LOCATION": "work_locations", "TYPE OF PERMIT": "permit_types"},
+    "equipment": {"EQUIPMENT TYPE": "equipment_types"},
+    "vehicle": {"VEHICLE TYPE": "vehicle_types"},
+}
+QUALITY_UNIQUE_KEYS = { # Besides RECORD ID. Plates, asset codes and Iqama numbers repeat
+    "permit": ["PERMIT NO"], # legitimately (re-inspections, one operator on several assets)
+}
+QUARANTINE_COLUMNS = ["ROW", "RULE", "COLUMN", "VALUE"]
+
+def _quarantine(mask, rule, col, text):
+    hits = text[mask]
+    return pd.DataFrame({"ROW": hits.index, "RULE": rule, "COLUMN": col, "VALUE": hits.to_numpy()}, columns=QUARANTINE_COLUMNS)
+
+def check_rows(df, dataset, ref):
+    """The per-row rules over one frame: blank required fields, values outside the
+    reference lists and, for the registers, expiry dates that do not parse."""
+    found = [pd.DataFrame(columns=QUARANTINE_COLUMNS)]
+    for col in QUALITY_REQUIRED[dataset]:
+        if col in df.columns:
+            text = df[col].astype(str).str.strip()
+            found.append(_quarantine(text.eq(""), "Missing value", col, text))
+    for col, key in QUALITY_VOCABULARIES[dataset].items():
+        if col in df.columns:
+            text = df[col].astype(str).str.strip()
+            allowed = {value.casefold() for value in ref[key]}
+            found.append(_quarantine(text.ne("") & ~text.str.casefold().isin(allowed), "Not in reference list", col, text))
+    for col in FLEET_DATE_COLUMNS.get(dataset, []):
+        if col in df.columns:
+            text = df[col].astype(str).str.strip()
+            found.append(_quarantine(text.ne("") & parse_dates(text).isna(), "Unreadable date", col, text))
+    return pd.concat(found, ignore_index=True)
+
+def unique_key_columns(dataset):
+    """Columns whose value identifies one record, so that a repeat is a duplicate row."""
+    return QUALITY_UNIQUE_KEYS.get(dataset, []) + ([RECORD_ID_COLUMN] if dataset in RECORD_ID_PREFIXES else [])
+
+@st.cache_resource(show_spinner=False)
+def get_unique_key_index(project, dataset):
+    return KeyIndex(unique_key_columns(dataset))
+
+def duplicate_keys(index):
+    """Rows repeating a record ID or permit number of an earlier row, from the unique key index."""
+    with index.lock:
+        repeats = [
+            (row, col, value)
+            for col, rows_by_value in index.keys.items() for value, rows in rows_by_value.items() if len(rows) > 1
+            for row in sorted(rows)[1:]
+        ]
+    return pd.DataFrame([(row, "Duplicate key", col, value) for row, col, value in repeats], columns=QUARANTINE_COLUMNS)
+
+def quality_report(sheet, dataset):
+    """The quarantine table of a dataset, one row per rule a sheet row breaks, by row.
+    Rebuilt only when the data or the reference lists change."""
+    ref = reference()
+    project = current_project()
+    cache = get_derived_cache()
+    if dataset in LOG_DATASETS:
+        manifest, tail, rejected = sync_log_with_rejected(sheet, dataset)
+        files = tuple(seg["file"] for segments in manifest["partitions"].values() for seg in segments)
+        frames = {filename: read_partition(project, dataset, filename) for filename in files}
+        frames["tail"] = tail
+        unreadable = [read_partition(project, dataset, seg["file"]) for seg in manifest["rejected"]] + [rejected]
+        sources = [tail, rejected]
+    else:
+        raw = load_sheet_frame(sheet, project, dataset)
+        frames, unreadable, files, sources = {"sheet": raw}, [], (), [raw]
+
+    def compute():
+        found = [
+            # A sealed partition is checked once; its result outlives the tail's
+            cache.get((dataset, "quality", ref["version"], name), [frame], lambda frame=frame: check_rows(frame, dataset, ref))
+            for name, frame in frames.items()
+        ]
+        found += [_quarantine(pd.Series(True, index=df.index), "Unreadable date", "DATE", df['DATE'].astype(str)) for df in unreadable if 'DATE' in df.columns]
+        index = get_unique_key_index(project, dataset)
+        if dataset in LOG_DATASETS:
+            index.sync(dataset, manifest, tail)
+        else:
+            index.sync_frame(raw)
+        found.append(duplicate_keys(index))
+        return pd.concat(found, ignore_index=True).sort_values("ROW", kind="stable", ignore_index=True)
+
+    with timed(f"quality.{dataset}"):
+        return cache.get((dataset, "quarantine", ref["version"], files, len(unreadable)), sources, compute)
+
+def show_data_quality(obs_sheet, permit_sheet, equip_sheet, vehicle_sheet):
+    st.header("🧪 Data Quality")
+    reports = {}
+    for dataset, sheet in (("observation", obs_sheet), ("permit", permit_sheet), ("equipment", equip_sheet), ("vehicle", vehicle_sheet)):
+        try:
+            reports[dataset] = quality_report(sheet, dataset)
+        except gspread.exceptions.GSpreadException as e:
+            st.error(f"❌ Could not check {dataset} data: {e}")
+    if not reports:
+        return
+    for col, (dataset, report) in zip(st.columns(len(reports)), reports.items()):
+        col.metric(f"{dataset.title()} Rows Quarantined", report["ROW"].nunique())
+    counts = pd.concat([report.assign(DATASET=dataset.title()) for dataset, report in reports.items()])
+    if counts.empty:
+        st.success("✅ Every row passes the data quality rules.")
+        return
+    st.dataframe(
+        counts.groupby(["DATASET", "RULE", "COLUMN"]).size().rename("ROWS").reset_index(),
+        use_container_width=True, hide_index=True
+    )
+
+    dataset = st.selectbox("Quarantined rows of", list(reports), format_func=str.title)
+    report = reports[dataset]
+    rules = st.multiselect("Rules", sorted(report["RULE"].unique()), key=f"quality_rules_{dataset}")
+    if rules:
+        report = report[report["RULE"].isin(rules)]
+    table = report.assign(ROW=[row_label(dataset, row) for row in report["ROW"]])
+    st.dataframe(table, use_container_width=True, hide_index=True)
+    st.download_button(
+        "Download quarantine (CSV)", table.to_csv(index=False).encode(),
+        file_name=f"{dataset}_quarantine.csv", mime="text/csv"
+    )
+
+# -------------------- SITE RISK INDEX --------------------
+# Observations (WELL NO) and permits (DRILL SITE) share the site list and DATE.
+# Each log keeps a hash index of its row counts per (site, day), maintained row by
+# row like the other indexes, so the site risk view joins two small dicts instead
+# of merging the full logs on every rerun.
+SITE_DAY_COLUMNS = {
+    "observation": ("WELL NO", "CLASSIFICATION"),
+    "permit": ("DRILL SITE", "TYPE OF PERMIT"),
+}
+UNSAFE_CLASSES = ("UNSAFE ACT", "UNSAFE CONDITION")
+SITE_RISK_PERIODS = {"Week": "W", "Day": "D"}
+HOT_PERMIT_TYPE = "Hot" # A Hot permit is this TYPE OF PERMIT, ignoring case and surrounding spaces
+HIGH_RISK_PERMIT_TYPES = (HOT_PERMIT_TYPE, "CSE", "EOLB")
+
+def hot_permits(types):
+    """Mask of the Hot permits among TYPE OF PERMIT values; every count of Hot permits uses it."""
+    return types.astype(str).str.strip().str.upper() == HOT_PERMIT_TYPE.upper()
+SITE_RISK_METRICS = {
+    "Unsafe observations": "UNSAFE",
+    "Unsafe per 10 permits": "UNSAFE PER 10 PERMITS",
+    "Permits": "PERMITS",
+    "High-risk permits (Hot/CSE/EOLB)": "HIGH RISK PERMITS",
+}
+MIN_CORRELATION_PERIODS = 4 # Periods a site needs before its correlation is shown
+
+class SiteDayIndex(RowIndex):
+    """Row counts of a log per (site, day) and kind (classification or permit type,
+    upper-cased: kinds match ignoring case and surrounding spaces, as hot_permits())."""
+
+    def __init__(self, site_col, kind_col):
+        super().__init__()
+        self.site_col, self.kind_col = site_col, kind_col
+        self.counts = {}    # (site, day) -> {kind: rows}
+        self.row_keys = {}
+        self.version = 0    # Bumped on every change; keys the joined frames
+
+    def _source_columns(self):
+        return [self.site_col, 'DATE', self.kind_col]
+
+    def _docs(self, df):
+        if self.site_col not in df.columns or 'DATE' not in df.columns:
+            return pd.Series([], dtype=object)
+        sites = df[self.site_col].astype(str).str.strip()
+        kinds = df[self.kind_col].astype(str).str.strip().str.upper() if self.kind_col in df.columns else pd.Series("", index=df.index)
+        return pd.Series(list(zip(sites, df['DATE'].dt.date, kinds)), index=df.index, dtype=object)
+
+    def _add(self, row, doc):
+        site, day, kind = doc
+        self.row_keys[row] = doc
+        cell = self.counts.setdefault((site, day), {})
+        cell[kind] = cell.get(kind, 0) + 1
+        self.version += 1
+
+    def _remove(self, row):
+        doc = self.row_keys.pop(row, None)
+        if doc is None:
+            return
+        site, day, kind = doc
+        cell = self.counts[(site, day)]
+        cell[kind] -= 1
+        if not cell[kind]:
+            del cell[kind]
+            if not cell:
+                del self.counts[(site, day)]
+        self.version += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {key: dict(cell) for key, cell in self.counts.items()}
+
+@st.cache_resource(show_spinner=False)
+def get_site_day_index(project, dataset):
+    return SiteDayIndex(*SITE_DAY_COLUMNS[dataset])
+
+def join_site_days(obs_counts, permit_counts, permit_types):
+    """Hash join of the two indexes on (site, day): one row per key present in either.
+    Permit types are counted under their reference-data names."""
+    high_risk = [t.upper() for t in HIGH_RISK_PERMIT_TYPES]
+    rows = []
+    for site, day in obs_counts.keys() | permit_counts.keys():
+        obs = obs_counts.get((site, day), {})
+        permits = permit_counts.get((site, day), {})
+        rows.append(
+            [site, day, sum(obs.values()), sum(obs.get(c, 0) for c in UNSAFE_CLASSES), sum(permits.values()),
+             sum(permits.get(t, 0) for t in high_risk)]
+            + [permits.get(t.strip().upper(), 0) for t in permit_types]
+        )
+    df = pd.DataFrame(rows, columns=["SITE", "DATE", "OBSERVATIONS", "UNSAFE", "PERMITS", "HIGH RISK PERMITS"] + list(permit_types))
+    df['DATE'] = pd.to_datetime(df['DATE'])
+    return df
+
+def load_site_risk(obs_sheet, permit_sheet, period, ref):
+    """Per site and period: observations, unsafe observations, permits and permit mix.
+
+    Both indexes are brought up to date from the cached logs (only new sealed
+    segments and changed hot-tail rows are visited); the joined frame is shared
+    until either index changes.
+    """
+    indexes, tails = [], []
+    for dataset, sheet in (("observation", obs_sheet), ("permit", permit_sheet)):
+        manifest, tail = sync_log(sheet, dataset)
+        index = get_site_day_index(current_project(), dataset)
+        with timed(f"site_risk.sync.{dataset}"):
+            index.sync(dataset, manifest, tail)
+        indexes.append(index)
+        tails.append(tail)
+
+    def compute():
+        df = join_site_days(indexes[0].snapshot(), indexes[1].snapshot(), ref["permit_types"])
+        df['DATE'] = df['DATE'].dt.to_period(SITE_RISK_PERIODS[period]).dt.start_time
+        df = df.groupby(["SITE", "DATE"], as_index=False).sum()
+        df['SITE'] = df['SITE'].astype(site_dtype(ref["version"], ref["sites"]))
+        return df.dropna(subset=['SITE'])
+
+    key = ("site_risk", period, ref["version"], indexes[0].version, indexes[1].version)
+    with timed("site_risk.join"):
+        return get_derived_cache().get(key, tails, compute)
+
+# -------------------- TREND ANOMALIES --------------------
+# Daily unsafe-observation and Hot-permit counts, overall and per site, supervisor
+# (permit receiver) and site × supervisor, are kept in a process-wide index
+# maintained row by row like the others. Each series holds prefix sums of its
+# counts and squares plus an EWMA, recomputed only from the earliest day that
+# changed, so new rows cost a few days of work instead of a pass over all history.
+# A day is flagged when its count spikes above the mean of the previous 28 days
+# (by ANOMALY_Z standard deviations), or when the EWMA drifts above it (EWMA
+# control limit). Baselines use the whole log, not the tab's filters.
+ANOMALY_EVENTS = { # dataset -> (column, values counted, what is counted)
+    "observation": ("CLASSIFICATION", UNSAFE_CLASSES, "Unsafe observations"),
+    "permit": ("TYPE OF PERMIT", (HOT_PERMIT_TYPE,), "Hot permits"),
+}
+ANOMALY_DIMENSIONS = {
+    "observation": {"Day": (), "Site": ("WELL NO",), "Supervisor": ("SUPERVISOR NAME",), "Site × Supervisor": ("WELL NO", "SUPERVISOR NAME")},
+    "permit": {"Day": (), "Site": ("DRILL SITE",), "Receiver": ("PERMIT RECEIVER",), "Site × Receiver": ("DRILL SITE", "PERMIT RECEIVER")},
+}
+ANOMALY_BASELINE_DAYS = 28
+ANOMALY_SHORT_DAYS = 7
+ANOMALY_EWMA_ALPHA = 2 / (ANOMALY_SHORT_DAYS + 1) # An EWMA with a 7-day span
+ANOMALY_Z = 3.0
+ANOMALY_MIN_COUNT = 3 # A spike needs at least this many events that day
+ANOMALY_MIN_HISTORY = 14 # Days a series needs before it can be flagged
+ANOMALY_LIST_ROWS = 50
+
+class DailySeries:
+    """Daily event counts of one site / supervisor / ..., with running statistics.
+
+    Prefix sums and the EWMA are valid up to `stale`; a change on day i only
+    recomputes them from i onward.
+    """
+
+    def __init__(self, first_day):
+        self.first = first_day # Date ordinal of counts[0]
+        self.counts = []
+        self.sums = [0]        # sums[i] = counts[0] + ... + counts[i - 1]
+        self.squares = [0]
+        self.ewma = []
+        self.stale = 0
+
+    def add(self, day, n):
+        if day < self.first:
+            self.counts[:0] = [0] * (self.first - day)
+            self.first, self.stale = day, 0
+        self.extend(day)
+        i = day - self.first
+        self.counts[i] += n
+        self.stale = min(self.stale, i)
+
+    def extend(self, day):
+        """Adds zero days up to `day`."""
+        missing = day - self.first + 1 - len(self.counts)
+        if missing > 0:
+            self.stale = min(self.stale, len(self.counts))
+            self.counts += [0] * missing
+
+    def refresh(self):
+        if self.stale >= len(self.counts):
+            return
+        del self.sums[self.stale + 1:], self.squares[self.stale + 1:], self.ewma[self.stale:]
+        level = self.ewma[-1] if self.ewma else 0.0
+        for x in self.counts[self.stale:]:
+            self.sums.append(self.sums[-1] + x)
+            self.squares.append(self.squares[-1] + x * x)
+            level += ANOMALY_EWMA_ALPHA * (x - level)
+            self.ewma.append(level)
+        self.stale = len(self.counts)
+
+    def window(self, end, days):
+        """(mean, variance) of the `days` counts before index `end`."""
+        start = max(0, end - days)
+        if end <= start:
+            return 0.0, 0.0
+        mean = (self.sums[end] - self.sums[start]) / (end - start)
+        return mean, max(0.0, (self.squares[end] - self.squares[start]) / (end - start) - mean * mean)
+
+    def total(self, start, end):
+        """Sum of the counts of days `start`..`end` (date ordinals). Call refresh() first."""
+        lo = min(max(start - self.first, 0), len(self.counts))
+        hi = min(max(end - self.first + 1, 0), len(self.counts))
+        return self.sums[hi] - self.sums[lo] if hi > lo else 0
+
+    def check(self, day):
+        """(count, 7-day mean, baseline mean, baseline sd, EWMA, signal, score) if `day`
+        stands out from its baseline, else None. Call refresh() first."""
+        i = day - self.first
+        x, level = self.counts[i], self.ewma[i]
+        if x < ANOMALY_MIN_COUNT and level < 1:
+            return None
+        mean, variance = self.window(i, ANOMALY_BASELINE_DAYS)
+        sd = max(math.sqrt(variance), 1.0) # Sparse counts have near-zero variance
+        spike = (x - mean) / sd if x >= ANOMALY_MIN_COUNT else 0.0
+        drift = (level - mean) / (sd * math.sqrt(ANOMALY_EWMA_ALPHA / (2 - ANOMALY_EWMA_ALPHA)))
+        if max(spike, drift) < ANOMALY_Z:
+            return None
+        short_mean, _ = self.window(i + 1, ANOMALY_SHORT_DAYS)
+        return x, short_mean, mean, sd, level, "Spike" if spike >= drift else "Rising trend", max(spike, drift)
+
+class TrendIndex(RowIndex):
+    """DailySeries of a log's events per (dimension, entity)."""
+
+    def __init__(self, dataset):
+        super().__init__()
+        self.event_col, values, _ = ANOMALY_EVENTS[dataset]
+        self.values = [v.upper() for v in values]
+        self.dimensions = ANOMALY_DIMENSIONS[dataset]
+        self.series = {}   # (dimension, entity) -> DailySeries
+        self.row_docs = {}
+        self.version = 0   # Bumped on every change; keys the flag frames
+
+    def _source_columns(self):
+        return [self.event_col, 'DATE'] + sorted({col for cols in self.dimensions.values() for col in cols})
+
+    def _docs(self, df):
+        if self.event_col not in df.columns or 'DATE' not in df.columns:
+            return pd.Series([], dtype=object)
+        events = df[self.event_col].astype(str).str.strip().str.upper().isin(self.values)
+        days = df['DATE'].dt.date.map(date.toordinal)
+        entities = [] # Per dimension, the (dimension, entity) key of each row, or None
+        for dimension, cols in self.dimensions.items():
+            if not cols:
+                entities.append([(dimension, "All")] * len(df))
+                continue
+            if not all(col in df.columns for col in cols):
+                continue
+            parts = [df[col].astype(object).fillna("").astype(str).str.strip() for col in cols]
+            complete = pd.concat(parts, axis=1).ne("").all(axis=1)
+            keys = parts[0].str.cat(parts[1:], sep=" · ") if len(parts) > 1 else parts[0]
+            entities.append([(dimension, key) if ok else None for key, ok in zip(keys, complete)])
+        docs = [
+            (day, tuple(key for key in keys if key)) if event else None
+            for event, day, *keys in zip(events, days, *entities)
+        ]
+        return pd.Series(docs, index=df.index, dtype=object)
+
+    def _add(self, row, doc):
+        if doc is None:
+            return
+        day, keys = doc
+        self.row_docs[row] = doc
+        for key in keys:
+            self.series.setdefault(key, DailySeries(day)).add(day, 1)
+        self.version += 1
+
+    def _remove(self, row):
+        doc = self.row_docs.pop(row, None)
+        if doc is None:
+            return
+        day, keys = doc
+        for key in keys:
+            self.series[key].add(day, -1)
+        self.version += 1
+
+    def flags(self, start, end, last_day):
+        """Flagged (day, dimension, entity) in [start, end], highest score first."""
+        rows = []
+        end = min(end, last_day).toordinal()
+        with self.lock:
+            for (dimension, entity), series in self.series.items():
+                series.extend(last_day.toordinal())
+                series.refresh()
+                for day in range(max(start.toordinal(), series.first + ANOMALY_MIN_HISTORY), end + 1):
+                    flag = series.check(day)
+                    if flag:
+                        rows.append((date.fromordinal(day), dimension, entity, *flag))
+        df = pd.DataFrame(rows, columns=[
+            "DATE", "DIMENSION", "ENTITY", "COUNT", "7-DAY MEAN", "28-DAY MEAN", "28-DAY SD", "EWMA", "SIGNAL", "SCORE"
+        ])
+        return df.sort_values("SCORE", ascending=False, ignore_index=True)
+
+@st.cache_resource(show_spinner=False)
+def get_trend_index(project, dataset):
+    return TrendIndex(dataset)
+
+def load_trend_flags(sheet, dataset, start, end):
+    """Anomaly flags of a log within [start, end], shared until the log changes."""
+    manifest, tail = sync_log(sheet, dataset)
+    index = get_trend_index(current_project(), dataset)
+    with timed(f"anomaly.sync.{dataset}"):
+        index.sync(dataset, manifest, tail)
+    last_day = log_date_bounds(manifest, tail)[1] or end
+    key = ("anomalies", dataset, index.version, start, end, last_day)
+    with timed(f"anomaly.flag.{dataset}"):
+        return get_derived_cache().get(key, [tail], lambda: index.flags(start, end, last_day))
+
+def overlay_flags(fig, by_day, flags):
+    """Marks the flagged days on a daily trend chart (x = DATE, y = count)."""
+    if flags.empty:
+        return
+    notes = collections.defaultdict(list)
+    for day, dimension, entity, count, signal in flags[["DATE", "DIMENSION", "ENTITY", "COUNT", "SIGNAL"]].itertuples(index=False, name=None):
+        notes[day].append(f"{dimension} {entity}: {count} ({signal.lower()})")
+    counts = dict(zip(by_day['DATE'], by_day['count']))
+    days = sorted(notes)
+    fig.add_scatter(
+        x=days, y=[counts.get(day, 0) for day in days], mode="markers", name="Attention needed",
+        marker=dict(color="#E74C3C", size=12, symbol="x"), hoverinfo="text",
+        hovertext=["<br>".join(notes[day][:3]) + (f"<br>+{len(notes[day]) - 3} more" if len(notes[day]) > 3 else "") for day in days],
+    )
+
+def show_attention_list(flags, dataset, clock):
+    """The ranked flags of a tab's date range."""
+    st.write("#### ⚠️ Attention Needed")
+    noun = ANOMALY_EVENTS[dataset][2]
+    if flags.empty:
+        st.success(f"No day, site or {'supervisor' if dataset == 'observation' else 'receiver'} stands out from its baseline in this range.")
+        return
+    st.caption(
+        f"{noun} per day against the previous {ANOMALY_BASELINE_DAYS} days of the whole log. "
+        f"Spike: the day's count is {ANOMALY_Z:g}+ standard deviations above the baseline. "
+        f"Rising trend: the {ANOMALY_SHORT_DAYS}-day EWMA is above its control limit."
+    )
+    table = flags.head(ANOMALY_LIST_ROWS).round(2)
+    table['DATE'] = pd.to_datetime(table['DATE']).dt.strftime('%d-%b-%Y')
+    clock.table(table)
+
+# -------------------- PERIOD COMPARISONS --------------------
+# The headline KPIs are compared with the previous period of the same length and
+# the same dates a year earlier. Each KPI keeps a DailySeries of its daily counts
+# over the whole log, maintained row by row, so any range total is the difference
+# of two prefix sums whatever the range or the length of history.
+KPI_COUNTS = { # dataset -> KPI -> (column, upper-cased pattern a counted row matches), None counts every row
+    "observation": {
+        "Total Observations": None,
+        "Open Issues": ("STATUS", "OPEN"),
+        "Total Unsafe": ("CLASSIFICATION", "|".join(UNSAFE_CLASSES)),
+    },
+    "permit": {
+        "Total Permits": None,
+        "Hot Permits": ("TYPE OF PERMIT", re.escape(HOT_PERMIT_TYPE.upper())), # As hot_permits()
+    },
+}
+KPI_PREVIOUS, KPI_LAST_YEAR = "Previous period", "Same period last year"
+
+class KpiIndex(RowIndex):
+    """DailySeries of a log's KPI counts, one per KPI."""
+
+    def __init__(self, dataset):
+        super().__init__()
+        self.kpis = KPI_COUNTS[dataset]
+        self.series = {}   # KPI -> DailySeries
+        self.row_docs = {}
+
+    def _source_columns(self):
+        return ['DATE'] + [rule[0] for rule in self.kpis.values() if rule is not None]
+
+    def _docs(self, df):
+        if 'DATE' not in df.columns:
+            return pd.Series([], dtype=object)
+        days = df['DATE'].dt.date.map(date.toordinal)
+        hits = []
+        for rule in self.kpis.values():
+            if rule is None:
+                hits.append([True] * len(df))
+            elif rule[0] in df.columns:
+                hits.append(df[rule[0]].astype(str).str.strip().str.upper().str.fullmatch(rule[1]).fillna(False))
+            else:
+                hits.append([False] * len(df))
+        docs = [(day, tuple(kpi for kpi, hit in zip(self.kpis, flags) if hit)) for day, *flags in zip(days, *hits)]
+        return pd.Series(docs, index=df.index, dtype=object)
+
+    def _add(self, row, doc):
+        day, kpis = doc
+        self.row_docs[row] = doc
+        for kpi in kpis:
+            self.series.setdefault(kpi, DailySeries(day)).add(day, 1)
+
+    def _remove(self, row):
+        doc = self.row_docs.pop(row, None)
+        if doc is None:
+            return
+        day, kpis = doc
+        for kpi in kpis:
+            self.series[kpi].add(day, -1)
+
+    def totals(self, start, end):
+        """{KPI: count} over the days `start`..`end`."""
+        with self.lock:
+            totals = {}
+            for kpi in self.kpis:
+                series = self.series.get(kpi)
+                if series is None:
+                    totals[kpi] = 0
+                    continue
+                series.refresh()
+                totals[kpi] = series.total(start.toordinal(), end.toordinal())
+            return totals
+
+@st.cache_resource(show_spinner=False)
+def get_kpi_index(project, dataset):
+    return KpiIndex(dataset)
+
+def year_earlier(day):
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError: # 29 February
+        return day.replace(year=day.year - 1, day=28)
+
+def load_kpi_comparison(dataset, manifest, tail, start, end):
+    """KPI totals of [start, end] and of the periods it is compared with; a period
+    starting before the log does is None rather than a partial total."""
+    index = get_kpi_index(current_project(), dataset)
+    with timed(f"kpi.sync.{dataset}"):
+        index.sync(dataset, manifest, tail)
+    first_day = log_date_bounds(manifest, tail)[0]
+    length = end - start + timedelta(days=1)
+    periods = {
+        "now": (start, end),
+        KPI_PREVIOUS: (start - length, start - timedelta(days=1)),
+        KPI_LAST_YEAR: (year_earlier(start), year_earlier(end)),
+    }
+    return {
+        period: (a, b, index.totals(a, b)) if period == "now" or (first_day and a >= first_day) else (a, b, None)
+        for period, (a, b) in periods.items()
+    }
+
+def kpi_delta(comparison, value, percent=False):
+    """st.metric delta (against the previous period) and help for a KPI computed by
+    `value(totals)`, and its change on the same period last year (None without history)."""
+    shown, signed = ("{:.1f}%", "{:+.1f} pp") if percent else ("{:,.0f}", "{:+,.0f}")
+    values = {period: None if totals is None else value(totals) for period, (_, _, totals) in comparison.items()}
+    changes = {period: None if values[period] is None else signed.format(values["now"] - values[period]) for period in (KPI_PREVIOUS, KPI_LAST_YEAR)}
+    lines = [
+        f"{period} ({start:%d-%b-%Y} – {end:%d-%b-%Y}): " + ("no data" if values[period] is None else f"{shown.format(values[period])} ({changes[period]})")
+        for period, (start, end, _) in comparison.items() if period != "now"
+    ]
+    return dict(delta=changes[KPI_PREVIOUS], help="  \n".join(lines)), changes[KPI_LAST_YEAR]
+
+# -------------------- RECORD IDS & IN-PLACE EDITS --------------------
+# Rows written by the observation / fleet forms and the bulk import carry a stable
+# RECORD ID. A locator index maps IDs to sheet rows (the row every frame is indexed
+# by), so a record picked on a page is written at the row its ID is at now. Before
+# the batch_update of just the changed cells, the target rows are read back: a row
+# whose RECORD ID (or, for rows written before IDs, whose cells) no longer match the
+# cached record was changed by hand in the sheet, and nothing is written. The cached
+# frames and the row indexes are then patched in place, not re-read; a sealed
+# segment holding an edited row is written as a new revision the manifest moves to.
+RECORD_ID_COLUMN = "RECORD ID"
+RECORD_ID_PREFIXES = {"observation": "OBS", "equipment": "EQP", "vehicle": "VEH"}
+RECORD_ID_HEADERS = {"equipment": "Record ID", "vehicle": "Record ID"} # Sheet header, where the forms write it last
+
+def new_record_id(dataset):
+    return f"{RECORD_ID_PREFIXES[dataset]}-{uuid.uuid4().hex[:10].upper()}"
+
+class RecordLocator(RowIndex):
+    """Hash index from record ID to sheet row, and back."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = {}  # record ID -> row
+        self.ids = {}   # row -> record ID
+
+    def _source_columns(self):
+        return [RECORD_ID_COLUMN]
+
+    def _docs(self, df):
+        if RECORD_ID_COLUMN not in df.columns:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[RECORD_ID_COLUMN].astype(object).fillna("").astype(str).str.strip()
+
+    def _add(self, row, record_id):
+        if record_id:
+            self.rows[record_id] = row
+            self.ids[row] = record_id
+
+    def _remove(self, row):
+        record_id = self.ids.pop(row, None)
+        if record_id is not None and self.rows.get(record_id) == row:
+            del self.rows[record_id]
+
+    def locate(self, record_ids):
+        """Current rows of the given record IDs (None where unknown)."""
+        with self.lock:
+            return {record_id: self.rows.get(record_id) for record_id in record_ids}
+
+    def record_id(self, row):
+        with self.lock:
+            return self.ids.get(row)
+
+@st.cache_resource(show_spinner=False)
+def get_record_locator(project, dataset):
+    return RecordLocator()
+
+def sync_record_locator(sheet, dataset):
+    locator = get_record_locator(current_project(), dataset)
+    if dataset in LOG_DATASETS:
+        locator.sync(dataset, *sync_log(sheet, dataset))
+    else:
+        locator.sync_frame(load_sheet_frame(sheet, current_project(), dataset))
+    return locator
+
+def record_columns(sheet, dataset):
+    """The sheet's columns (upper-cased, in sheet order). A log sheet without a RECORD ID
+    header gets one in the first free column; the fleet headers include it already."""
+    if dataset not in LOG_DATASETS:
+        return list(load_sheet_frame(sheet, current_project(), dataset).columns)
+    manifest, tail = sync_log(sheet, dataset)
+    columns = list(tail.columns)
+    if columns and RECORD_ID_COLUMN not in columns:
+        active_shard(dataset, manifest).batch_update([{"range": gspread.utils.rowcol_to_a1(1, len(columns) + 1), "values": [[RECORD_ID_COLUMN]]}])
+        invalidate_dataset(dataset) # The cached tail predates the new column
+        columns.append(RECORD_ID_COLUMN)
+    return columns
+
+def with_record_id(sheet, dataset, data):
+    """A form row with a new record ID in the sheet's RECORD ID column."""
+    position = record_columns(sheet, dataset).index(RECORD_ID_COLUMN)
+    return (list(data) + [""] * position)[:position] + [new_record_id(dataset)]
+
+def record_key(df, row):
+    """What update_records is given for row `row` of `df`: its record ID, or the row
+    itself for a row written before record IDs."""
+    value = df.at[row, RECORD_ID_COLUMN] if RECORD_ID_COLUMN in df.columns else None
+    return str(value).strip() if not pd.isna(value) and str(value).strip() else row
+
+def row_matches(dataset, record_id, cached, values, columns):
+    """Whether a sheet row read back (`values`, in sheet column order) still holds the
+    cached record: the same RECORD ID, or for a record without one, the same cells.
+    DATE is left out there, as a single date string may parse differently alone."""
+    sheet = dict(zip(columns, list(values) + [""] * (len(columns) - len(values))))
+    if record_id:
+        return sheet.get(RECORD_ID_COLUMN, "").strip() == record_id
+    for col, value in cached.items():
+        if col in sheet and col not in ('DATE', RECORD_ID_COLUMN):
+            if cached_value(dataset, col, sheet[col]) != ("" if pd.isna(value) else str(value)):
+                return False
+    return True
+
+def keep_record_id(dataset, row, data):
+    """A form row overwriting sheet row `row` keeps that row's record ID."""
+    record_id = get_record_locator(current_project(), dataset).record_id(row) if dataset in RECORD_ID_HEADERS else None
+    return list(data[:-1]) + [record_id] if record_id else data
+
+def cached_value(dataset, col, value):
+    """A written cell as the cached frames hold it (see clean_log_frame)."""
+    value = str(value)
+    if dataset in LOG_DATASETS and col == 'CLASSIFICATION':
+        return value.strip().upper()
+    if dataset in LOG_DATASETS and col == 'STATUS':
+        return value.strip().capitalize()
+    return value
+
+def _set_cells(frame, col, values):
+    """Writes {row: value} into one column of a cached frame, keeping the frame object.
+    The column is replaced rather than written through, as its buffers may be read-only."""
+    column = frame[col].copy() if col in frame.columns else pd.Series("", index=frame.index) # e.g. RECORD ID on an old segment
+    new = [v for v in set(values.values()) if isinstance(column.dtype, pd.CategoricalDtype) and v not in column.cat.categories]
+    if new:
+        column = column.cat.add_categories(new)
+    column.loc[list(values)] = list(values.values())
+    frame[col] = column
+
+def row_indexes(dataset):
+    """Every row index kept for a dataset."""
+    project = current_project()
+    indexes = [get_record_locator(project, dataset), get_unique_key_index(project, dataset)]
+    if dataset in DUPLICATE_KEYS:
+        indexes.append(get_key_index(project, dataset))
+    if dataset in REGISTRY_FIELDS:
+        indexes.append(get_asset_registry(project, dataset))
+    if dataset in SITE_DAY_COLUMNS:
+        indexes.append(get_site_day_index(project, dataset))
+    if dataset in ANOMALY_EVENTS:
+        indexes.append(get_trend_index(project, dataset))
+    if dataset in KPI_COUNTS:
+        indexes.append(get_kpi_index(project, dataset))
+    if dataset == "observation":
+        indexes.append(get_search_index(project, dataset))
+    return indexes
+
+def cached_frames(sheet, dataset, manifest, rows):
+    """(frame, sealed segment or None) of the cached frames that may hold `rows`: the
+    hot tail (or the whole sheet) and the sealed segments whose rows span them."""
+    project = current_project()
+    if dataset not in LOG_DATASETS:
+        return [(load_sheet_frame(sheet, project, dataset), None)]
+    tail, _, _ = fetch_tail(active_shard(dataset, manifest), project, dataset, manifest["rows_archived"] + 2, manifest["shard"])
+    frames = [(tail, None)]
+    for segments in manifest["partitions"].values():
+        for seg in segments:
+            if "first_row" in seg:
+                if not any(seg["first_row"] <= row <= seg["last_row"] for row in rows):
+                    continue
+            else: # Sealed before segments recorded their rows: read just the row keys
+                held = pd.read_parquet(_archive_path(dataset, seg["file"]), columns=[]).index
+                if not held.isin(list(rows)).any():
+                    continue
+            frames.append((read_partition(project, dataset, seg["file"]), seg))
+    return frames
+
+def patch_cached_rows(sheet, dataset, changes):
+    """Applies {row: {column: value}} to the cached frames, the archive and the row indexes."""
+    project = current_project()
+    with archive_lock():
+        manifest = load_manifest(dataset) if dataset in LOG_DATASETS else None
+        frames = cached_frames(sheet, dataset, manifest, changes)
+        replaced = [] # (old, new) segment files
+        for frame, seg in frames:
+            rows = [row for row in changes if row in frame.index]
+            if not rows:
+                continue
+            by_column = collections.defaultdict(dict)
+            for row in rows:
+                for col, value in changes[row].items():
+                    by_column[col][row] = cached_value(dataset, col, value)
+            for col, values in by_column.items():
+                _set_cells(frame, col, values)
+            if seg is not None:
+                # Sealed segments are immutable: the edited one is a new revision, and the
+                # manifest moves to it (the cached frame already matches)
+                old = seg["file"]
+                seg["revision"] = seg.get("revision", 0) + 1
+                seg["file"] = re.sub(r"(\.r\d+)?\.parquet$", f".r{seg['revision']}.parquet", old)
+                tmp_path = _archive_path(dataset, seg["file"] + ".tmp")
+                frame.to_parquet(tmp_path, compression="zstd")
+                os.replace(tmp_path, _archive_path(dataset, seg["file"]))
+                replaced.append((old, seg["file"]))
+            for index in row_indexes(dataset):
+                index.update_rows(frame.loc[rows])
+        if replaced:
+            save_manifest(dataset, manifest)
+            for old, new in replaced:
+                for index in row_indexes(dataset):
+                    index.rename_segment(old, new)
+                read_partition.clear(project, dataset, old)
+                with contextlib.suppress(OSError):
+                    os.remove(_archive_path(dataset, old))
+        # Ranges and filtered frames of a log are all keyed on its tail
+        get_derived_cache().drop_source(frames[0][0])
+
+def check_rows_unchanged(sheet, dataset, columns, record_ids):
+    """Reads back the target rows ({row: record ID or None}) in one call per shard and
+    raises if one no longer holds its cached record."""
+    manifest = load_manifest(dataset) if dataset in LOG_DATASETS else None
+    cached = {}
+    for frame, _ in cached_frames(sheet, dataset, manifest, record_ids):
+        for row in record_ids:
+            if row in frame.index:
+                cached[row] = frame.loc[row].to_dict()
+    shards = list_shards(current_project(), dataset) if dataset in LOG_DATASETS else [sheet]
+    by_shard = collections.defaultdict(list)
+    for row in record_ids:
+        by_shard[split_row(row)[0]].append(row)
+    last_col = gspread.utils.rowcol_to_a1(1, len(columns)).rstrip("1")
+    moved = []
+    with timed(f"sheets.read.{dataset}"):
+        for shard, rows in by_shard.items():
+            values = shards[shard].batch_get([f"A{split_row(row)[1]}:{last_col}{split_row(row)[1]}" for row in rows])
+            for row, value in zip(rows, values):
+                if row not in cached or not row_matches(dataset, record_ids[row], cached[row], value[0] if value else [], columns):
+                    moved.append(row)
+    if moved:
+        invalidate_dataset(dataset)
+        raise RuntimeError(
+            f"row(s) {', '.join(row_label(dataset, row) for row in moved)} no longer hold the record shown here; "
+            "the sheet was changed by hand. Nothing was written. Reload the page and try again "
+            "(for archived rows, rebuild the archive under Dashboard › Local Data Archive first)."
+        )
+
+def update_records(sheet, dataset, changes):
+    """Writes {record: {column: value}} to the sheet in one batch_update (per shard touched)
+    and patches the cached data. Records are given by record ID, or by row for rows written
+    before IDs (see record_key); IDs are resolved to their current rows through the locator,
+    and every target row is checked against the sheet first. Rows without a record ID get
+    one in the same call. Returns rows written."""
+    columns = record_columns(sheet, dataset)
+    locator = sync_record_locator(sheet, dataset)
+    changes = {key: dict(cells) for key, cells in changes.items() if cells}
+    if not changes:
+        return 0
+    rows = locator.locate([key for key in changes if isinstance(key, str)])
+    missing = [record_id for record_id, row in rows.items() if row is None]
+    if missing:
+        raise RuntimeError(f"record(s) {', '.join(missing)} are no longer in the sheet. Nothing was written.")
+    record_ids = {rows.get(key, key): key if isinstance(key, str) else None for key in changes}
+    changes = {rows.get(key, key): cells for key, cells in changes.items()}
+    check_rows_unchanged(sheet, dataset, columns, record_ids)
+    if RECORD_ID_COLUMN in columns:
+        for row, cells in changes.items():
+            if not record_ids[row]:
+                cells[RECORD_ID_COLUMN] = new_record_id(dataset)
+    shards = list_shards(current_project(), dataset) if dataset in LOG_DATASETS else [sheet]
+    data = collections.defaultdict(list) # shard -> cell updates
+    for row, cells in changes.items():
+        shard, sheet_row = split_row(row)
+        data[shard] += [
+            {"range": gspread.utils.rowcol_to_a1(sheet_row, columns.index(col) + 1), "values": [[value]]}
+            for col, value in cells.items()
+        ]
+    with timed(f"sheets.write.{dataset}"):
+        for shard, cells in data.items():
+            shards[shard].batch_update(cells)
+    patch_cached_rows(sheet, dataset, changes)
+    return len(changes)
+
+def observation_labels(df):
+    """'ID · date · site · classification · details' per row, for pickers."""
+    def text(col):
+        return df[col].astype(object).fillna("").astype(str) if col in df.columns else pd.Series("", index=df.index)
+    ids = text(RECORD_ID_COLUMN)
+    missing = df.index[ids == ""]
+    ids = ids.where(ids != "", pd.Series(["Row " + row_label("observation", row) for row in missing], index=missing))
+    details = text('OBSERVATION DETAILS')
+    details = details.where(details.str.len() <= 60, details.str[:60] + "…")
+    return (ids + " · " + df['DATE'].dt.strftime('%d-%b-%Y') + " · " + text('WELL NO') + " · "
+            + text('CLASSIFICATION') + " · " + details)
+
+def show_observation_closeout(sheet, df):
+    """Closes open observations, or edits one, in place on the sheet."""
+    flash = st.session_state.pop("closeout_flash", None)
+    if flash:
+        st.success(flash)
+    edit_round = st.session_state.setdefault("closeout_round", 0)
+    with st.expander("✅ Close Out & Edit Observations"):
+        labels = {int(row): label for row, label in observation_labels(df).items()}
+        open_rows = [int(row) for row in df.index[df['STATUS'] == "Open"]] if 'STATUS' in df.columns else []
+        selected = st.multiselect(
+            f"Open observations in the current filter ({len(open_rows)})", open_rows,
+            format_func=labels.get, key=f"closeout_rows_{edit_round}"
+        )
+        if st.button(f"Close {len(selected)} selected", disabled=not selected, key="closeout_button"):
+            try:
+                written = update_records(sheet, "observation", {record_key(df, row): {'STATUS': "CLOSE"} for row in selected})
+            except Exception as e:
+                st.error(f"❌ Could not close the observations: {e}")
+                return
+            st.session_state["closeout_flash"] = f"✅ Closed {written} observation(s)."
+            st.session_state["closeout_round"] = edit_round + 1
+            st.rerun()
+
+        st.markdown("**Edit one observation**")
+        row = st.selectbox(
+            "Observation", list(labels), index=None, format_func=labels.get,
+            placeholder="Choose an observation to edit", key=f"edit_obs_row_{edit_round}"
+        )
+        if row is None:
+            return
+        current = df.loc[row].to_dict()
+        classifications = ["POSITIVE", "UNSAFE CONDITION", "UNSAFE ACT"]
+        with st.form(f"edit_obs_{row}"):
+            col1, col2 = st.columns(2)
+            classification = col1.selectbox(
+                "Classification", classifications,
+                index=classifications.index(current['CLASSIFICATION']) if current.get('CLASSIFICATION') in classifications else 0
+            )
+            status = col2.selectbox("Status", ["OPEN", "CLOSE"], index=1 if current.get('STATUS') == "Close" else 0)
+            details = st.text_area("Observation Details", value=str(current.get('OBSERVATION DETAILS', '')))
+            action = st.text_area("Recommended Action", value=str(current.get('RECOMMENDED ACTION', '')))
+            if st.form_submit_button("Save changes"):
+                edited = {'CLASSIFICATION': classification, 'STATUS': status, 'OBSERVATION DETAILS': details, 'RECOMMENDED ACTION': action}
+                cells = {col: v for col, v in edited.items() if cached_value("observation", col, v) != str(current.get(col, ''))}
+                try:
+                    update_records(sheet, "observation", {record_key(df, row): cells})
+                except Exception as e:
+                    st.error(f"❌ Could not save the observation: {e}")
+                    return
+                st.session_state["closeout_flash"] = f"✅ Row {row_label('observation', row)} updated ({len(cells)} field(s))." if cells else "Nothing to update."
+                st.session_state["closeout_round"] = edit_round + 1
+                st.rerun()
+
+def show_fleet_record_editor(sheet, dataset, headers):
+    """Edits one equipment / vehicle record in place, writing only the changed cells."""
+    fields = REGISTRY_FIELDS[dataset]
+    flash = st.session_state.pop(f"{dataset}_edit_flash", None)
+    if flash:
+        st.success(flash)
+    edit_round = st.session_state.setdefault(f"{dataset}_edit_round", 0)
+    with st.expander("✏️ Update a Record"):
+        raw = load_sheet_frame(sheet, current_project(), dataset)
+        records = {int(row): r for row, r in raw.reindex(columns=[fields["plate"], fields["asset"]]).astype(object).fillna("").to_dict("index").items()}
+        row = st.selectbox(
+            "Record", list(records), index=None, placeholder="Choose a plate / asset code",
+            format_func=lambda row: " · ".join(v for v in (*records[row].values(), f"row {row}") if v),
+            key=f"{dataset}_edit_row_{edit_round}"
+        )
+        if row is None:
+            return
+        current = raw.loc[row].to_dict()
+        date_cols = FLEET_DATE_COLUMNS[dataset]
+        with st.form(f"{dataset}_edit_{row}"):
+            cols = st.columns(2)
+            edited = {}
+            for i, header in enumerate(h for h in headers if h.upper() != RECORD_ID_COLUMN):
+                col = header.upper()
+                value = str(current.get(col, ""))
+                if col in date_cols:
+                    original = parse_date(value)
+                    picked = cols[i % 2].date_input(header, value=original)
+                    # An unchanged date keeps the cell as it was written
+                    edited[col] = value if picked == original else picked.strftime("%d-%b-%Y") if picked else ""
+                else:
+                    edited[col] = cols[i % 2].text_input(header, value=value)
+            if st.form_submit_button("Save changes", use_container_width=True):
+                cells = {col: v for col, v in edited.items() if v != str(current.get(col, ""))}
+                try:
+                    update_records(sheet, dataset, {record_key(raw, row): cells})
+                except Exception as e:
+                    st.error(f"❌ Could not save the record: {e}")
+                    return
+                st.session_state[f"{dataset}_edit_flash"] = f"✅ Row {row} updated ({len(cells)} field(s))." if cells else "Nothing to update."
+                st.session_state[f"{dataset}_edit_round"] = edit_round + 1
+                st.rerun()
+
+# -------------------- LOGIN BACKGROUND ASSETS --------------------
+# The 4 MB source JPEG is never sent as-is. Resized AVIF/WebP/JPEG variants are
+# generated once per process in a background thread and saved under ./static with
+# content-fingerprinted names. They are served by Streamlit's static file route
+# (server.enableStaticServing), which sends an ETag and Last-Modified but no
+# Cache-Control, and the app cannot add headers to it. So browsers keep the image,
+# but revalidate it on later visits: a bodiless 304 rather than the full download.
+# No "immutable" caching. The fingerprint only makes a changed image a new URL.
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGIN_BG_SOURCE = os.path.join(APP_DIR, "login_bg.jpg") # This assumes "login_bg.jpg" is in the SAME folder as "app.py"
+STATIC_DIR = os.path.join(APP_DIR, "static")
+STATIC_URL = "app/static"
+LOGIN_BG_WIDTHS = (640, 1280, 1920)
+LOGIN_BG_FORMATS = (("avif", "AVIF", {"quality": 50}), ("webp", "WEBP", {"quality": 70, "method": 6}), ("jpeg", "JPEG", {"quality": 72, "progressive": True, "optimize": True}))
+
+def generate_login_variants():
+    """Writes the resized variants (skipping ones already on disk). Returns {width: {format: filename}}."""
+    from PIL import Image, features
+
+    with open(LOGIN_BG_SOURCE, "rb") as f:
+        fingerprint = hashlib.sha1(f.read()).hexdigest()[:10]
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    variants, missing = {}, {}
+    for width in LOGIN_BG_WIDTHS:
+        for ext, pil_format, options in LOGIN_BG_FORMATS:
+            if ext in ("avif", "webp") and not features.check(ext):
+                continue
+            filename = f"login_bg.{fingerprint}.{width}.{ext}"
+            variants.setdefault(width, {})[ext] = filename
+            if not os.path.exists(os.path.join(STATIC_DIR, filename)):
+                missing.setdefault(width, []).append((filename, pil_format, options))
+    if not missing:
+        return variants # Already generated by an earlier process; no need to decode the source
+
+    with Image.open(LOGIN_BG_SOURCE) as source:
+        source = source.convert("RGB")
+        for width, outputs in missing.items():
+            resized = source.resize((width, round(source.height * width / source.width)), Image.LANCZOS)
+            for filename, pil_format, options in outputs:
+                path = os.path.join(STATIC_DIR, filename)
+                resized.save(path + ".tmp", pil_format, **options)
+                os.replace(path + ".tmp", path)
+    return variants
+
+@st.cache_resource(show_spinner=False)
+def login_background_job():
+    """Starts variant generation once per process; the result is filled in when done."""
+    job = {"variants": None, "error": None}
+
+    def run():
+        try:
+            job["variants"] = generate_login_variants()
+        except Exception as e: # Missing image or Pillow problem: fall back to a plain background
+            job["error"] = e
+
+    threading.Thread(target=run, name="login-bg-variants", daemon=True).start()
+    return job
+
+@st.cache_resource(show_spinner=False)
+def warm_heavy_imports():
+    """Imports the deferred modules in the background, once per process."""
+    registry = get_perf_registry()
+
+    def run():
+        for name in HEAVY_MODULES:
+            start = time.perf_counter()
+            importlib.import_module(name)
+            registry.observe(f"import.{name}", time.perf_counter() - start)
+
+    thread = threading.Thread(target=run, name="warm-imports", daemon=True)
+    thread.start()
+    return thread
+
+def _image_set(files):
+    sources = [f'url("{STATIC_URL}/{files[ext]}") type("image/{ext}")' for ext, _, _ in LOGIN_BG_FORMATS if ext in files]
+    return f'url("{STATIC_URL}/{files["jpeg"]}"); background-image: image-set({", ".join(sources)})'
+
+@st.cache_resource(show_spinner=False)
+def _login_background_css(variants_key):
+    variants = login_background_job()["variants"]
+    if st.get_option("server.enableStaticServing"):
+        rules = []
+        for i, width in enumerate(sorted(variants)):
+            rule = f'[data-testid="stAppViewContainer"] {{ background-image: {_image_set(variants[width])}; }}'
+            if i < len(variants) - 1:
+                rule = f"@media (max-width: {width}px) {{ {rule} }}"
+            rules.insert(0, rule) # Wider breakpoints first so narrower media queries win
+        images = "\n".join(rules)
+    else:
+        # Static serving disabled: inline the smallest variant rather than the 4 MB original
+        smallest = variants[min(variants)]
+        ext = "webp" if "webp" in smallest else "jpeg"
+        images = (f'[data-testid="stAppViewContainer"] {{ background-image: '
+                  f'url("data:image/{ext};base64,{get_img_as_base64(os.path.join(STATIC_DIR, smallest[ext]))}"); }}')
+    return f"""
         <style>
+        {images}
         [data-testid="stAppViewContainer"] {{
-            background-image: url("data:image/{mime_type};base64,{img_base64}");
+            background-color: #1f2a36;
             background-size: cover;
             background-position: center;
             background-repeat: no-repeat;
             background-attachment: fixed;
         }}
-        
+
         /* This makes the main content area transparent so the background shows through */
         [data-testid="stAppViewContainer"] > .main {{
             background-color: transparent !important;
@@ -164,6 +3151,302 @@ def login():
         </style>
         """
 
+def login_background_css():
+    """CSS for the login background; empty until the variants are ready."""
+    variants = login_background_job()["variants"]
+    if not variants:
+        return ""
+    return _login_background_css(tuple(sorted(variants)))
+
+# -------------------- DATA PREFETCH --------------------
+# As soon as a user logs in, the pages they are likely to open are warmed in a
+# background thread: their worksheets are opened and the cached loads those pages
+# make (sheet reads, cleaning, the dashboard's default date ranges, indexes, site
+# risk) are run, so the first view renders from warm caches. Predictions come from
+# the user's page history, or from their role until they have enough of one.
+PAGE_HISTORY_FILE = os.path.join(ARCHIVE_DIR, "page_history.json")
+PREFETCH_ROLE_DEFAULTS = {"admin": ("dashboard",)}
+PREFETCH_MIN_VISITS = 5 # Visits recorded before a user's own history replaces the role defaults
+PREFETCH_MIN_SHARE = 0.2 # Pages below this share of a user's visits are not prefetched
+PREFETCH_MAX_PAGES = 2
+PREFETCH_INTERVAL = DATA_TTL # Seconds before the same user's logins prefetch again
+
+class PageHistory:
+    """Per-user visit counts of the pages that can be prefetched, kept across restarts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        try:
+            with open(PAGE_HISTORY_FILE) as f:
+                self.counts = json.load(f) # user -> {page slug: visits}
+        except (OSError, ValueError):
+            self.counts = {}
+
+    def record(self, user, page):
+        with self.lock:
+            pages = self.counts.setdefault(user, {})
+            pages[page] = pages.get(page, 0) + 1
+            with contextlib.suppress(OSError): # History is a hint; never fail a page over it
+                os.makedirs(os.path.dirname(PAGE_HISTORY_FILE), exist_ok=True)
+                with open(PAGE_HISTORY_FILE + ".tmp", "w") as f:
+                    json.dump(self.counts, f)
+                os.replace(PAGE_HISTORY_FILE + ".tmp", PAGE_HISTORY_FILE)
+
+    def likely_pages(self, user, role):
+        """The pages worth prefetching for `user`, most visited first."""
+        with self.lock:
+            pages = dict(self.counts.get(user, {}))
+        total = sum(pages.values())
+        if total < PREFETCH_MIN_VISITS:
+            return list(PREFETCH_ROLE_DEFAULTS.get(role, ()))
+        ranked = sorted(pages, key=pages.get, reverse=True)
+        return [page for page in ranked if pages[page] / total >= PREFETCH_MIN_SHARE][:PREFETCH_MAX_PAGES]
+
+@st.cache_resource(show_spinner=False)
+def get_page_history():
+    return PageHistory()
+
+def prefetch_dashboard():
+    """The loads of the dashboard's first view, with its default filters."""
+    obs_sheet, permit_sheet, equip_sheet, vehicle_sheet = get_sheets("observation", "permit", "equipment", "vehicle")
+    recent_log(obs_sheet, "observation", 30)
+    recent_log(permit_sheet, "permit", 30)
+    load_fleet_frame(equip_sheet, "equipment")
+    load_fleet_frame(vehicle_sheet, "vehicle")
+    load_site_risk(obs_sheet, permit_sheet, next(iter(SITE_RISK_PERIODS)), reference())
+
+def prefetch_form(dataset):
+    """Opens a form's worksheet and brings its duplicate-check and lookup indexes up to date."""
+    project = current_project()
+    sheet = get_worksheet(project, dataset)
+    if dataset in LOG_DATASETS:
+        sync_log(sheet, dataset)
+    if dataset in DUPLICATE_KEYS:
+        find_duplicates(sheet, dataset, {})
+    if dataset in REGISTRY_FIELDS:
+        get_asset_registry(project, dataset).sync_frame(load_sheet_frame(sheet, project, dataset))
+
+PREFETCH_TASKS = { # page slug -> warm-up
+    "dashboard": prefetch_dashboard,
+    "observation_form": lambda: prefetch_form("observation"),
+    "permit_form": lambda: prefetch_form("permit"),
+    "heavy_equipment": lambda: prefetch_form("equipment"),
+    "heavy_vehicle": lambda: prefetch_form("vehicle"),
+}
+
+BACKGROUND_THREAD_PREFIXES = ("prefetch-", "aggregates-api")
+
+@st.cache_resource(show_spinner=False)
+def quiet_background_threads():
+    """Background threads belong to no session, which Streamlit logs on every cached call."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    logging.getLogger(get_script_run_ctx.__module__).addFilter(
+        lambda record: not threading.current_thread().name.startswith(BACKGROUND_THREAD_PREFIXES)
+    )
+
+@st.cache_resource(show_spinner=False)
+def prefetch_runs():
+    """(user, project) -> start time of their last prefetch, shared by all sessions."""
+    quiet_background_threads()
+    return {"lock": threading.Lock(), "started": {}}
+
+def start_prefetch(user, role, project):
+    """Warms the caches of the pages `user` is likely to open in `project`, in a background thread."""
+    pages = [page for page in get_page_history().likely_pages(user, role) if page in PREFETCH_TASKS]
+    runs = prefetch_runs()
+    with runs["lock"]:
+        if not pages or time.time() - runs["started"].get((user, project), 0) < PREFETCH_INTERVAL:
+            return
+        runs["started"][user, project] = time.time()
+    session = st.session_state.setdefault("session_tag", uuid.uuid4().hex[:8])
+
+    def run():
+        get_api_ledger().set_context(session, user, "prefetch") # Counted against the user's read budget
+        get_project_registry().use(project)
+        for page in pages:
+            try:
+                with timed(f"prefetch.{page}"):
+                    PREFETCH_TASKS[page]()
+            except Exception: # A failed prefetch only means a cold first view
+                pass
+
+    threading.Thread(target=run, name=f"prefetch-{user}", daemon=True).start()
+
+# -------------------- AGGREGATES API --------------------
+# A small read-only JSON endpoint for other tools (site TV screens, the weekly
+# slides) so they stop polling Google Sheets themselves. It runs in this process
+# and reads the same caches as the dashboard, so a consumer adds no Sheets load.
+# Responses carry an ETag; a poll whose If-None-Match lists it (or is "*") gets a bodiless 304.
+# Requests are served on their own threads, so a cold read from Sheets for one
+# consumer does not hold up the others.
+#   GET /summary  /observations?days=30  /permits?days=30  (each takes &project=<id>)
+#   GET /expiry?days=30  documents expired, or expiring within `days`
+#   GET /projects?days=30  the summary of every project, and their totals
+AGGREGATES_API_HOST = os.environ.get("APP_AGGREGATES_HOST", "127.0.0.1")
+AGGREGATES_API_PORT = int(os.environ.get("APP_AGGREGATES_PORT", "8502")) # 0 disables the endpoint
+AGGREGATES_DEFAULT_DAYS = 30
+
+def _counts(df, col):
+    return {str(k): int(v) for k, v in observed_counts(df[col]).items()} if col in df.columns else {}
+
+def observation_aggregates(days=AGGREGATES_DEFAULT_DAYS):
+    start, end, df = recent_log(get_worksheet(current_project(), "observation"), "observation", days)
+    return {
+        "from": start and start.isoformat(), "to": end and end.isoformat(), "total": len(df),
+        "open": int((df['STATUS'] == "Open").sum()) if 'STATUS' in df.columns else 0,
+        "unsafe": int(df['CLASSIFICATION'].isin(UNSAFE_CLASSES).sum()) if 'CLASSIFICATION' in df.columns else 0,
+        "by_classification": _counts(df, 'CLASSIFICATION'),
+        "by_status": _counts(df, 'STATUS'),
+    }
+
+def permit_aggregates(days=AGGREGATES_DEFAULT_DAYS):
+    start, end, df = recent_log(get_worksheet(current_project(), "permit"), "permit", days)
+    by_site = {}
+    if {'DRILL SITE', 'TYPE OF PERMIT'} <= set(df.columns):
+        for (site, permit_type), n in df.groupby(['DRILL SITE', 'TYPE OF PERMIT'], observed=True).size().items():
+            by_site.setdefault(str(site), {})[str(permit_type)] = int(n)
+    return {
+        "from": start and start.isoformat(), "to": end and end.isoformat(), "total": len(df),
+        "by_type": _counts(df, 'TYPE OF PERMIT'),
+        "by_site": by_site,
+    }
+
+def expiry_aggregates(days=EXPIRING_SOON_DAYS):
+    """Expired and expiring-soon (within `days`) documents per register, with one alert per document."""
+    today = date.today().isoformat()
+    soon = (date.today() + timedelta(days=days)).isoformat()
+    registers = {}
+    for dataset in ("equipment", "vehicle"):
+        state = compliance_state(load_fleet_frame(get_worksheet(current_project(), dataset), dataset), dataset)
+        documents = collections.defaultdict(lambda: {"expired": 0, "expiring_soon": 0})
+        alerts = []
+        for asset, docs in sorted(state.items()):
+            for doc, expiry in docs.items():
+                status = None if expiry is None else "expired" if expiry < today else "expiring_soon" if expiry <= soon else None
+                if status:
+                    documents[doc][status] += 1
+                    alerts.append({"asset": asset, "document": doc, "expires": expiry, "status": status})
+        registers[dataset] = {"assets": len(state), "documents": dict(documents), "alerts": alerts}
+    return registers
+
+def summary_aggregates(days=AGGREGATES_DEFAULT_DAYS):
+    expiry = expiry_aggregates()
+    return {
+        "observations": {k: v for k, v in observation_aggregates(days).items() if not k.startswith("by_")},
+        "permits": {k: v for k, v in permit_aggregates(days).items() if not k.startswith("by_")},
+        "expiry": {dataset: register["documents"] for dataset, register in expiry.items()},
+    }
+
+@st.cache_resource(ttl=DATA_TTL, show_spinner=False)
+def project_rollup(project, days=AGGREGATES_DEFAULT_DAYS):
+    """summary_aggregates of one project. Unless a session is working in that project,
+    the rows loaded for it are evicted again, so rolling up every project never holds
+    all of their rows at once."""
+    with project_scope(project):
+        rollup = summary_aggregates(days)
+    if not get_project_registry().in_use(project):
+        evict_project(project)
+    return rollup
+
+def all_projects_aggregates(days=AGGREGATES_DEFAULT_DAYS):
+    """Every project's rollup, computed one project at a time, and their totals."""
+    registry = get_project_registry()
+    projects, errors = {}, {}
+    for project in registry.projects:
+        try:
+            projects[project] = {"name": registry.name(project), **project_rollup(project, days)}
+        except Exception as e: # One unreachable workbook must not hide the other projects
+            errors[project] = str(e)
+    totals = {
+        "observations": {k: sum(p["observations"][k] for p in projects.values()) for k in ("total", "open", "unsafe")},
+        "permits": {"total": sum(p["permits"]["total"] for p in projects.values())},
+        "expiry": {
+            dataset: {status: sum(
+                counts[status] for p in projects.values() for counts in p["expiry"][dataset].values()
+            ) for status in ("expired", "expiring_soon")}
+            for dataset in ("equipment", "vehicle")
+        },
+    }
+    return {"projects": projects, "errors": errors, "totals": totals}
+
+AGGREGATES_ROUTES = {
+    "/summary": summary_aggregates,
+    "/observations": observation_aggregates,
+    "/permits": permit_aggregates,
+    "/expiry": expiry_aggregates,
+    "/projects": all_projects_aggregates,
+}
+
+class AggregatesHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        route = AGGREGATES_ROUTES.get(url.path.rstrip("/"))
+        if route is None:
+            return self._send(404, {"error": "Unknown endpoint", "endpoints": sorted(AGGREGATES_ROUTES)})
+        query = urllib.parse.parse_qs(url.query)
+        kwargs = {}
+        if "days" in query: # Each route has its own default
+            try:
+                kwargs["days"] = int(query["days"][0])
+            except ValueError:
+                return self._send(400, {"error": "days must be a whole number"})
+            if kwargs["days"] < 0:
+                return self._send(400, {"error": "days must not be negative"})
+        projects = get_project_registry().projects
+        project = query.get("project", [next(iter(projects))])[0]
+        if project not in projects:
+            return self._send(404, {"error": "Unknown project", "projects": sorted(projects)})
+        get_api_ledger().set_context("aggregates-api", "system", "aggregates_api") # Per request thread
+        try:
+            with timed(f"aggregates{url.path.rstrip('/').replace('/', '.')}"), project_scope(project):
+                payload = route(**kwargs)
+        except Exception as e: # Sheets unreachable, read budget, ...: the consumer retries later
+            return self._send(503, {"error": str(e)})
+        self._send(200, payload)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+        if status == 200 and etag_matches(self.headers.get("If-None-Match"), etag):
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache") # Revalidate with the ETag on every poll
+        if status != 304:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Polled every few seconds; timings go to the perf registry instead
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches `etag`: "*", or one of its comma-separated
+    tags compared weakly (a W/ prefix is ignored), as for a GET."""
+    tags = [tag.strip() for tag in (if_none_match or "").split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+@st.cache_resource(show_spinner=False)
+def aggregates_api():
+    """Starts the endpoint once per process; later calls are cache hits. Returns the server,
+    the error that kept it from starting (e.g. the port is taken by another app process),
+    or None when disabled."""
+    if not AGGREGATES_API_PORT:
+        return None
+    quiet_background_threads()
+    try:
+        server = http.server.ThreadingHTTPServer((AGGREGATES_API_HOST, AGGREGATES_API_PORT), AggregatesHandler)
+    except OSError as e:
+        return e
+
+    threading.Thread(target=server.serve_forever, name="aggregates-api", daemon=True).start()
+    return server
+
+# -------------------- LOGIN PAGE --------------------
+def login():
+    background_css = login_background_css()
+
     st.markdown(f"""
     {background_css}
     <style>
@@ -220,42 +3503,179 @@ def login():
         user = USER_CREDENTIALS.get(username)
         if user and user["password"] == password:
             st.session_state.update(logged_in=True, username=username, role=user["role"])
+            projects = get_project_registry().available(username, user["role"])
+            if projects:
+                start_prefetch(username, user["role"], projects[0]) # Runs while the Home page renders
             st.rerun()
         else:
             st.error("❌ Invalid username or password")
 # -------------------- END OF LOGIN --------------------
 
-# -------------------- SIDEBAR --------------------
-def sidebar():
-    with st.sidebar:
-        st.title("🧭 Navigation")
-        menu_options = [
-            "🏠 Home", "📝 Observation Form", "🛠️ Permit Form",
-            "🏗️ Equipments", "📊 Dashboard", "🚪 Logout"
+# -------------------- PAGES --------------------
+# Each page declares the worksheets it needs; only those are opened when it runs.
+# Admin pages are only registered for admins, so other users cannot navigate to them.
+def show_home():
+    st.title("📋 Onsite Reporting System")
+    st.write(f"Welcome, **{st.session_state.get('username')}**!")
+    registry = get_project_registry()
+    if len(registry.projects) > 1:
+        st.caption(f"Project: {registry.name(current_project())}")
+    st.info("Select an option from the sidebar to begin.")
+    if st.session_state.get("role") == "admin":
+        store = get_reference_store()
+        ref = reference()
+        st.caption(f"Reference data v{ref['version']}, loaded {store.loaded_at:%d-%b-%Y %H:%M:%S}")
+        if store.error:
+            st.warning(f"Reference data edit not applied, still serving v{ref['version']}: {store.error}")
+        api = aggregates_api()
+        if isinstance(api, OSError):
+            st.warning(f"Aggregates API not running: {api}")
+        elif api:
+            st.caption(f"Aggregates API: http://{AGGREGATES_API_HOST}:{AGGREGATES_API_PORT}/summary")
+
+def logout():
+    st.session_state.clear()
+    st.rerun()
+
+def make_page(title, icon, datasets, render, default=False):
+    """An st.Page that acquires `datasets` worksheets and passes them to `render`."""
+    slug = page_slug(title)
+
+    def run():
+        set_api_context(slug)
+        if slug in PREFETCH_TASKS and st.session_state.get("last_page") != slug:
+            get_page_history().record(st.session_state.get("username"), slug)
+        st.session_state["last_page"] = slug
+        try:
+            sheets = get_sheets(*datasets)
+        except Exception as e:
+            st.error(f"Failed to connect to Google Sheets. Please check your connection and secrets.")
+            st.error(f"Error details: {e}")
+            return # Stop if sheets can't be loaded
+        # Whole-page rerun latency, per page
+        with timed(f"rerun.{slug}"):
+            render(*sheets)
+
+    return st.Page(run, title=title, icon=icon, url_path=slug, default=default)
+
+def app_pages():
+    """The sidebar navigation for the logged-in user, by section."""
+    pages = {
+        "": [make_page("Home", "🏠", (), show_home, default=True)],
+        "Forms": [
+            make_page("Observation Form", "📝", ("observation",), show_observation_form),
+            make_page("Permit Form", "🛠️", ("permit",), show_permit_form),
+            make_page("Heavy Equipment", "🚜", ("equipment",), show_equipment_form),
+            make_page("Heavy Vehicle", "🚚", ("vehicle",), show_heavy_vehicle_form),
+        ],
+    }
+    if st.session_state.get("role") == "admin":
+        pages["Admin"] = [
+            make_page("Dashboard", "📊", ("observation", "permit", "equipment", "vehicle"), show_combined_dashboard),
+            make_page("Bulk Import", "📥", (), show_bulk_import),
+            make_page("Data Quality", "🧪", ("observation", "permit", "equipment", "vehicle"), show_data_quality),
+            make_page("API Usage", "📡", (), show_api_usage),
+            make_page("Memory", "🧠", (), show_memory_usage),
         ]
-        menu = st.selectbox("Go to", menu_options, key="main_menu")
-
-        if menu == "🏗️ Equipments":
-            sub_menu = st.selectbox("Select Equipment", ["🚜 Heavy Equipment", "🚚 Heavy Vehicle"], key="equip_sub")
-            return sub_menu
-        return menu
+        if len(get_project_registry().projects) > 1:
+            pages["Admin"].insert(1, make_page("All Projects", "🌐", (), show_all_projects))
+    pages["Account"] = [make_page("Logout", "🚪", (), logout)]
+    return pages
 
 # -------------------- FORMS --------------------
+def submit_record(sheet, dataset, data, record, success_msg):
+    """Appends a row unless it repeats a key of an existing record.
+
+    Duplicates are parked in session state (the form has already been cleared)
+    and resolved by `resolve_pending_submission` before anything is written.
+    """
+    try:
+        duplicates = find_duplicates(sheet, dataset, record)
+    except Exception as e:
+        st.error(f"❌ Could not check for duplicates: {e}")
+        return
+    if duplicates:
+        st.session_state[f"pending_{dataset}"] = {"data": data, "duplicates": duplicates, "success_msg": success_msg}
+        return
+    try:
+        writable_sheet(sheet, dataset).append_row(data)
+        invalidate_dataset(dataset)
+        st.success(success_msg)
+    except Exception as e:
+        st.error(f"❌ Error submitting data: {e}")
+
+def merge_record(stored, submitted):
+    """The row an update writes: the submitted values, except where a form field was
+    left blank, which keeps the stored value (insurance dates, TP card, ...)."""
+    width = max(len(stored), len(submitted))
+    stored, submitted = (list(values) + [""] * (width - len(values)) for values in (stored, submitted))
+    return [new if str(new).strip() else old for old, new in zip(stored, submitted)]
+
+def record_changes(sheet, dataset, row, data):
+    """(header, stored, submitted) of each field an update of sheet row `row` would change,
+    judged against the cached sheet."""
+    headers = WORKSHEETS[dataset][2]
+    frame = load_sheet_frame(sheet, current_project(), dataset)
+    stored = [str(frame.at[row, h.strip().upper()]) if row in frame.index and h.strip().upper() in frame.columns else "" for h in headers]
+    merged = merge_record(stored, keep_record_id(dataset, row, data))
+    return [(h, old, new) for h, old, new in zip(headers, stored, merged) if old != new]
+
+def resolve_pending_submission(sheet, dataset, allow_update=True):
+    """Shows the duplicate warning for a parked submission and applies the user's choice."""
+    flash = st.session_state.pop(f"flash_{dataset}", None)
+    if flash:
+        st.success(flash)
+    pending = st.session_state.get(f"pending_{dataset}")
+    if not pending:
+        return
+    existing_rows = sorted({row for _, _, rows in pending["duplicates"] for row in rows})
+    st.warning(
+        "⚠️ Possible duplicate — not submitted yet:\n\n" + "\n".join(
+            f"- **{col.title()}** `{value}` already exists in sheet row(s) {', '.join(row_label(dataset, row) for row in rows)}"
+            for col, value, rows in pending["duplicates"]
+        )
+    )
+    if allow_update and len(existing_rows) == 1:
+        changes = record_changes(sheet, dataset, existing_rows[0], pending["data"])
+        st.markdown(
+            f"Updating row {existing_rows[0]} changes only the fields filled in on the form:\n\n"
+            + "\n".join(f"- **{h}**: `{old or '—'}` → `{new}`" for h, old, new in changes)
+            if changes else f"Updating row {existing_rows[0]} would change nothing: the filled-in fields match it."
+        )
+    col_new, col_update, col_cancel = st.columns(3)
+    try:
+        if col_new.button("Submit as new record", key=f"dup_new_{dataset}", use_container_width=True):
+            writable_sheet(sheet, dataset).append_row(pending["data"])
+            flash = pending["success_msg"]
+        elif (allow_update and len(existing_rows) == 1 and
+              col_update.button(f"Update existing record (row {existing_rows[0]})", key=f"dup_update_{dataset}", use_container_width=True)):
+            stored = sheet.row_values(existing_rows[0]) # Merged against the sheet as it is now, not the cached copy
+            sheet.update(f"A{existing_rows[0]}", [merge_record(stored, keep_record_id(dataset, existing_rows[0], pending["data"]))])
+            flash = f"✅ Row {existing_rows[0]} updated successfully!"
+        elif not col_cancel.button("Cancel", key=f"dup_cancel_{dataset}", use_container_width=True):
+            return
+    except Exception as e:
+        st.error(f"❌ Error submitting data: {e}")
+        return
+    if flash:
+        invalidate_dataset(dataset)
+        st.session_state[f"flash_{dataset}"] = flash
+    del st.session_state[f"pending_{dataset}"]
+    st.rerun()
+
 def show_equipment_form(sheet):
     st.header("🚜 Heavy Equipment Entry Form")
-    EQUIPMENT_LIST = [
-        "Excavator", "Backhoe Loader", "Wheel Loader", "Bulldozer", "Motor Grader", "Compactor / Roller",
-        "Crane", "Forklift", "Boom Truck", "Side Boom", "Hydraulic Drill Unit", "Telehandler", "Skid Loader"
-    ]
+    equipment_types = reference()["equipment_types"]
+    show_asset_lookup(sheet, "equipment", equipment_types)
     with st.form("equipment_form", clear_on_submit=True):
         cols = st.columns(2)
-        equipment_type = cols[0].selectbox("Equipment type", EQUIPMENT_LIST)
-        make = cols[1].text_input("Make")
-        plate_no = cols[0].text_input("Palte No.")
-        asset_code = cols[1].text_input("Asset code")
-        owner = cols[0].text_input("Owner")
-        operator_name = cols[1].text_input("Operator Name")
-        iqama_no = cols[0].text_input("Iqama NO")
+        equipment_type = cols[0].selectbox("Equipment type", equipment_types, key="eq_type")
+        make = cols[1].text_input("Make", key="eq_make")
+        plate_no = cols[0].text_input("Palte No.", key="eq_plate")
+        asset_code = cols[1].text_input("Asset code", key="eq_asset")
+        owner = cols[0].text_input("Owner", key="eq_owner")
+        operator_name = cols[1].text_input("Operator Name", key="eq_operator")
+        iqama_no = cols[0].text_input("Iqama NO", key="eq_iqama")
 
         st.subheader("Expiry Dates")
         cols_dates = st.columns(2)
@@ -269,9 +3689,9 @@ def show_equipment_form(sheet):
 
         st.subheader("T.P Card & Status")
         cols_status = st.columns(2)
-        tp_card_type = cols_status[0].selectbox("T.P Card Type", ["SPSP", "Aramco", "PAX", "N/A"])
+        tp_card_type = cols_status[0].selectbox("T.P Card Type", TP_CARD_TYPES)
         tp_card_number = cols_status[1].text_input("T.P Card Number")
-        pwas_status = cols_status[0].selectbox("PWAS Status", ["Working", "Not Working", "Alarm Not Audible", "Faulty Camera/Monitor", "N/A"])
+        pwas_status = cols_status[0].selectbox("PWAS Status", PWAS_OPTIONS)
         fa_box_status = cols_status[1].text_input("FA box Status")
         qr_code = cols_status[0].text_input("Q.R code")
         documents = cols_status[1].text_input("Documents")
@@ -281,83 +3701,19 @@ def show_equipment_form(sheet):
             data = [
                 equipment_type, make, plate_no, asset_code, owner, tp_insp_date, tp_expiry,
                 insurance_expiry, operator_name, iqama_no, tp_card_type, tp_card_number,
-                tp_card_expiry, qr_code, pwas_status, fa_box_status, documents
+                tp_card_expiry, qr_code, pwas_status, fa_box_status, documents, new_record_id("equipment")
             ]
-            
-            try:
-                sheet.append_row(data)
-                st.success("✅ Equipment submitted successfully!")
-            except Exception as e:
-                st.error(f"❌ Error submitting data: {e}")
+            record = {"PALTE NO.": plate_no, "ASSET CODE": asset_code, "T.P INSPECTION DATE": tp_insp_date}
+            submit_record(sheet, "equipment", data, record, "✅ Equipment submitted successfully!")
+
+    resolve_pending_submission(sheet, "equipment")
 
 #--------------------------------------------------------------- HSE OBSERVATION FORM-----------------------------------------------------------------------------------------------
 def show_observation_form(sheet):
     st.header("📋 Daily HSE Site Observation Entry Form")
     
-    OBSERVER_NAMES = [
-        "AJISH", "AKHIL MOHAN", "AQIB", "ARFAN", "ASIM", "ASHRAF KHAN", "BIJO",
-        "FELIN", "HABEEB", "ILYAS", "IRFAN", "JAMALI", "JOSEPH CRUZ", "MOHSIN",
-        "PRADEEP", "RAJSHEKAR", "RICKEN", "SHIVA KANNAN", "SHIVA SUBRAMANIYAM",
-        "SUDISH", "VAISHAK", "VARGHEESE", "WALI ALAM", "ZAHEER"
-    ]
-    
-    AREAS = [
-        "Well Head", "Flow Line", "OHPL", "Tie In",
-        "Lay Down", "Cellar", "Remote Header"
-    ]
-
-    CATEGORIES = [
-        "Fall Protection/Personal Fall Arrest System Use/Falling Hazard",
-        "Trenching/Excavation/Shoring",
-        "Scaffolds, Ladders and Elevated work platforms",
-        "Crane and Lifting Devices",
-        "Heavy Equipment",
-        "Vehicles / Traffic Control",
-        "Hand/Power Tools and Electrical appliances",
-        "Electrical Safety",
-        "Hot work (Cutting/Welding/Brazing)",
-        "Fire prevention & Protection",
-        "Abrasive Blasting and Coating",
-        "Confined Space / Restricted area",
-        "Civil, Concrete Work",
-        "Compressed Gases",
-        "General Equipment's (Air Compressors/Power Generator etc.)",
-        "Work Permit, Risk Assessment, JSA & other procedures",
-        "Chemical Handling and Hazardous material",
-        "Environmental / Waste Management",
-        "Health, hygiene & welfare",
-        "Radiation and NDT",
-        "Security, Unsafe Behavior, and other project Requirements",
-        "PPE",
-        "House Keeping"
-    ]
-
-    SUPERVISOR_TRADE_MAP = {
-"RAJA KUMAR": "CONTROLLER-EQUIPMENT", "SREEDHARAN VISWANATHAN": "SUPERVISOR-PIPING",
-"MANOJ THOMAS": "WELL IN CHARGE", "ANIL KUMAR JANARDHANAN": "WELL IN CHARGE",
-"SIVA PRASAD PILLAI": "FOREMAN-PIPING", "JAYAN RAJAJAN": "FOREMAN-PIPING",
-"MURUGAN VANNIYAPERUMAL": "COORDINATOR-NDE", "ANU MOHAN MOHANAN PILLAI": "FIELD ADMINISTRATOR",
-"BHARAT CHANDRABARAL": "ASSISTANT-STORE", "SUMOD PRABHAKARA": "LAND SURVEYOR",
-"DHARMA RAJU UPPADA": "FOREMAN-HYDRO TEST", "JEFFREY F. TABAMO": "CONSTRUCTION SUPERVISOR-E & I",
-"ORLANDO GURGUD": "SUPERVISOR-PAINTING CREW", "RICHARD REYES RIVERAL": "SUPERVISOR-PAINTING CREW",
-"AJIMAL SULFIKAR": "SUPERVISOR-PIPING", "ARVIND KUMAR": "SUPERVISOR-CIVIL",
-"MAQSUD ALAM": "CONSTRUCTION SUPERVISOR-PIPING", "SIFAT MEHDI": "FOREMAN-INSTRUMENTATION",
-"SAJU SADANANDAN": "SUPERVISOR-CIVIL", "SASIDHARA KURUP": "FOREMAN-ELECTRICAL",
-"ALVIN CHARLY": "CONSTRUCTION SUPERVISOR-E & I", "PAWAN KUMAR YADAV": "FOREMAN-CIVIL",
-"BRIHASPATI ADAK": "FOREMAN-CIVIL", "JITHIN JOHN": "CONSTRUCTION SUPERVISOR-CIVIL",
-"RAVI SINGH": "SUPERVISOR-CIVIL", "ANILKUMAR SAHADEVAN": "SUPERVISOR-CIVIL",
-"BALA KRISHNA": "FOREMAN-CIVIL", "SUNIL KUMARSAHU": "FOREMAN-CIVIL",
-"RAJESHWAR YASOJI NARAYANA": "SUPERVISOR-SCAFFOLDING", "ASHWANI KUMAR YADAV": "FOREMAN-CIVIL",
-"QUAISAR ALI": "SUPERVISOR-ELECTRICAL", "ABHISHEK REGHUVARAN": "SUPERVISOR-PIPING",
-"ZEESHAN YOUSUF": "SUPERVISOR-CIVIL", "MOHAMMAD RAUSHAN": "SUPERVISOR-CIVIL",
-"AHAMED RIYAZ ASHRAE ALI": "SUPERVISOR-CIVIL", "ASLAM KHAN ALBAN": "FOREMAN-SCAFFOLDING",
-"SURESH KUMAR": "WELL IN CHARGE", "ANOOPKUMAR": "SUPERVISOR-ELECTRICAL",
-"VAISHNAV VINOD SREEJA": "SUPERVISOR-PIPING", "MOHAMMED MUHANNA AL WOSAIFER": "ENGINEER-MECHANICAL",
-"HISHAM IBRAHIM AL FARHAN": "ADMIN ASSISTANT", "HASSAN FAYAA MOHAMMED MASHNI": "ELECTRICAL ENGINEER",
-"ABDALLAH MOHAMMED ALMOTAWA": "ENGINEER-MECHANICAL", "RAJA ALAGAPPAN": "SUPERVISOR-PAINTING CREW",
-"SURESHKUMAR": "CONSTRUCTION SUPERVISOR-PIPING","GOPAN": "SUPERVISOR-CIVIL","BHARATH":"STORE KEEPER","HAROON":"STORE KEEPER","BIVIN":"FOREMAN-PIPING"
-    }
-    
+    ref = reference()
+    SUPERVISOR_TRADE_MAP = ref["supervisor_trades"]
     supervisor_names = [""] + sorted(list(SUPERVISOR_TRADE_MAP.keys()))
 
     with st.form("obs_form", clear_on_submit=True):
@@ -365,13 +3721,13 @@ def show_observation_form(sheet):
 
         with col1:
             form_date = st.date_input("Date")
-            area = st.selectbox("Area", AREAS)
-            observer_name = st.selectbox("Observer Name", OBSERVER_NAMES)
+            area = st.selectbox("Area", ref["areas"])
+            observer_name = st.selectbox("Observer Name", ref["observers"])
             classification = st.selectbox("Classification", ["POSITIVE", "UNSAFE CONDITION", "UNSAFE ACT"])
-            category = st.selectbox("Category", CATEGORIES)
+            category = st.selectbox("Category", ref["categories"])
             
         with col2:
-            well_no = st.selectbox("Well No", ALL_SITES) # Uses the master ALL_SITES list
+            well_no = st.selectbox("Well No", ref["sites"])
             supervisor_name = st.selectbox("Supervisor Name", supervisor_names)
             trade = SUPERVISOR_TRADE_MAP.get(supervisor_name, "")
             discipline = st.text_input("Discipline", value=trade, disabled=True)
@@ -395,7 +3751,9 @@ def show_observation_form(sheet):
                 status
             ]
             try:
-                sheet.append_row(data)
+                sheet = writable_sheet(sheet, "observation")
+                sheet.append_row(with_record_id(sheet, "observation", data))
+                invalidate_dataset("observation")
                 st.success("✅ Observation submitted successfully!")
             except Exception as e:
                 st.error(f"❌ Error submitting data: {e}")
@@ -403,94 +3761,23 @@ def show_observation_form(sheet):
 def show_permit_form(sheet):
     st.header("🛠️ Daily Internal Permit Log")
     
-    WORK_LOCATIONS = [
-        "Well Head", "OHPL", "OPTF", "E&I Skid", "Burn Pit", "Cellar",
-        "Flow Line", "Lay down", "CP area","BD-Line"
-    ]
-    PERMIT_TYPES = ["Hot", "Cold", "CSE", "EOLB"]
-    PERMIT_ISSUERS = ["UNNIMON SRINIVASAN","VISHNU MOHAN"]
-    PERMIT_RECEIVERS = [
-        "MD MEHEDI HASAN NAHID","ALWIN", "JEFFREY VERBO YOSORES", "RAMESH KOTHAPALLY BHUMAIAH",
-        "ALAA ALI ALI ALQURAISHI", "VALDIMIR FERNANDO", "PRINCE BRANDON LEE RAJU",
-        "JEES RAJ RAJAN ALPHONSA", "BRAYAN DINESH", "EZBORN NGUNYI MBATIA",
-        "AHILAN THANKARAJ", "MOHAMMAD FIROZ ALAM", "PRAVEEN SAHANI",
-        "KANNAN GANESAN", "ARUN MANAYATHU ANANDH", "ANANDHU SASIDHARAN",
-        "NINO URSAL CANON", "REJIL RAVI", "SIVA PRAVEEN SUGUMARAN",
-        "AKHIL ASHOKAN", "OMAR MAHUSAY DATANGEL", "MAHAMMAD SINAN",
-        "IRSHAD ALI MD QUYOOM", "RAISHKHA IQBALKHA PATHAN", "ABHILASH AMBAREEKSHAN",
-        "SHIVKUMAR MANIKAPPA MANIKAPPA", "VAMSHIKRISHNA POLASA", "NIVIN PRASAD",
-        "DHAVOUTH SULAIMAN JEILANI", "WINDY BLANCASABELLA", "MAHTAB ALAM",
-        "BERIN ROHIN JOSEPH BENZIGER", "NEMWEL GWAKO", "RITHIC SAI",
-        "SHAIK KHADEER", "SIMON GACHAU MUCHIRI", "DIFLIN", "JARUZELSKI MELENDES PESINO",
-        "HAIDAR NASSER MOHAMMED ALKHALAF", "JEYARAJA JAYAPAL",
-        "HASHEM ABDULMAJEED ALBAHRANI", "PRATHEEP RADHAKRISHNAN",
-        "REYNANTE CAYUMO AMOYO", "JAY MARASIGAN BONDOC", "SHAHWAZ KHAN","PACIFICO LUBANG ICHON","ELMER","REMY E PORRAS",
-    ]
-    
-    PERMIT_ACTIVITIES = [
-        "--- Select Activity ---",
-        "Mechanical Excavation",
-        "Manual Excavation",
-        "Fitup welding cutting and grinding",
-        "Holiday test",
-        "Pole erection",
-        "Manual painting",
-        "CP drilling",
-        "Trenching and Backfilling",
-        "Backfilling leveling and compaction",
-        "Construction of ROW",
-        "Marl mixing loading and unloading",
-        "Construction of fence",
-        "Cable pulling",
-        "Cable termination and threading",
-        "Conduit fixing",
-        "Construction of Burn pit",
-        "Loading and unloading of materials",
-        "Abrasive blasting and painting",
-        "Diesel refueling",
-        "Equipment maintenance",
-        "Water filling",
-        "Surface preparation and concrete chipping",
-        "Foam work",
-        "Shuttering activity",
-        "Nitrogen purging",
-        "Berming",
-        "Rebar works",
-        "Megger test",
-        "Marker installation",
-        "Grouting",
-        "Cellar construction",
-        "Entry into CSE",
-        "Entry into Burnpit",
-        "Hydro test",
-        "Scafolding activity",
-        "Structure cutting",
-        "Bolt Torquing",
-        "Surface Prepration",
-        "Survey",
-        "Foundation Installation",
-        "CAD welding",
-        "Pipe Lowering",
-        "Sand Bedding",
-        "Radiography test",
-        "Splicing "
-    ]
+    ref = reference()
 
     with st.form("permit_form", clear_on_submit=True):
         col1, col2 = st.columns(2)
         
         with col1:
             date_val = st.date_input("Date")
-            drill_site = st.selectbox("Drill Site", ALL_SITES) # Uses the master ALL_SITES list
-            work_location = st.selectbox("Work Location", WORK_LOCATIONS)
-            permit_receiver = st.selectbox("Permit Receiver", PERMIT_RECEIVERS)
+            drill_site = st.selectbox("Drill Site", ref["sites"])
+            work_location = st.selectbox("Work Location", ref["work_locations"])
+            permit_receiver = st.selectbox("Permit Receiver", ref["permit_receivers"])
 
         with col2:
             permit_no = st.text_input("Permit No")
-            permit_type = st.radio("Type of Permit", PERMIT_TYPES, horizontal=True)
-            permit_issuer = st.radio("Permit Issuer", PERMIT_ISSUERS, horizontal=True)
+            permit_type = st.radio("Type of Permit", ref["permit_types"], horizontal=True)
+            permit_issuer = st.radio("Permit Issuer", ref["permit_issuers"], horizontal=True)
 
-        activity = st.selectbox("Activity", PERMIT_ACTIVITIES)
+        activity = st.selectbox("Activity", ["--- Select Activity ---"] + ref["permit_activities"])
 
         if st.form_submit_button("Submit"):
             data = [
@@ -503,28 +3790,28 @@ def show_permit_form(sheet):
                 permit_receiver,               # Column G: PERMIT RECEIVER
                 permit_issuer                  # Column H: PERMIT ISSUER
             ]
-            try:
-                sheet.append_row(data)
-                st.success("✅ Permit submitted successfully!")
-            except Exception as e:
-                st.error(f"❌ Error submitting data: {e}")
+            submit_record(sheet, "permit", data, {"PERMIT NO": permit_no}, "✅ Permit submitted successfully!")
+
+    # Sealed months are immutable in the local archive, so permits are never updated in place here
+    resolve_pending_submission(sheet, "permit", allow_update=False)
 
 
 def show_heavy_vehicle_form(sheet):
     st.header("🚚 Heavy Vehicle Entry Form")
-    VEHICLE_LIST = ["Bus", "Dump Truck", "Low Bed", "Trailer", "Water Tanker", "Mini Bus", "Flat Truck"]
+    vehicle_types = reference()["vehicle_types"]
+    show_asset_lookup(sheet, "vehicle", vehicle_types)
     with st.form("vehicle_form", clear_on_submit=True):
         
         st.subheader("Vehicle & Driver Information")
         c1, c2 = st.columns(2)
-        vehicle_type = c1.selectbox("Vehicle Type", VEHICLE_LIST)
-        make = c2.text_input("Make")
-        plate_no = c1.text_input("Plate No")
-        asset_code = c2.text_input("Asset Code")
-        owner = c1.text_input("Owner")
+        vehicle_type = c1.selectbox("Vehicle Type", vehicle_types, key="veh_type")
+        make = c2.text_input("Make", key="veh_make")
+        plate_no = c1.text_input("Plate No", key="veh_plate")
+        asset_code = c2.text_input("Asset Code", key="veh_asset")
+        owner = c1.text_input("Owner", key="veh_owner")
         qr_code = c2.text_input("Q.R code")
-        driver_name = c1.text_input("Driver Name")
-        iqama_no = c2.text_input("Iqama No")
+        driver_name = c1.text_input("Driver Name", key="veh_driver")
+        iqama_no = c2.text_input("Iqama No", key="veh_iqama")
 
         st.subheader("Expiry Dates")
         d1, d2 = st.columns(2)
@@ -535,11 +3822,11 @@ def show_heavy_vehicle_form(sheet):
 
         st.subheader("Condition & Status")
         s1, s2 = st.columns(2)
-        fa_box = s1.selectbox("F.A Box", ["Available", "Not Available", "Expired", "Inadequate Medicine"])
-        pwas_status = s2.selectbox("PWAS Status", ["Working", "Not Working", "Alarm Not Audible", "Faulty Camera/Monitor", "N/A"])
-        seatbelt_damaged = s1.selectbox("Seat belt damaged", ["Yes", "No", "N/A"])
-        tyre_condition = s2.selectbox("Tyre Condition", ["Good", "Worn Out", "Damaged", "Needs Replacement", "N/A"])
-        suspension_systems = s1.selectbox("Suspension Systems", ["Good", "Faulty", "Needs Repair", "DamDamaged", "N/A"])
+        fa_box = s1.selectbox("F.A Box", FA_BOX_OPTIONS)
+        pwas_status = s2.selectbox("PWAS Status", PWAS_OPTIONS)
+        seatbelt_damaged = s1.selectbox("Seat belt damaged", SEATBELT_OPTIONS)
+        tyre_condition = s2.selectbox("Tyre Condition", TYRE_OPTIONS)
+        suspension_systems = s1.selectbox("Suspension Systems", SUSPENSION_OPTIONS)
         
         remarks = st.text_area("Remarks")
 
@@ -551,19 +3838,243 @@ def show_heavy_vehicle_form(sheet):
                 driver_name, iqama_no, licence_expiry,
                 qr_code, fa_box,
                 pwas_status, seatbelt_damaged, tyre_condition,
-                suspension_systems, remarks
+                suspension_systems, remarks, new_record_id("vehicle")
             ]
-            try:
-                sheet.append_row(data)
-                st.success("✅ Heavy Vehicle submitted successfully!")
-            except Exception as e:
-                st.error(f"❌ Error: {e}")
+            record = {"PLATE NO": plate_no, "ASSET CODE": asset_code, "MVPI EXPIRY DATE": mvpi_expiry}
+            submit_record(sheet, "vehicle", data, record, "✅ Heavy Vehicle submitted successfully!")
+
+    resolve_pending_submission(sheet, "vehicle")
+
+# -------------------- BULK IMPORT --------------------
+IMPORT_CHUNK_ROWS = 500 # Rows per append_rows call
+
+# Per dataset: target headers, required columns, date columns and controlled vocabularies
+# (a string vocabulary names a reference-data list, resolved at validation time)
+IMPORT_SPECS = {
+    "equipment": {
+        "label": "🚜 Heavy Equipment", "headers": HEAVY_EQUIP_HEADERS, "required": ["Palte No."],
+        "dates": ["T.P inspection date", "T.P Expiry date", "Insurance expiry date", "T.P Card expiry date"],
+        "vocab": {"Equipment type": "equipment_types", "T.P Card type": TP_CARD_TYPES, "PWAS status": PWAS_OPTIONS},
+    },
+    "vehicle": {
+        "label": "🚚 Heavy Vehicle", "headers": HEAVY_VEHICLE_HEADERS, "required": ["Plate No"],
+        "dates": ["MVPI Expiry date", "Insurance Expiry", "Licence Expiry"],
+        "vocab": {
+            "Vehicle Type": "vehicle_types", "F.A Box": FA_BOX_OPTIONS, "PWAS Status": PWAS_OPTIONS,
+            "Seat belt damaged": SEATBELT_OPTIONS, "Tyre Condition": TYRE_OPTIONS, "Suspension Systems": SUSPENSION_OPTIONS,
+        },
+    },
+    "permit": {
+        "label": "🛠️ Permit Log", "headers": PERMIT_HEADERS, "required": ["DATE", "PERMIT NO"],
+        "dates": ["DATE"],
+        "vocab": {"DRILL SITE": "sites", "WORK LOCATION": "work_locations", "TYPE OF PERMIT": "permit_types", "PERMIT ISSUER": "permit_issuers"},
+    },
+}
+
+def _header_key(name):
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def read_upload(data, filename):
+    """Reads an uploaded CSV / Excel file with every cell as text."""
+    buffer = io.BytesIO(data)
+    if filename.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(buffer, dtype=str)
+    else:
+        df = pd.read_csv(buffer, dtype=str, keep_default_na=False, encoding_errors="replace")
+    df.columns = [str(c).strip() for c in df.columns]
+    return df.fillna("").reset_index(drop=True)
+
+def auto_map_columns(upload_columns, headers):
+    """Matches upload columns to sheet headers ignoring case, spaces and punctuation."""
+    by_key = {_header_key(c): c for c in upload_columns}
+    return {header: by_key.get(_header_key(header)) for header in headers}
+
+def validate_import(df, dataset, mapping, key_index):
+    """Vectorized validation of an upload. Returns (accepted rows, rejected rows with reasons)."""
+    spec = IMPORT_SPECS[dataset]
+    out = pd.DataFrame({
+        header: df[col].astype(str).str.strip() if col else pd.Series("", index=df.index)
+        for header, col in mapping.items()
+    })
+    reasons = pd.Series("", index=df.index)
+
+    def reject(bad, reason):
+        nonlocal reasons
+        reasons = reasons.mask(bad, reasons + reason + "; ")
+
+    for col in spec["required"]:
+        reject(out[col] == "", f"{col} is required")
+    for col in spec["dates"]:
+        parsed = parse_dates(out[col])
+        reject((out[col] != "") & parsed.isna(), f"{col} is not a date")
+        out[col] = parsed.dt.strftime("%d-%b-%Y").fillna(out[col])
+    for col, vocab in spec["vocab"].items():
+        vocab = reference()[vocab] if isinstance(vocab, str) else vocab # Reference-data key
+        canonical = out[col].str.lower().map({str(v).strip().lower(): v for v in vocab})
+        reject((out[col] != "") & canonical.isna(), f"{col} is not a known value")
+        out[col] = canonical.fillna(out[col])
+    for col in DUPLICATE_KEYS.get(dataset, []):
+        header = next((h for h in spec["headers"] if h.upper() == col), None)
+        if header is None:
+            continue
+        keys = out[header].map(normalize_key)
+        with key_index.lock:
+            existing = keys.isin(key_index.keys[col].keys())
+        reject((keys != "") & existing, f"{header} already exists in the sheet")
+        reject((keys != "") & keys.duplicated(keep="first"), f"{header} repeated in the upload")
+
+    if RECORD_ID_HEADERS.get(dataset) in out.columns:
+        ids = out[RECORD_ID_HEADERS[dataset]]
+        out[RECORD_ID_HEADERS[dataset]] = ids.where(ids != "", pd.Series([new_record_id(dataset) for _ in ids], index=ids.index))
+
+    bad = reasons != ""
+    rejects = df[bad].copy()
+    rejects.insert(0, "Reason", reasons[bad].str.rstrip("; "))
+    rejects.insert(0, "Upload row", rejects.index + 2)
+    return out[~bad][spec["headers"]], rejects
+
+def show_bulk_import():
+    st.header("📥 Bulk Import")
+    dataset = st.radio("Dataset", list(IMPORT_SPECS), format_func=lambda d: IMPORT_SPECS[d]["label"], horizontal=True)
+    spec = IMPORT_SPECS[dataset]
+    try:
+        sheet = get_worksheet(current_project(), dataset) # Only the chosen dataset's sheet is opened
+        show_sheet_notices()
+    except Exception as e:
+        st.error(f"❌ Could not connect to the {spec['label']} sheet: {e}")
+        return
+
+    flash = st.session_state.pop("import_flash", None)
+    if flash:
+        st.success(flash)
+
+    upload_round = st.session_state.setdefault(f"import_round_{dataset}", 0)
+    upload = st.file_uploader("Upload a CSV or Excel file", type=["csv", "xlsx", "xls"], key=f"import_file_{dataset}_{upload_round}")
+    if upload is None:
+        expected = [h for h in spec["headers"] if h != RECORD_ID_HEADERS.get(dataset)] # Record IDs are generated when missing
+        st.info(f"The first row must hold column names. Expected columns: {', '.join(expected)}")
+        return
+    try:
+        df_upload = read_upload(upload.getvalue(), upload.name)
+    except ImportError: # pandas reads .xlsx with openpyxl and the older .xls with xlrd
+        package = "xlrd" if upload.name.lower().endswith(".xls") else "openpyxl"
+        st.error(f"❌ Reading this Excel file needs the '{package}' package. Upload a CSV instead.")
+        return
+    except Exception as e:
+        st.error(f"❌ Could not read the file: {e}")
+        return
+
+    # --- Column Mapping ---
+    st.markdown("#### 1. Map Columns")
+    auto_mapping = auto_map_columns(df_upload.columns, spec["headers"])
+    options = [None] + list(df_upload.columns)
+    mapping = {}
+    with st.expander("Column mapping", expanded=not all(auto_mapping.values())):
+        map_cols = st.columns(3)
+        for i, header in enumerate(spec["headers"]):
+            mapping[header] = map_cols[i % 3].selectbox(
+                header, options, index=options.index(auto_mapping[header]),
+                format_func=lambda c: "— not mapped —" if c is None else c,
+                key=f"import_map_{dataset}_{header}"
+            )
+
+    # --- Validation ---
+    st.markdown("#### 2. Validate")
+    try:
+        key_index = get_key_index(current_project(), dataset)
+        if dataset in LOG_DATASETS:
+            key_index.sync(dataset, *sync_log(sheet, dataset))
+        else:
+            key_index.sync_frame(load_sheet_frame(sheet, current_project(), dataset))
+    except Exception as e:
+        st.error(f"❌ Could not load existing records for the duplicate check: {e}")
+        return
+    accepted, rejects = validate_import(df_upload, dataset, mapping, key_index)
+
+    kpi1, kpi2, kpi3 = st.columns(3)
+    kpi1.metric("Rows in File", len(df_upload))
+    kpi2.metric("Ready to Import", len(accepted))
+    kpi3.metric("Rejected", len(rejects))
+    if not rejects.empty:
+        st.write("**Rejected rows**")
+        st.dataframe(rejects, use_container_width=True, hide_index=True)
+    if not accepted.empty:
+        st.write("**Preview of accepted rows**")
+        st.dataframe(accepted.head(100), use_container_width=True, hide_index=True)
+
+    # --- Import ---
+    st.markdown("#### 3. Import")
+    if st.button(f"Import {len(accepted)} rows", disabled=accepted.empty, type="primary"):
+        rows = accepted.values.tolist()
+        progress = st.progress(0.0, text="Importing...")
+        written = 0
+        try:
+            sheet = writable_sheet(sheet, dataset, len(rows))
+            for start in range(0, len(rows), IMPORT_CHUNK_ROWS):
+                chunk = rows[start:start + IMPORT_CHUNK_ROWS]
+                sheet.append_rows(chunk)
+                written += len(chunk)
+                progress.progress(written / len(rows), text=f"Imported {written} of {len(rows)} rows")
+        except Exception as e:
+            st.error(f"❌ Import stopped after {written} rows: {e}")
+            return
+        finally:
+            if written:
+                invalidate_dataset(dataset)
+        st.session_state[f"import_round_{dataset}"] = upload_round + 1
+        st.session_state["import_flash"] = f"✅ Imported {written} rows into {spec['label']}."
+        st.rerun()
+
+# -------------------- ALL PROJECTS DASHBOARD --------------------
+def show_all_projects():
+    st.header("🌐 All Projects")
+    days = st.selectbox("Period", (7, 30, 90), index=1, format_func=lambda d: f"Last {d} days")
+    with st.spinner("Rolling up projects..."):
+        rollups = all_projects_aggregates(days)
+    totals = rollups["totals"]
+    kpi1, kpi2, kpi3, kpi4, kpi5 = st.columns(5)
+    kpi1.metric("Projects", len(rollups["projects"]))
+    kpi2.metric("Observations", totals["observations"]["total"])
+    kpi3.metric("Open Observations", totals["observations"]["open"])
+    kpi4.metric("Permits", totals["permits"]["total"])
+    kpi5.metric("Expired Documents", sum(register["expired"] for register in totals["expiry"].values()))
+    st.dataframe(pd.DataFrame([
+        {
+            "Project": p["name"],
+            "Observations": p["observations"]["total"], "Open": p["observations"]["open"], "Unsafe": p["observations"]["unsafe"],
+            "Permits": p["permits"]["total"],
+            "Expired Documents": sum(c["expired"] for register in p["expiry"].values() for c in register.values()),
+            "Expiring Soon": sum(c["expiring_soon"] for register in p["expiry"].values() for c in register.values()),
+            "Latest Entry": p["observations"]["to"],
+        }
+        for p in rollups["projects"].values()
+    ]), use_container_width=True, hide_index=True)
+    for project, error in rollups["errors"].items():
+        st.error(f"❌ {get_project_registry().name(project)}: {error}")
+    st.caption(f"Each project's figures are kept for {DATA_TTL // 60} minutes.")
+    if st.button("Refresh"):
+        project_rollup.clear()
+        st.rerun()
 
 # -------------------- ADVANCED DASHBOARD (MODIFIED) --------------------
 def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_vehicle_sheet):
     st.header("📊 Dashboard")
-    tab_obs, tab_permit, tab_eqp, tab_veh = st.tabs([
-        "📋 Observation", "🛠️ Permit", "🚜 Heavy Equipment", "🚚 Heavy Vehicle"
+    ref = reference()
+    with st.expander("🗄️ Local Data Archive"):
+        for dataset in LOG_DATASETS:
+            manifest = load_manifest(dataset)
+            sealed_rows = sum(seg["rows"] for segs in manifest["partitions"].values() for seg in segs)
+            col_info, col_btn = st.columns([3, 1])
+            col_info.write(
+                f"**{dataset.title()}**: {len(manifest['partitions'])} sealed months, "
+                f"{sealed_rows} rows archived ({manifest['shard']} closed shard(s), then rows 2–{manifest['rows_archived'] + 1} of the active one)"
+            )
+            if col_btn.button("Rebuild", key=f"rebuild_{dataset}"):
+                rebuild_archive(dataset)
+                st.rerun()
+    tab_obs, tab_permit, tab_eqp, tab_veh, tab_risk = st.tabs([
+        "📋 Observation", "🛠️ Permit", "🚜 Heavy Equipment", "🚚 Heavy Vehicle", "🧭 Site Risk"
     ])
 
     today = date.today()
@@ -571,32 +4082,23 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
 
     # -------------------- OBSERVATION TAB --------------------
     with tab_obs:
+        clock_obs = StageClock("observation")
         st.subheader("Advanced Observation Analytics")
         try:
-            df_obs = pd.DataFrame(obs_sheet.get_all_records())
-            df_obs.columns = [str(col).strip().upper() for col in df_obs.columns]
+            manifest_obs, tail_obs = sync_log(obs_sheet, "observation")
         except gspread.exceptions.GSpreadException as e:
             st.error(f"Could not load observation data from Google Sheets: {e}")
             return # Use return to stop execution of this tab only
+        clock_obs.lap("load")
 
-        if df_obs.empty:
-            st.info("No observation data available to display.")
-            return
-
-        # --- Data Cleaning and Preparation ---
-        if 'DATE' not in df_obs.columns:
+        if 'DATE' not in tail_obs.columns:
             st.warning("The 'DATE' column is missing from the Observation Log sheet.")
             return
 
-        df_obs['DATE'] = pd.to_datetime(df_obs['DATE'], errors='coerce')
-        df_obs.dropna(subset=['DATE'], inplace=True)
-        df_obs = df_obs.sort_values(by='DATE', ascending=False)
-        
-        if 'CLASSIFICATION' in df_obs.columns:
-            df_obs['CLASSIFICATION'] = df_obs['CLASSIFICATION'].str.strip().str.upper()
-        if 'STATUS' in df_obs.columns:
-            df_obs['STATUS'] = df_obs['STATUS'].str.strip().str.capitalize()
-
+        min_date_obs, max_date_obs = log_date_bounds(manifest_obs, tail_obs)
+        if min_date_obs is None:
+            st.info("No observation data available to display.")
+            return
 
         # --- Interactive Filters ---
         st.markdown("#### Filter & Explore")
@@ -604,16 +4106,18 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
             col_filter1_obs, col_filter2_obs = st.columns(2)
 
             with col_filter1_obs:
-                min_date_obs = df_obs['DATE'].min().date()
-                max_date_obs = df_obs['DATE'].max().date()
                 date_range_obs = st.date_input(
                     "Select Date Range",
-                    (min_date_obs, max_date_obs),
+                    (max(min_date_obs, max_date_obs - timedelta(days=30)), max_date_obs),
                     min_value=min_date_obs,
                     max_value=max_date_obs,
                     key="obs_date_range"
                 )
 
+            # Only the monthly partitions overlapping the chosen range are loaded
+            start_date_obs, end_date_obs = date_range_obs if len(date_range_obs) == 2 else (min_date_obs, max_date_obs)
+            df_obs = load_log_range("observation", manifest_obs, tail_obs, start_date_obs, end_date_obs)
+
             with col_filter2_obs:
                 class_options = df_obs['CLASSIFICATION'].unique() if 'CLASSIFICATION' in df_obs.columns else []
                 selected_class = st.multiselect("Filter by Classification", options=class_options, default=class_options)
@@ -621,18 +4125,39 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 status_options = df_obs['STATUS'].unique() if 'STATUS' in df_obs.columns else []
                 selected_status = st.multiselect("Filter by Status", options=status_options, default=status_options)
 
-        # --- Apply Filters to DataFrame ---
-        start_date_obs, end_date_obs = date_range_obs if len(date_range_obs) == 2 else (min_date_obs, max_date_obs)
-        start_datetime_obs = pd.to_datetime(start_date_obs)
-        end_datetime_obs = pd.to_datetime(end_date_obs)
+            search_query = st.text_input(
+                "🔎 Search Observation Details & Recommended Action",
+                key="obs_search",
+                placeholder='e.g. scaffold "fall arrest" harn*'
+            )
 
-        mask_obs = (df_obs['DATE'] >= start_datetime_obs) & (df_obs['DATE'] <= end_datetime_obs)
+        # --- Apply Filters to DataFrame ---
+        mask_obs = pd.Series(True, index=df_obs.index)
         if selected_class and 'CLASSIFICATION' in df_obs.columns:
             mask_obs &= df_obs['CLASSIFICATION'].isin(selected_class)
         if selected_status and 'STATUS' in df_obs.columns:
             mask_obs &= df_obs['STATUS'].isin(selected_status)
 
-        df_filtered_obs = df_obs[mask_obs]
+        search_scores = None
+        if search_query.strip():
+            search_start = time.perf_counter()
+            search_index = get_search_index(current_project(), "observation")
+            search_index.sync("observation", manifest_obs, tail_obs)
+            search_scores = search_index.search(search_query)
+            search_elapsed = time.perf_counter() - search_start
+            get_perf_registry().observe("observation.search", search_elapsed)
+            mask_obs &= df_obs.index.isin(search_scores.index)
+            st.caption(
+                f"{int(mask_obs.sum())} matching observations in range "
+                f"({len(search_scores)} across all history) · {search_elapsed * 1000:.1f} ms"
+            )
+
+        # Sessions with the same filters share the filtered frame
+        df_filtered_obs = df_obs if mask_obs.all() else get_derived_cache().get(
+            ("observation", "filtered", start_date_obs, end_date_obs, tuple(selected_class), tuple(selected_status), search_query.strip()),
+            [tail_obs], lambda: df_obs[mask_obs]
+        )
+        clock_obs.lap("filter")
 
         if df_filtered_obs.empty:
             st.warning("No data matches the selected filters.")
@@ -653,13 +4178,28 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
 
         busiest_day_obs = df_filtered_obs['DATE'].dt.day_name().mode()[0] if not df_filtered_obs.empty else "N/A"
 
+        # Comparisons come from the whole log, so they are shown only while no filter narrows the range
+        compare_obs = {kpi: (dict(), None) for kpi in KPI_COUNTS["observation"]}
+        if mask_obs.all():
+            comparison_obs = load_kpi_comparison("observation", manifest_obs, tail_obs, start_date_obs, end_date_obs)
+            compare_obs = {kpi: kpi_delta(comparison_obs, lambda totals, kpi=kpi: totals[kpi]) for kpi in compare_obs}
+
         kpi1_obs, kpi2_obs, kpi3_obs, kpi4_obs = st.columns(4)
-        kpi1_obs.metric("Total Observations", f"{total_obs}")
-        kpi2_obs.metric("Open Issues", f"{open_issues}")
-        kpi3_obs.metric("Total Unsafe (Acts + Cond.)", f"{total_unsafe}")
+        kpi1_obs.metric("Total Observations", f"{total_obs}", **compare_obs["Total Observations"][0])
+        kpi2_obs.metric("Open Issues", f"{open_issues}", delta_color="inverse", **compare_obs["Open Issues"][0])
+        kpi3_obs.metric("Total Unsafe (Acts + Cond.)", f"{total_unsafe}", delta_color="inverse", **compare_obs["Total Unsafe"][0])
         kpi4_obs.metric("Busiest Day", busiest_day_obs)
+        if mask_obs.all():
+            st.caption(
+                f"Deltas against the previous {(end_date_obs - start_date_obs).days + 1} days. {KPI_LAST_YEAR}: "
+                + " · ".join(f"{kpi} {change or 'no data'}" for kpi, (_, change) in compare_obs.items())
+            )
+        else:
+            st.caption("Period comparisons cover the whole log and are hidden while filters are applied.")
         st.markdown("---")
 
+        clock_obs.lap("aggregate")
+
         # --- Visualizations ---
         st.markdown("#### Visual Insights")
         col_viz1_obs, col_viz2_obs = st.columns(2)
@@ -669,7 +4209,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 st.write("**Observation Classification**")
                 color_map = {'UNSAFE ACT': '#E74C3C', 'UNSAFE CONDITION': '#F39C12', 'POSITIVE': '#2ECC71'}
                 
-                class_counts = df_filtered_obs['CLASSIFICATION'].value_counts().reset_index()
+                class_counts = observed_counts(df_filtered_obs['CLASSIFICATION']).reset_index()
                 
                 fig_class_pie = px.pie(
                     class_counts,
@@ -681,24 +4221,24 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 )
                 fig_class_pie.update_traces(textposition='inside', textinfo='percent+label')
                 fig_class_pie.update_layout(showlegend=False, margin=dict(l=10, r=10, t=30, b=10))
-                st.plotly_chart(fig_class_pie, use_container_width=True)
+                clock_obs.chart(fig_class_pie)
 
             if 'CATEGORY' in df_filtered_obs.columns:
                 st.write("**Top 10 Observation Categories**")
-                cat_counts = df_filtered_obs['CATEGORY'].value_counts().nlargest(10).reset_index()
+                cat_counts = observed_counts(df_filtered_obs['CATEGORY']).nlargest(10).reset_index()
                 fig_cat_bar = px.bar(
                     cat_counts,
                     y='CATEGORY', x='count', orientation='h', text_auto=True,
                     labels={'count': 'Count', 'CATEGORY': 'Category'}
                 )
                 fig_cat_bar.update_layout(yaxis={'categoryorder':'total ascending'}, margin=dict(l=20, r=20, t=30, b=20))
-                st.plotly_chart(fig_cat_bar, use_container_width=True)
+                clock_obs.chart(fig_cat_bar)
 
         with col_viz2_obs:
             if 'STATUS' in df_filtered_obs.columns:
                 st.write("**Observation Status**")
                 status_color_map = {'Open': '#E74C3C', 'Close': '#2ECC71'} # Adjusted "CLOSE" to "Close"
-                status_counts = df_filtered_obs['STATUS'].value_counts().reset_index()
+                status_counts = observed_counts(df_filtered_obs['STATUS']).reset_index()
 
                 fig_status_pie = px.pie(
                     status_counts,
@@ -710,18 +4250,18 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 )
                 fig_status_pie.update_traces(textposition='inside', textinfo='percent+label')
                 fig_status_pie.update_layout(showlegend=False, margin=dict(l=10, r=10, t=30, b=10))
-                st.plotly_chart(fig_status_pie, use_container_width=True)
+                clock_obs.chart(fig_status_pie)
 
             if 'OBSERVER NAME' in df_filtered_obs.columns:
                 st.write("**Top 10 Observers**")
-                observer_counts = df_filtered_obs['OBSERVER NAME'].value_counts().nlargest(10).reset_index()
+                observer_counts = observed_counts(df_filtered_obs['OBSERVER NAME']).nlargest(10).reset_index()
                 fig_obs_bar = px.bar(
                     observer_counts,
                     y='OBSERVER NAME', x='count', orientation='h', text_auto=True,
                     labels={'count': 'Count', 'OBSERVER NAME': 'Observer'}
                 )
                 fig_obs_bar.update_layout(yaxis={'categoryorder':'total ascending'}, margin=dict(l=20, r=20, t=30, b=20))
-                st.plotly_chart(fig_obs_bar, use_container_width=True)
+                clock_obs.chart(fig_obs_bar)
         
         # --- Time Series Analysis ---
         st.markdown("---")
@@ -733,7 +4273,10 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
             labels={'DATE': 'Date', 'count': 'Number of Observations'}
         )
         fig_time_obs.update_layout(margin=dict(l=20, r=20, t=30, b=20))
-        st.plotly_chart(fig_time_obs, use_container_width=True)
+        flags_obs = load_trend_flags(obs_sheet, "observation", start_date_obs, end_date_obs)
+        overlay_flags(fig_time_obs, obs_by_day, flags_obs)
+        clock_obs.chart(fig_time_obs)
+        show_attention_list(flags_obs, "observation", clock_obs)
         
         # --- Supervisor Analysis ---
         if 'SUPERVISOR NAME' in df_filtered_obs.columns and 'CLASSIFICATION' in df_filtered_obs.columns:
@@ -741,9 +4284,9 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
             df_unsafe = df_filtered_obs[df_filtered_obs['CLASSIFICATION'].isin(['UNSAFE ACT', 'UNSAFE CONDITION'])]
             
             if not df_unsafe.empty:
-                unsafe_counts = df_unsafe.groupby(['SUPERVISOR NAME', 'CLASSIFICATION']).size().reset_index(name='count')
+                unsafe_counts = df_unsafe.groupby(['SUPERVISOR NAME', 'CLASSIFICATION'], observed=True).size().reset_index(name='count')
                 
-                top_supervisors = df_unsafe['SUPERVISOR NAME'].value_counts().nlargest(15).index
+                top_supervisors = observed_counts(df_unsafe['SUPERVISOR NAME']).nlargest(15).index
                 unsafe_counts_top = unsafe_counts[unsafe_counts['SUPERVISOR NAME'].isin(top_supervisors)]
 
                 fig_sup_bar = px.bar(
@@ -757,40 +4300,43 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     color_discrete_map={'UNSAFE ACT': '#E74C3C', 'UNSAFE CONDITION': '#F39C12'}
                 )
                 fig_sup_bar.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig_sup_bar, use_container_width=True)
+                clock_obs.chart(fig_sup_bar)
             else:
                 st.info("No 'Unsafe Act' or 'Unsafe Condition' observations found in the selected filter range.")
 
 
+        clock_obs.lap("figures")
+
         # --- Full Data Table ---
         st.markdown("---")
         st.markdown("#### Detailed Observation Log (Filtered)")
-        df_display_obs = df_filtered_obs.copy()
+        df_display_obs = df_filtered_obs.copy(deep=False) # Only the re-formatted DATE column is copied
+        if search_scores is not None:
+            # Rank by relevance when searching
+            df_display_obs = df_display_obs.loc[search_scores.index.intersection(df_display_obs.index, sort=False)]
         df_display_obs['DATE'] = df_display_obs['DATE'].dt.strftime('%d-%b-%Y')
-        st.dataframe(df_display_obs, use_container_width=True, hide_index=True)
+        clock_obs.table(df_display_obs)
+        show_observation_closeout(obs_sheet, df_filtered_obs)
 
     # -------------------- PERMIT TAB --------------------
     with tab_permit:
+        clock_permit = StageClock("permit")
         st.subheader("Advanced Permit Log Analytics")
         try:
-            df_permit = pd.DataFrame(permit_sheet.get_all_records())
-            df_permit.columns = [str(col).strip().upper() for col in df_permit.columns]
+            manifest_permit, tail_permit = sync_log(permit_sheet, "permit")
         except gspread.exceptions.GSpreadException as e:
             st.error(f"Could not load permit data from Google Sheets: {e}")
             return
+        clock_permit.lap("load")
 
-        if df_permit.empty:
-            st.info("No permit data available to display.")
-            return
-
-        # --- Data Cleaning and Preparation ---
-        if 'DATE' not in df_permit.columns:
+        if 'DATE' not in tail_permit.columns:
             st.warning("The 'DATE' column is missing from the Permit Log sheet.")
             return
 
-        df_permit['DATE'] = pd.to_datetime(df_permit['DATE'], errors='coerce')
-        df_permit.dropna(subset=['DATE'], inplace=True)
-        df_permit = df_permit.sort_values(by='DATE', ascending=False)
+        min_date, max_date = log_date_bounds(manifest_permit, tail_permit)
+        if min_date is None:
+            st.info("No permit data available to display.")
+            return
 
         # --- Interactive Filters ---
         st.markdown("#### Filter & Explore")
@@ -798,16 +4344,17 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
             col_filter1, col_filter2 = st.columns(2)
 
             with col_filter1:
-                min_date = df_permit['DATE'].min().date()
-                max_date = df_permit['DATE'].max().date()
                 date_range = st.date_input(
                     "Select Date Range",
-                    (min_date, max_date),
+                    (max(min_date, max_date - timedelta(days=30)), max_date),
                     min_value=min_date,
                     max_value=max_date,
                     key="permit_date_range"
                 )
 
+            start_date, end_date = date_range if len(date_range) == 2 else (min_date, max_date)
+            df_permit = load_log_range("permit", manifest_permit, tail_permit, start_date, end_date)
+
             with col_filter2:
                 permit_types = df_permit['TYPE OF PERMIT'].unique() if 'TYPE OF PERMIT' in df_permit.columns else []
                 selected_types = st.multiselect("Filter by Permit Type", options=permit_types, default=permit_types)
@@ -816,17 +4363,17 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 selected_issuers = st.multiselect("Filter by Permit Issuer", options=issuers, default=issuers)
 
         # --- Apply Filters to DataFrame ---
-        start_date, end_date = date_range if len(date_range) == 2 else (min_date, max_date)
-        start_datetime = pd.to_datetime(start_date)
-        end_datetime = pd.to_datetime(end_date)
-
-        mask = (df_permit['DATE'] >= start_datetime) & (df_permit['DATE'] <= end_datetime)
+        mask = pd.Series(True, index=df_permit.index)
         if selected_types and 'TYPE OF PERMIT' in df_permit.columns:
             mask &= df_permit['TYPE OF PERMIT'].isin(selected_types)
         if selected_issuers and 'PERMIT ISSUER' in df_permit.columns:
             mask &= df_permit['PERMIT ISSUER'].isin(selected_issuers)
 
-        df_filtered = df_permit[mask]
+        df_filtered = df_permit if mask.all() else get_derived_cache().get(
+            ("permit", "filtered", start_date, end_date, tuple(selected_types), tuple(selected_issuers)),
+            [tail_permit], lambda: df_permit[mask]
+        )
+        clock_permit.lap("filter")
 
         if df_filtered.empty:
             st.warning("No data matches the selected filters.")
@@ -839,19 +4386,36 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
         total_permits = len(df_filtered)
         hot_permits_count = 0
         if 'TYPE OF PERMIT' in df_filtered.columns:
-            hot_permits_count = df_filtered[df_filtered['TYPE OF PERMIT'].str.contains("Hot", case=False)].shape[0]
+            hot_permits_count = int(hot_permits(df_filtered['TYPE OF PERMIT']).sum())
 
         hot_permits_perc = (hot_permits_count / total_permits * 100) if total_permits > 0 else 0
         busiest_day = df_filtered['DATE'].dt.day_name().mode()[0] if not df_filtered.empty else "N/A"
         active_receivers = df_filtered['PERMIT RECEIVER'].nunique() if 'PERMIT RECEIVER' in df_filtered.columns else 0
 
+        compare_total, compare_hot = (dict(), None), (dict(), None)
+        if mask.all():
+            comparison = load_kpi_comparison("permit", manifest_permit, tail_permit, start_date, end_date)
+            compare_total = kpi_delta(comparison, lambda totals: totals["Total Permits"])
+            compare_hot = kpi_delta(
+                comparison, lambda totals: totals["Hot Permits"] / totals["Total Permits"] * 100 if totals["Total Permits"] else 0, percent=True
+            )
+
         kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-        kpi1.metric("Total Permits (in range)", f"{total_permits}")
-        kpi2.metric("Hot Permits %", f"{hot_permits_perc:.1f}%")
+        kpi1.metric("Total Permits (in range)", f"{total_permits}", **compare_total[0])
+        kpi2.metric("Hot Permits %", f"{hot_permits_perc:.1f}%", delta_color="off", **compare_hot[0])
         kpi3.metric("Busiest Day", busiest_day)
         kpi4.metric("Active Permit Receivers", f"{active_receivers}")
+        if mask.all():
+            st.caption(
+                f"Deltas against the previous {(end_date - start_date).days + 1} days. {KPI_LAST_YEAR}: "
+                f"Total Permits {compare_total[1] or 'no data'} · Hot Permits % {compare_hot[1] or 'no data'}"
+            )
+        else:
+            st.caption("Period comparisons cover the whole log and are hidden while filters are applied.")
         st.markdown("---")
 
+        clock_permit.lap("aggregate")
+
         # --- Visualizations ---
         st.markdown("#### Visual Insights")
         col_viz1, col_viz2 = st.columns(2)
@@ -864,18 +4428,14 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 )
                 fig_type_pie.update_traces(textposition='inside', textinfo='percent+label')
                 fig_type_pie.update_layout(showlegend=False, margin=dict(l=10, r=10, t=30, b=10))
-                st.plotly_chart(fig_type_pie, use_container_width=True)
+                clock_permit.chart(fig_type_pie)
 
             if 'DRILL SITE' in df_filtered.columns and 'TYPE OF PERMIT' in df_filtered.columns:
                 st.write("**Permit Composition by Drill Site**")
                 
-                site_permit_counts = df_filtered.groupby(['DRILL SITE', 'TYPE OF PERMIT']).size().reset_index(name='count')
+                site_permit_counts = df_filtered.groupby(['DRILL SITE', 'TYPE OF PERMIT'], observed=True).size().reset_index(name='count')
                 
-                site_permit_counts['DRILL SITE'] = pd.Categorical(
-                    site_permit_counts['DRILL SITE'],
-                    categories=ALL_SITES,
-                    ordered=True
-                )
+                site_permit_counts['DRILL SITE'] = site_permit_counts['DRILL SITE'].astype(site_dtype(ref["version"], ref["sites"]))
                 site_permit_counts = site_permit_counts.dropna(subset=['DRILL SITE'])
 
                 fig_site_stacked = px.bar(
@@ -895,17 +4455,13 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     barmode='stack',
                     margin=dict(l=20, r=20, t=40, b=20)
                 )
-                st.plotly_chart(fig_site_stacked, use_container_width=True)
+                clock_permit.chart(fig_site_stacked)
             
             elif 'DRILL SITE' in df_filtered.columns:
                 st.write("**Total Permits by Drill Site**")
-                site_counts = df_filtered['DRILL SITE'].value_counts().reset_index()
+                site_counts = observed_counts(df_filtered['DRILL SITE']).reset_index()
 
-                site_counts['DRILL SITE'] = pd.Categorical(
-                    site_counts['DRILL SITE'],
-                    categories=ALL_SITES,
-                    ordered=True
-                )
+                site_counts['DRILL SITE'] = site_counts['DRILL SITE'].astype(site_dtype(ref["version"], ref["sites"]))
                 site_counts = site_counts.dropna(subset=['DRILL SITE'])
 
                 fig_site = px.bar(
@@ -914,12 +4470,12 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     labels={'count': 'Count', 'DRILL SITE': 'Drill Site'}
                 )
                 fig_site.update_layout(margin=dict(l=20, r=20, t=40, b=20))
-                st.plotly_chart(fig_site, use_container_width=True)
+                clock_permit.chart(fig_site)
 
         with col_viz2:
             if 'PERMIT ISSUER' in df_filtered.columns:
                 st.write("**Permit Count by Issuer**")
-                issuer_counts = df_filtered['PERMIT ISSUER'].value_counts().reset_index()
+                issuer_counts = observed_counts(df_filtered['PERMIT ISSUER']).reset_index()
                 fig_issuer_bar = px.bar(
                     issuer_counts,
                     x='PERMIT ISSUER',
@@ -928,17 +4484,17 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     labels={'count': 'Number of Permits', 'PERMIT ISSUER': 'Issuer Name'}
                 )
                 fig_issuer_bar.update_layout(margin=dict(l=20, r=20, t=30, b=20))
-                st.plotly_chart(fig_issuer_bar, use_container_width=True)
+                clock_permit.chart(fig_issuer_bar)
 
             if 'PERMIT RECEIVER' in df_filtered.columns:
                 st.write("**Top 10 Permit Receivers**")
-                receiver_counts = df_filtered['PERMIT RECEIVER'].value_counts().nlargest(10).reset_index()
+                receiver_counts = observed_counts(df_filtered['PERMIT RECEIVER']).nlargest(10).reset_index()
                 fig_receiver = px.bar(
                     receiver_counts, y='PERMIT RECEIVER', x='count', orientation='h', text_auto=True,
                     labels={'count': 'Count', 'PERMIT RECEIVER': 'Receiver Name'}
                 )
                 fig_receiver.update_layout(yaxis={'categoryorder':'total ascending'}, margin=dict(l=20, r=20, t=30, b=20))
-                st.plotly_chart(fig_receiver, use_container_width=True)
+                clock_permit.chart(fig_receiver)
                 
         # --- Time Series Analysis ---
         st.markdown("---")
@@ -957,34 +4513,36 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
         )
         
         fig_time.update_layout(margin=dict(l=20, r=20, t=30, b=20))
-        st.plotly_chart(fig_time, use_container_width=True)
+        flags_permit = load_trend_flags(permit_sheet, "permit", start_date, end_date)
+        overlay_flags(fig_time, permits_by_day, flags_permit)
+        clock_permit.chart(fig_time)
+        show_attention_list(flags_permit, "permit", clock_permit)
+
+        clock_permit.lap("figures")
 
         # --- Full Data Table ---
         st.markdown("---")
         st.markdown("#### Detailed Permit Log (Filtered)")
-        df_display_permit = df_filtered.copy()
+        df_display_permit = df_filtered.copy(deep=False)
         df_display_permit['DATE'] = df_display_permit['DATE'].dt.strftime('%d-%b-%Y')
-        st.dataframe(df_display_permit, use_container_width=True, hide_index=True)
+        clock_permit.table(df_display_permit)
 
     # -------------------- HEAVY EQUIPMENT TAB --------------------
     with tab_eqp:
+        clock_eq = StageClock("equipment")
         st.subheader("🚜 Heavy Equipment Analytics")
         try:
-            df_equip = pd.DataFrame(heavy_equip_sheet.get_all_records())
-            df_equip.columns = [str(col).strip().upper() for col in df_equip.columns]
+            df_equip = load_fleet_frame(heavy_equip_sheet, "equipment")
         except gspread.exceptions.GSpreadException as e:
             st.error(f"Could not load data from Google Sheets: {e}")
             return
+        clock_eq.lap("load")
 
         if df_equip.empty:
             st.info("No Heavy Equipment data available to display.")
             return
 
-        # MODIFIED: Removed "F.E TP EXPIRY" from date_cols_eq
-        date_cols_eq = ["T.P EXPIRY DATE", "INSURANCE EXPIRY DATE", "T.P CARD EXPIRY DATE"]
-        for col in date_cols_eq:
-                if col in df_equip.columns:
-                    df_equip[col] = df_equip[col].apply(parse_date)
+        date_cols_eq = FLEET_DATE_COLUMNS["equipment"]
 
         # --- EXPIRY TRACKING TABLE ---
         st.subheader("🚨 Equipment Document Expiry Alerts")
@@ -1005,7 +4563,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
             )
 
             df_long_eq.dropna(subset=['Expiry Date'], inplace=True)
-            df_alerts_eq = df_long_eq[df_long_eq['Expiry Date'] <= thirty_days].copy()
+            df_alerts_eq = df_long_eq[df_long_eq['Expiry Date'] <= thirty_days]
 
             if df_alerts_eq.empty:
                 st.success("✅ No equipment documents are expired or expiring within 30 days.")
@@ -1025,7 +4583,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 
                 final_cols_eq = [col for col in display_cols_eq if col in df_alerts_eq.columns]
                 
-                st.dataframe(df_alerts_eq[final_cols_eq], use_container_width=True, hide_index=True)
+                clock_eq.table(df_alerts_eq[final_cols_eq])
         # --- END OF TABLE ---
 
         st.markdown("---")
@@ -1044,7 +4602,8 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
         kpi3_eq.metric(label="Expiring in 30 Days", value=expiring_soon_count, delta="Monitor Closely", delta_color="off")
         
         st.markdown("---")
-        
+        clock_eq.lap("aggregate")
+
         st.subheader("Visual Insights")
         c1_eq, c2_eq = st.columns(2)
 
@@ -1057,7 +4616,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     text_auto=True
                 )
                 fig_type_eq.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig_type_eq, use_container_width=True)
+                clock_eq.chart(fig_type_eq)
 
         with c2_eq:
             if 'PWAS STATUS' in df_equip.columns:
@@ -1065,7 +4624,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     df_equip, names='PWAS STATUS', title='PWAS Status Overview',
                     hole=0.3
                 )
-                st.plotly_chart(fig_pwas, use_container_width=True)
+                clock_eq.chart(fig_pwas)
                 
         if 'OWNER' in df_equip.columns:
             fig_owner = px.bar(
@@ -1074,41 +4633,40 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 labels={'count': 'Number of Units', 'OWNER': 'Owner Name'},
                 text_auto=True
             )
-            st.plotly_chart(fig_owner, use_container_width=True)
+            clock_eq.chart(fig_owner)
         
         st.markdown("---")
         
+        clock_eq.lap("figures")
         st.subheader("Full Heavy Equipment Data")
-        df_display_eq = df_equip.copy()
+        df_display_eq = df_equip.copy(deep=False)
         for col in existing_date_cols_eq:
             df_display_eq[col] = df_display_eq[col].apply(badge_expiry, expiry_days=30)
         
-        st.dataframe(df_display_eq, use_container_width=True, hide_index=True)
+        clock_eq.table(df_display_eq)
+        show_fleet_record_editor(heavy_equip_sheet, "equipment", HEAVY_EQUIP_HEADERS)
+
+        st.markdown("---")
+        show_compliance_history("equipment", "Equipment")
+        clock_eq.lap("history")
+        show_merged_names()
 
     # -------------------- START: NEW HEAVY VEHICLE TAB --------------------
     with tab_veh:
+        clock_veh = StageClock("vehicle")
         st.subheader("🚚 Heavy Vehicle Analytics")
         try:
-            df_veh = pd.DataFrame(heavy_vehicle_sheet.get_all_records())
-            df_veh.columns = [str(col).strip().upper() for col in df_veh.columns]
+            df_veh = load_fleet_frame(heavy_vehicle_sheet, "vehicle")
         except gspread.exceptions.GSpreadException as e:
             st.error(f"Could not load data from Google Sheets: {e}")
             return
+        clock_veh.lap("load")
 
         if df_veh.empty:
             st.info("No Heavy Vehicle data available to display.")
             return
 
-        # --- Data Cleaning ---
-        date_cols_veh = ["MVPI EXPIRY DATE", "INSURANCE EXPIRY", "LICENCE EXPIRY"]
-        for col in date_cols_veh:
-            if col in df_veh.columns:
-                df_veh[col] = df_veh[col].apply(parse_date)
-        
-        cat_cols_veh = ["PWAS STATUS", "TYRE CONDITION", "SUSPENSION SYSTEMS", "F.A BOX", "SEAT BELT DAMAGED", "VEHICLE TYPE"]
-        for col in cat_cols_veh:
-             if col in df_veh.columns:
-                 df_veh[col] = df_veh[col].str.strip().str.capitalize()
+        date_cols_veh = FLEET_DATE_COLUMNS["vehicle"]
 
         # --- Filters ---
         st.markdown("#### Filter & Explore")
@@ -1129,6 +4687,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
             mask_veh &= df_veh['OWNER'].isin(selected_owners_veh)
         
         df_filtered_veh = df_veh[mask_veh]
+        clock_veh.lap("filter")
 
         if df_filtered_veh.empty:
             st.warning("No data matches the selected filters.")
@@ -1151,7 +4710,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 value_name="Expiry Date"
             )
             df_long_veh.dropna(subset=['Expiry Date'], inplace=True)
-            df_alerts_veh = df_long_veh[df_long_veh['Expiry Date'] <= thirty_days].copy()
+            df_alerts_veh = df_long_veh[df_long_veh['Expiry Date'] <= thirty_days]
 
             if df_alerts_veh.empty:
                 st.success("✅ No vehicle documents are expired or expiring within 30 days.")
@@ -1162,7 +4721,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 
                 display_cols_veh = ["VEHICLE TYPE", "PLATE NO", "Document Type", "Expiry Date", "Status", "DRIVER NAME", "OWNER"]
                 final_cols_veh = [col for col in display_cols_veh if col in df_alerts_veh.columns]
-                st.dataframe(df_alerts_veh[final_cols_veh], use_container_width=True, hide_index=True)
+                clock_veh.table(df_alerts_veh[final_cols_veh])
         # --- END OF TABLE ---
 
         st.markdown("---")
@@ -1183,6 +4742,8 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
         
         st.markdown("---")
         
+        clock_veh.lap("aggregate")
+
         # --- Charts ---
         st.subheader("Visual Insights")
         c1_veh, c2_veh = st.columns(2)
@@ -1196,7 +4757,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     text_auto=True
                 )
                 fig_type_veh.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig_type_veh, use_container_width=True)
+                clock_veh.chart(fig_type_veh)
 
         with c2_veh:
             if 'PWAS STATUS' in df_filtered_veh.columns:
@@ -1204,7 +4765,7 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                     df_filtered_veh, names='PWAS STATUS', title='PWAS Status Overview',
                     hole=0.3
                 )
-                st.plotly_chart(fig_pwas_veh, use_container_width=True)
+                clock_veh.chart(fig_pwas_veh)
                 
         if 'TYRE CONDITION' in df_filtered_veh.columns:
             fig_tyre = px.bar(
@@ -1213,20 +4774,119 @@ def show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_ve
                 labels={'count': 'Count', 'TYRE CONDITION': 'Condition'},
                 text_auto=True
             )
-            st.plotly_chart(fig_tyre, use_container_width=True)
+            clock_veh.chart(fig_tyre)
         
+        clock_veh.lap("figures")
+
         # --- Full Table ---
         st.markdown("---")
         st.subheader("Full Heavy Vehicle Data (Filtered)")
-        df_display_veh = df_filtered_veh.copy()
+        df_display_veh = df_filtered_veh.copy(deep=False)
         for col in existing_date_cols_veh:
             if col in df_display_veh.columns:
                 df_display_veh[col] = df_display_veh[col].apply(badge_expiry, expiry_days=30)
         
-        st.dataframe(df_display_veh, use_container_width=True, hide_index=True)
+        clock_veh.table(df_display_veh)
+        show_fleet_record_editor(heavy_vehicle_sheet, "vehicle", HEAVY_VEHICLE_HEADERS)
+
+        st.markdown("---")
+        show_compliance_history("vehicle", "Vehicle")
+        clock_veh.lap("history")
 
     # -------------------- END: NEW HEAVY VEHICLE TAB --------------------
 
+    # -------------------- SITE RISK TAB --------------------
+    with tab_risk:
+        clock_risk = StageClock("site_risk")
+        st.subheader("Site Risk: Unsafe Observations vs Permit Activity")
+
+        col_period, col_metric = st.columns(2)
+        risk_period = col_period.radio("Group by", list(SITE_RISK_PERIODS), horizontal=True, key="risk_period")
+        risk_metric = col_metric.selectbox("Heatmap shows", list(SITE_RISK_METRICS), key="risk_metric")
+        try:
+            df_risk = load_site_risk(obs_sheet, permit_sheet, risk_period, ref)
+        except gspread.exceptions.GSpreadException as e:
+            st.error(f"Could not load site risk data from Google Sheets: {e}")
+            return
+        clock_risk.lap("load")
+
+        if df_risk.empty:
+            st.info("No observation or permit data available to display.")
+            return
+
+        min_date_risk, max_date_risk = df_risk['DATE'].min().date(), df_risk['DATE'].max().date()
+        default_span = timedelta(weeks=12) if risk_period == "Week" else timedelta(days=30)
+        date_range_risk = st.date_input(
+            "Select Date Range",
+            (max(min_date_risk, max_date_risk - default_span), max_date_risk),
+            min_value=min_date_risk,
+            max_value=max_date_risk,
+            key=f"risk_date_range_{risk_period}"
+        )
+        start_date_risk, end_date_risk = date_range_risk if len(date_range_risk) == 2 else (min_date_risk, max_date_risk)
+        df_risk = df_risk[(df_risk['DATE'] >= pd.to_datetime(start_date_risk)) & (df_risk['DATE'] <= pd.to_datetime(end_date_risk))]
+
+        # --- Per-site summary and correlation of unsafe observations with permit volume ---
+        count_cols = ["OBSERVATIONS", "UNSAFE", "PERMITS", "HIGH RISK PERMITS"] + list(ref["permit_types"])
+        df_sites = df_risk.groupby('SITE', observed=False)[count_cols].sum()
+        df_sites['UNSAFE PER 10 PERMITS'] = (df_sites['UNSAFE'] * 10 / df_sites['PERMITS'].where(df_sites['PERMITS'] > 0)).round(1)
+        correlations = {
+            site: group['UNSAFE'].corr(group['PERMITS'])
+            for site, group in df_risk.groupby('SITE', observed=True)
+            if len(group) >= MIN_CORRELATION_PERIODS
+        }
+        df_sites['UNSAFE ~ PERMITS (r)'] = pd.Series(correlations, dtype=float).round(2)
+        overall_r = df_risk['UNSAFE'].corr(df_risk['PERMITS']) if len(df_risk) >= MIN_CORRELATION_PERIODS else float("nan")
+        clock_risk.lap("aggregate")
+
+        kpi1_risk, kpi2_risk, kpi3_risk, kpi4_risk = st.columns(4)
+        kpi1_risk.metric("Unsafe Observations", int(df_sites['UNSAFE'].sum()))
+        kpi2_risk.metric("Permits", int(df_sites['PERMITS'].sum()))
+        kpi3_risk.metric("High-risk Permits %", f"{df_sites['HIGH RISK PERMITS'].sum() / max(df_sites['PERMITS'].sum(), 1) * 100:.1f}%")
+        kpi4_risk.metric(f"Unsafe vs Permits per Site-{risk_period} (r)", "n/a" if pd.isna(overall_r) else f"{overall_r:.2f}")
+
+        # --- Site x period heatmap across all sites ---
+        value_col = SITE_RISK_METRICS[risk_metric]
+        if value_col == "UNSAFE PER 10 PERMITS":
+            unsafe = df_risk.pivot_table(index='SITE', columns='DATE', values='UNSAFE', aggfunc='sum', observed=False, fill_value=0)
+            permits = df_risk.pivot_table(index='SITE', columns='DATE', values='PERMITS', aggfunc='sum', observed=False, fill_value=0)
+            heat = (unsafe * 10 / permits.where(permits > 0)).round(1)
+        else:
+            heat = df_risk.pivot_table(index='SITE', columns='DATE', values=value_col, aggfunc='sum', observed=False, fill_value=0)
+        heat.columns = [d.strftime("%d-%b-%Y") for d in heat.columns]
+        fig_heat = px.imshow(
+            heat, aspect="auto", color_continuous_scale="Reds", text_auto=True,
+            labels={'x': f"{risk_period} starting" if risk_period == "Week" else "Date", 'y': 'Site', 'color': risk_metric},
+            title=f"{risk_metric} per Site and {risk_period}"
+        )
+        fig_heat.update_layout(margin=dict(l=20, r=20, t=40, b=20))
+        clock_risk.chart(fig_heat)
+
+        c1_risk, c2_risk = st.columns(2)
+        with c1_risk:
+            fig_scatter_risk = px.scatter(
+                df_risk, x='PERMITS', y='UNSAFE', color='HIGH RISK PERMITS', hover_data=['SITE', 'DATE'],
+                color_continuous_scale="OrRd", title=f"Unsafe Observations vs Permits per Site-{risk_period}",
+                labels={'PERMITS': 'Permits', 'UNSAFE': 'Unsafe Observations', 'HIGH RISK PERMITS': 'High-risk Permits'}
+            )
+            clock_risk.chart(fig_scatter_risk)
+        with c2_risk:
+            df_mix = df_sites[list(ref["permit_types"])].reset_index().melt(id_vars='SITE', var_name='TYPE OF PERMIT', value_name='count')
+            fig_mix = px.bar(
+                df_mix, x='SITE', y='count', color='TYPE OF PERMIT', title="Permit Mix per Site",
+                labels={'count': 'Permits', 'SITE': 'Site', 'TYPE OF PERMIT': 'Permit Type'}
+            )
+            fig_mix.update_layout(barmode='stack', margin=dict(l=20, r=20, t=40, b=20))
+            clock_risk.chart(fig_mix)
+        clock_risk.lap("figures")
+
+        st.subheader("Site Summary")
+        st.caption(
+            f"Correlation (r) is between a site's unsafe observations and its permits per {risk_period.lower()}, "
+            f"shown for sites active in at least {MIN_CORRELATION_PERIODS} {risk_period.lower()}s."
+        )
+        clock_risk.table(df_sites.sort_values('UNSAFE PER 10 PERMITS', ascending=False).reset_index())
+
 # -------------------- MAIN APP --------------------
 def main():
     st.set_page_config(page_title="Onsite Reporting System", layout="wide")
@@ -1235,50 +4895,26 @@ def main():
     if "logged_in" not in st.session_state:
         st.session_state.logged_in = False
 
+    aggregates_api() # Serves other tools from this process's caches
+
     if not st.session_state.logged_in:
-        login()
+        with timed("rerun.login"):
+            login()
+        warm_heavy_imports() # The page is already on screen; load the rest while the user types
         return # Stop execution if not logged in
 
     # --- Main app logic runs only if logged in ---
-    try:
-        # get_sheets() now includes the header verification/fix logic
-        obs_sheet, permit_sheet, heavy_equip_sheet, heavy_vehicle_sheet = get_sheets()
-    except Exception as e:
-        st.error(f"Failed to connect to Google Sheets. Please check your connection and secrets.")
-        st.error(f"Error details: {e}")
-        if st.button("Logout"):
-            st.session_state.clear()
-            st.rerun()
-        return # Stop if sheets can't be loaded
-
-    choice = sidebar()
+    if select_project() is None:
+        st.error("❌ No project is assigned to your account.")
+        return
 
-    if choice == "🏠 Home":
-        st.title("📋 Onsite Reporting System")
-        st.write(f"Welcome, **{st.session_state.get('username')}**!")
-        st.info("Select an option from the sidebar to begin.")
+    # Only the selected page's function runs, and it opens only its own worksheets
+    st.navigation(app_pages()).run()
 
-    elif choice == "📝 Observation Form":
-        show_observation_form(obs_sheet)
+    get_memory_ledger().record_session(session_state_bytes())
 
-    elif choice == "🛠️ Permit Form":
-        show_permit_form(permit_sheet)
-
-    elif choice == "📊 Dashboard":
-        if st.session_state.get("role") == "admin":
-            show_combined_dashboard(obs_sheet, permit_sheet, heavy_equip_sheet, heavy_vehicle_sheet)
-        else:
-            st.warning("🚫 Access Denied: This page is for admins only.")
-
-    elif choice == "🚜 Heavy Equipment":
-        show_equipment_form(heavy_equip_sheet)
-
-    elif choice == "🚚 Heavy Vehicle":
-        show_heavy_vehicle_form(heavy_vehicle_sheet)
-
-    elif choice == "🚪 Logout":
-        st.session_state.clear()
-        st.rerun()
+    if st.session_state.get("role") == "admin" and st.query_params.get("perf"):
+        show_performance_panel()
 
 if __name__ == "__main__":
     main()
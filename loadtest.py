@@ -0,0 +1,592 @@
+"""Concurrent-session load test for app.py.
+
+Runs the app headlessly through streamlit.testing's AppTest against an in-memory
+stand-in for Google Sheets and simulates N concurrent users doing a realistic mix
+of actions: logging in, submitting each form, opening the dashboard and filtering
+its tabs. For each N it reports throughput, rerun latency percentiles, Sheets API
+calls per action and process memory growth.
+
+    python loadtest.py --users 1,10,50,100,200 --actions 8 --api-latency-ms 150
+
+With --check it runs the regression scenarios (see CHECKS) instead, and exits
+non-zero if one fails.
+
+Every virtual user shares this process (and so the app's st.cache_* caches), the
+same way sessions share a single Streamlit server.
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from unittest.mock import MagicMock
+
+# Load tests hammer the API stand-in; the per-user read budget would throttle them
+os.environ.setdefault("SHEETS_READ_BUDGET_PER_MIN", "0")
+
+import gspread
+import streamlit as st
+import streamlit.logger
+from streamlit import config
+from google.oauth2 import service_account
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest, local_script_runner
+from streamlit.util import calc_hash
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+VU_KEY = "_loadtest_vu" # Session-state key naming the virtual user of a session
+
+# Relative weight of each action in a user's session
+ACTION_WEIGHTS = {
+    "home": 1,
+    "observation_form": 3,
+    "permit_form": 3,
+    "equipment_form": 1,
+    "vehicle_form": 1,
+    "dashboard": 2,
+    "dashboard_filter": 2,
+    "dashboard_search": 1,
+}
+ADMIN_ONLY = {"dashboard", "dashboard_filter", "dashboard_search"}
+
+# -------------------- GOOGLE SHEETS STAND-IN --------------------
+class FakeResponse:
+    ok = True
+
+    def __init__(self, size):
+        self.content = b" " * size
+
+class FakeHTTP:
+    """Plays the part of gspread's HTTPClient: every worksheet call goes through `request`,
+    so the app's API accounting wrapper sees it. Adds a fixed latency per call."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        self.backend.count_call()
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        return FakeResponse(self.backend.last_size)
+
+class FakeWorksheet:
+    def __init__(self, backend, title, rows, cols=26):
+        self.backend, self.title, self.data, self.col_count = backend, title, rows, cols
+        self.id = abs(hash(title)) % 100000
+
+    @property
+    def row_count(self):
+        return max(1000, len(self.data))
+
+    def _call(self, method, url, rows=()):
+        self.backend.last_size = sum(len(",".join(map(str, r))) for r in rows) + 64
+        self.backend.http.request(method, url)
+
+    def _rows(self, a1):
+        a1 = a1.split("!")[-1]
+        bounds = re.findall(r"\d+", a1)
+        start = int(bounds[0]) if bounds else 1
+        end = int(bounds[1]) if len(bounds) > 1 else len(self.data)
+        return [list(r) for r in self.data[start - 1:end]]
+
+    def batch_get(self, ranges, **kwargs):
+        with self.backend.lock:
+            out = [self._rows(r) for r in ranges]
+        self._call("GET", "https://sheets.googleapis.com/v4/spreadsheets/x/values:batchGet", [r for v in out for r in v])
+        return out
+
+    def get_values(self, range_name=None, **kwargs):
+        with self.backend.lock:
+            out = self._rows(range_name) if range_name else [list(r) for r in self.data]
+        self._call("GET", "https://sheets.googleapis.com/v4/spreadsheets/x/values/A1", out)
+        return out
+
+    def get_all_values(self, **kwargs):
+        return self.get_values()
+
+    def get_all_records(self, **kwargs):
+        values = self.get_values()
+        return [dict(zip(values[0], r)) for r in values[1:]] if values else []
+
+    def row_values(self, row, **kwargs):
+        values = self.get_values(f"A{row}:ZZ{row}")
+        return values[0] if values else []
+
+    def col_values(self, col, **kwargs):
+        values = self.get_values()
+        return [r[col - 1] if len(r) >= col else "" for r in values]
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        with self.backend.lock:
+            start = len(self.data) + 1
+            self.data.extend([[str(v) for v in row] for row in values])
+        self._call("POST", "https://sheets.googleapis.com/v4/spreadsheets/x/values/A1:append")
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:ZZ{start + len(values) - 1}"}}
+
+    def update(self, range_name, values=None, **kwargs):
+        if not isinstance(range_name, str): # gspread 6 order: update(values, range_name)
+            range_name, values = values, range_name
+        row = int(re.findall(r"\d+", range_name)[0])
+        with self.backend.lock:
+            for i, line in enumerate(values):
+                while len(self.data) < row + i:
+                    self.data.append([])
+                self.data[row + i - 1] = [str(v) for v in line]
+        self._call("PUT", "https://sheets.googleapis.com/v4/spreadsheets/x/values/A1")
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            col = re.match(r"[A-Z]+", item["range"].split("!")[-1]).group(0)
+            row = int(re.findall(r"\d+", item["range"])[0])
+            col_idx = gspread.utils.a1_to_rowcol(f"{col}1")[1]
+            with self.backend.lock:
+                line = self.data[row - 1]
+                line.extend([""] * (col_idx - 1 + len(item["values"][0]) - len(line)))
+                line[col_idx - 1:col_idx - 1 + len(item["values"][0])] = [str(v) for v in item["values"][0]]
+        self._call("POST", "https://sheets.googleapis.com/v4/spreadsheets/x/values:batchUpdate")
+
+    def batch_clear(self, ranges, **kwargs):
+        self._call("POST", "https://sheets.googleapis.com/v4/spreadsheets/x/values:batchClear")
+
+    def resize(self, rows=None, cols=None, **kwargs):
+        self.backend.maybe_fail("resize")
+        if cols is not None:
+            self.col_count = int(cols)
+        self._call("POST", "https://sheets.googleapis.com/v4/spreadsheets/x:batchUpdate")
+
+class FakeSpreadsheet:
+    def __init__(self, backend, worksheets):
+        self.backend, self._worksheets = backend, worksheets
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    def worksheet(self, title):
+        for ws in self._worksheets:
+            if ws.title == title:
+                return ws
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def worksheets(self, **kwargs):
+        return list(self._worksheets)
+
+    def add_worksheet(self, title, rows, cols, **kwargs):
+        ws = FakeWorksheet(self.backend, title, [], int(cols))
+        self._worksheets.append(ws)
+        self.backend.http.request("POST", "https://sheets.googleapis.com/v4/spreadsheets/x:batchUpdate")
+        return ws
+
+class FakeClient:
+    def __init__(self, backend):
+        self.backend = backend
+        self.http_client = backend.http
+
+    def open_by_url(self, url):
+        self.backend.last_size = 2048
+        self.backend.http.request("GET", "https://sheets.googleapis.com/v4/spreadsheets/x")
+        return self.backend.spreadsheet_for(url)
+
+    def open_by_key(self, key):
+        return self.open_by_url(key)
+
+class FakeAPIError(Exception):
+    """An injected Sheets API failure (see FakeSheetsBackend.fail_once)."""
+
+class FakeSheetsBackend:
+    """In-memory workbooks seeded with synthetic history, plus per-virtual-user call counts."""
+
+    def __init__(self, app_module_globals, latency, history_days, seed=7):
+        self.lock = threading.RLock()
+        self.latency = latency
+        self.last_size = 0
+        self.calls = collections.Counter()
+        self.failures = collections.Counter() # operation -> calls still to fail
+        self.http = FakeHTTP(self)
+        self.books = {}
+        self._seed(app_module_globals, history_days, random.Random(seed))
+
+    def count_call(self):
+        vu = "unattributed"
+        try:
+            vu = st.session_state.get(VU_KEY, vu) # Runs inside the session's script thread
+        except Exception:
+            pass
+        with self.lock:
+            self.calls[vu] += 1
+
+    def fail_once(self, operation):
+        with self.lock:
+            self.failures[operation] += 1
+
+    def maybe_fail(self, operation):
+        with self.lock:
+            if self.failures[operation] <= 0:
+                return
+            self.failures[operation] -= 1
+        raise FakeAPIError(f"simulated API error in {operation}")
+
+    def spreadsheet_for(self, url):
+        for key, book in self.books.items():
+            if key in url:
+                return book
+        return self.books["equipment"]
+
+    def _seed(self, g, history_days, rnd):
+        today = date.today()
+        day = lambda k: (today - timedelta(days=k)).strftime("%d-%b-%Y")
+        sites = g["sites"]
+        obs_header = ["DATE", "WELL NO", "AREA", "OBSERVER NAME", "OBSERVATION DETAILS", "RECOMMENDED ACTION",
+                      "SUPERVISOR NAME", "DISCIPLINE", "CATEGORY", "CLASSIFICATION", "STATUS"]
+        words = "scaffold ladder guard rail harness hot work fire extinguisher excavation shoring cable trench housekeeping ppe".split()
+        obs = [obs_header] + [
+            [day(history_days - i // 6), rnd.choice(sites), "Cellar", "AJISH", " ".join(rnd.sample(words, 6)),
+             " ".join(rnd.sample(words, 3)), "RAVI SINGH", "SUPERVISOR-CIVIL", "PPE",
+             rnd.choice(["POSITIVE", "UNSAFE ACT", "UNSAFE CONDITION"]), rnd.choice(["OPEN", "CLOSE"])]
+            for i in range(history_days * 6)
+        ]
+        permits = [list(g["PERMIT_HEADERS"])] + [
+            [day(history_days - i // 5), rnd.choice(sites), "Cellar", f"LT-{i}", rnd.choice(g["permit_types"]),
+             "Survey", "ALWIN", g["permit_issuers"][0]]
+            for i in range(history_days * 5)
+        ]
+        equipment = [list(g["HEAVY_EQUIP_HEADERS"])] + [
+            ["Crane", "CAT", f"EQ-{i}", f"A-{i}", "ABC Co.", day(200), day(rnd.randint(-120, 60)), day(rnd.randint(-120, 60)),
+             f"Operator {i}", f"IQ{i}", "SPSP", f"TP{i}", day(rnd.randint(-120, 60)), "", "Working", "OK", ""]
+            for i in range(150)
+        ]
+        vehicles = [list(g["HEAVY_VEHICLE_HEADERS"])] + [
+            ["Bus", "Toyota", f"VH-{i}", f"V-{i}", "XYZ Ltd", day(rnd.randint(-120, 60)), day(rnd.randint(-120, 60)),
+             f"Driver {i}", f"IQV{i}", day(rnd.randint(-120, 60)), "", "Available", "Working", "No", "Good", "Good", ""]
+            for i in range(120)
+        ]
+        self.books = {
+            url_key(g["OBSERVATION_URL"]): FakeSpreadsheet(self, [FakeWorksheet(self, "Sheet1", obs)]),
+            url_key(g["PERMIT_URL"]): FakeSpreadsheet(self, [FakeWorksheet(self, "Sheet1", permits)]),
+            url_key(g["EQUIPMENT_URL"]): FakeSpreadsheet(self, [
+                FakeWorksheet(self, "Sheet1", [[""]]),
+                FakeWorksheet(self, g["HEAVY_EQUIP_TAB"], equipment, 40),
+                FakeWorksheet(self, g["HEAVY_VEHICLE_TAB"], vehicles, 40),
+            ]),
+        }
+        self.books["equipment"] = self.books[url_key(g["EQUIPMENT_URL"])]
+
+def url_key(url):
+    match = re.search(r"/d/([\w-]+)", url)
+    return match.group(1) if match else url
+
+def install_backend(backend):
+    gspread.authorize = lambda creds, **kwargs: FakeClient(backend)
+    service_account.Credentials.from_service_account_info = staticmethod(lambda info, scopes=None: object())
+    # A server compiles the script once for all sessions; AppTest would recompile it on every
+    # rerun, which is both unrealistic and not thread-safe (ast.parse on CPython 3.11)
+    shared_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: shared_cache
+    # AppTest installs a mock Runtime, swaps st.secrets and turns on the global.appTest option for
+    # the length of each run and resets them afterwards, which breaks whichever session is still
+    # running. Keep one of each for the whole process, as a server would have.
+    config.set_option("global.appTest", True)
+    shared_runtime = MagicMock(spec=Runtime)
+    shared_runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared_runtime.dataframe_source_mgr = DataframeSourceManager()
+    shared_runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or shared_runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    secrets = Secrets()
+    secrets._secrets = {"gcp_service_account": {}}
+    st.secrets = secrets
+
+def app_constants():
+    """Reads the constants and reference lists the stand-in needs without running app.py as a Streamlit script."""
+    import ast
+    with open(APP_PATH) as f:
+        tree = ast.parse(f.read())
+    wanted = {"PERMIT_HEADERS", "HEAVY_EQUIP_HEADERS",
+              "HEAVY_VEHICLE_HEADERS", "OBSERVATION_URL", "PERMIT_URL", "EQUIPMENT_URL", "HEAVY_EQUIP_TAB", "HEAVY_VEHICLE_TAB"}
+    found = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and getattr(node.targets[0], "id", None) in wanted:
+            found[node.targets[0].id] = ast.literal_eval(node.value)
+    with open(os.environ.get("APP_REFERENCE_FILE", os.path.join(os.path.dirname(APP_PATH), "reference_data.json"))) as f:
+        found.update(json.load(f))
+    return found
+
+# -------------------- VIRTUAL USERS --------------------
+def rss_mb():
+    """Resident memory of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+class VirtualUser:
+    def __init__(self, vu_id, admin, rnd, timeout):
+        self.vu_id, self.admin, self.rnd = vu_id, admin, rnd
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.at.session_state[VU_KEY] = vu_id
+        self.page = "home"
+        self.samples = [] # (action, seconds, api_calls, error or None)
+        self.reruns = [] # Seconds per script run
+        run = self.at._run
+
+        def timed_run(*args, **kwargs): # Every widget interaction ends up here
+            start = time.perf_counter()
+            try:
+                return run(*args, **kwargs)
+            finally:
+                self.reruns.append(time.perf_counter() - start)
+        self.at._run = timed_run
+
+    def _run(self, action, step, backend):
+        calls_before = backend.calls[self.vu_id]
+        start = time.perf_counter()
+        error = None
+        try:
+            step()
+            if self.at.exception:
+                error = self.at.exception[0].message
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.samples.append((action, time.perf_counter() - start, backend.calls[self.vu_id] - calls_before, error))
+
+    def _by_label(self, elements, label):
+        return next(e for e in elements if e.label == label)
+
+    def _navigate(self, page):
+        """Opens an st.navigation page by its url_path. AppTest.switch_page only knows
+        file-based pages; a function page's script hash is the hash of its url_path."""
+        self.at._page_hash = calc_hash(page)
+        self.page = page
+        self.at.run()
+
+    def login(self, backend):
+        def step():
+            self.at.run()
+            self.at.text_input(key="login_username").input("Rahul" if self.admin else "user")
+            self.at.text_input(key="login_password").input("1234" if self.admin else "user")
+            self._by_label(self.at.button, "Login").click().run()
+        self._run("login", step, backend)
+
+    def act(self, action, backend):
+        at, rnd = self.at, self.rnd
+
+        def submit(page, fields):
+            self._navigate(page)
+            for label, value in fields.items():
+                self._by_label(at.text_input, label).input(value)
+            self._by_label(at.button, "Submit").click().run()
+
+        steps = {
+            "home": lambda: self._navigate("home"),
+            "observation_form": lambda: submit("observation_form", {}),
+            "permit_form": lambda: submit("permit_form", {"Permit No": f"LT-{self.vu_id}-{rnd.randint(0, 10**9)}"}),
+            "equipment_form": lambda: submit("heavy_equipment", {"Palte No.": f"LT-EQ-{self.vu_id}-{rnd.randint(0, 10**9)}"}),
+            "vehicle_form": lambda: submit("heavy_vehicle", {"Plate No": f"LT-VH-{self.vu_id}-{rnd.randint(0, 10**9)}"}),
+            "dashboard": lambda: self._navigate("dashboard"),
+            "dashboard_filter": self._filter_dashboard,
+            "dashboard_search": self._search_dashboard,
+        }
+        self._run(action, steps[action], backend)
+
+    def _ensure_dashboard(self):
+        if self.page != "dashboard":
+            self._navigate("dashboard")
+
+    def _filter_dashboard(self):
+        """Narrows the date range and drops one option of a multiselect on the observation or
+        permit tab (the fleet tabs have no filters)."""
+        self._ensure_dashboard()
+        key, label = self.rnd.choice([("obs_date_range", "Filter by Classification"), ("permit_date_range", "Filter by Permit Type")])
+        end = date.today()
+        self.at.date_input(key=key).set_value((end - timedelta(days=self.rnd.choice([7, 30, 90, 365])), end)).run()
+        options = self._by_label(self.at.multiselect, label)
+        if options.value:
+            options.unselect(self.rnd.choice(options.value)).run()
+
+    def _search_dashboard(self):
+        self._ensure_dashboard()
+        self.at.text_input(key="obs_search").input(self.rnd.choice(["scaff", "hot work", '"fire extinguisher"', "harn*"])).run()
+
+def run_level(n_users, args, backend):
+    """Runs n_users concurrent sessions; returns the report row for this level."""
+    actions = list(ACTION_WEIGHTS)
+    weights = [ACTION_WEIGHTS[a] for a in actions]
+    rss_before = rss_mb()
+    users = []
+
+    def session(vu_index):
+        vu = VirtualUser(f"vu{n_users}-{vu_index}", vu_index < max(1, round(n_users * args.admin_share)),
+                         random.Random(f"{args.seed}-{n_users}-{vu_index}"), args.timeout)
+        users.append(vu)
+        vu.login(backend)
+        for _ in range(args.actions):
+            action = vu.rnd.choices(actions, weights)[0]
+            if action in ADMIN_ONLY and not vu.admin:
+                action = "observation_form"
+            vu.act(action, backend)
+            if args.think_ms:
+                time.sleep(vu.rnd.uniform(0, 2 * args.think_ms) / 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_users) as pool:
+        list(pool.map(session, range(n_users)))
+    elapsed = time.perf_counter() - start
+
+    samples = [s for vu in users for s in vu.samples]
+    latencies = sorted(t for vu in users for t in vu.reruns)
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    per_action = collections.defaultdict(list)
+    for action, _, calls, _ in samples:
+        per_action[action].append(calls)
+    return {
+        "users": n_users,
+        "actions": len(samples),
+        "errors": sum(1 for s in samples if s[3]),
+        "error_kinds": collections.Counter(f"{s[0]}: {s[3][:120]}" for s in samples if s[3]).most_common(5),
+        "reruns": len(latencies),
+        "throughput_per_s": len(samples) / elapsed if elapsed else 0.0,
+        "action_mean_ms": sum(s[1] for s in samples) / len(samples) * 1000 if samples else 0.0,
+        "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99),
+        "api_calls_per_action": {a: sum(c) / len(c) for a, c in sorted(per_action.items())},
+        "rss_mb": rss_mb(),
+        "rss_growth_mb": rss_mb() - rss_before,
+    }
+
+# -------------------- REGRESSION CHECKS --------------------
+# Scenarios driven through the app like a user would, on a fresh archive. Each
+# returns a list of failure messages.
+CHECK_HISTORY_DAYS = 120 # Enough history for closed months to be sealed
+
+def log_rows_in_range(book, start, end):
+    """Data rows of every tab of a log workbook dated within [start, end]."""
+    count = 0
+    for ws in book.worksheets():
+        for row in ws.data[1:]:
+            day = datetime.strptime(row[0], "%d-%b-%Y").date()
+            count += start <= day <= end
+    return count
+
+def check_rollover(args, backend, g):
+    """The observation log rolls over to a new tab, and the rollover fails half-way
+    (the new tab exists, the old one could not be resized). No row may be counted
+    twice, the dashboard must open on the empty new shard beside the sealed
+    partitions, and the next submission must land in the new tab."""
+    book = backend.spreadsheet_for(g["OBSERVATION_URL"])
+    first = book.worksheets()[0]
+    failures = []
+    vu = VirtualUser("check-rollover", True, random.Random(args.seed), args.timeout)
+    vu.login(backend)
+
+    def expect_dashboard(step):
+        vu._navigate("dashboard")
+        if vu.at.exception:
+            failures.append(f"{step}: dashboard raised {vu.at.exception[0].message}")
+            return
+        start, end = vu.at.date_input(key="obs_date_range").value
+        shown = int(vu._by_label(vu.at.metric, "Total Observations").value)
+        expected = log_rows_in_range(book, start, end)
+        if shown != expected:
+            failures.append(f"{step}: Total Observations is {shown}, the sheets hold {expected}")
+
+    def submit(step):
+        vu.act("observation_form", backend)
+        if vu.samples[-1][3]:
+            failures.append(f"{step}: {vu.samples[-1][3]}")
+
+    expect_dashboard("before rollover")
+    submit("last row of the first tab") # Fills the tab up to APP_SHARD_MAX_ROWS
+    backend.fail_once("resize")
+    submit("failed rollover") # Opens the new tab, then fails; the form shows the error
+    shards = book.worksheets()
+    if len(shards) != 2 or len(shards[-1].data) != 1:
+        failures.append(f"failed rollover: expected a new tab holding only its header, got {[(ws.title, len(ws.data)) for ws in shards]}")
+    expect_dashboard("after failed rollover")
+    rows_before = len(first.data)
+    submit("first row of the new tab")
+    if len(first.data) != rows_before or len(book.worksheets()[-1].data) != 2:
+        failures.append("first row of the new tab: the row was not appended to the new tab")
+    expect_dashboard("after rollover")
+    return failures
+
+CHECKS = {"rollover": check_rollover}
+
+def run_checks(args):
+    """Runs every check against its own backend and archive; returns the exit status."""
+    g = app_constants()
+    os.environ["APP_SHARD_MAX_ROWS"] = str(CHECK_HISTORY_DAYS * 6 + 2) # Header + seeded rows + one more
+    status = 0
+    for name, check in CHECKS.items():
+        backend = FakeSheetsBackend(g, 0, CHECK_HISTORY_DAYS)
+        install_backend(backend)
+        with tempfile.TemporaryDirectory() as archive:
+            os.environ["APP_ARCHIVE_DIR"] = archive
+            failures = check(args, backend, g)
+        print(f"{name}: {'ok' if not failures else 'FAILED'}")
+        for failure in failures:
+            print(f"  {failure}")
+        status = status or bool(failures)
+    return status
+
+def print_report(rows):
+    print("Rerun latency percentiles; action mean covers all reruns of one action.")
+    print(f"{'users':>6} {'actions':>8} {'reruns':>7} {'errors':>6} {'act/s':>8} {'act ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7} {'+MB':>6}")
+    for r in rows:
+        print(f"{r['users']:>6} {r['actions']:>8} {r['reruns']:>7} {r['errors']:>6} {r['throughput_per_s']:>8.2f} {r['action_mean_ms']:>8.0f} "
+              f"{r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['rss_mb']:>7.0f} {r['rss_growth_mb']:>6.0f}")
+    print("\nSheets API calls per action (mean):")
+    for r in rows:
+        calls = ", ".join(f"{a}={c:.2f}" for a, c in r["api_calls_per_action"].items())
+        print(f"  N={r['users']}: {calls}")
+    for r in rows:
+        for kind, count in r["error_kinds"]:
+            print(f"  N={r['users']} error x{count}: {kind}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", default="1,5,10,25,50,100,200", help="Comma-separated concurrency levels")
+    parser.add_argument("--actions", type=int, default=6, help="Actions per user after login")
+    parser.add_argument("--admin-share", type=float, default=0.3, help="Fraction of users logging in as admin")
+    parser.add_argument("--api-latency-ms", type=float, default=150, help="Simulated latency of each Sheets API call")
+    parser.add_argument("--history-days", type=int, default=365, help="Days of synthetic observation/permit history")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a user's actions")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds before a single rerun counts as failed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the report rows to this file")
+    parser.add_argument("--check", action="store_true", help="Run the regression scenarios instead of the load levels")
+    args = parser.parse_args()
+    streamlit.logger.set_log_level("error") # Bare-mode AppTest warns on every session_state access
+    if args.check:
+        sys.exit(run_checks(args))
+
+    backend = FakeSheetsBackend(app_constants(), args.api_latency_ms / 1000, args.history_days)
+    install_backend(backend)
+
+    rows = []
+    for n_users in [int(n) for n in args.users.split(",")]:
+        print(f"Running {n_users} concurrent user(s)...", file=sys.stderr)
+        rows.append(run_level(n_users, args, backend))
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=1)
+
+if __name__ == "__main__":
+    main()
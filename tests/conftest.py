@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app.py sits at the repo root and runs its UI only as __main__, so tests import it directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+import pytest
+
+import app
+
+ETAG = '"0123456789abcdef"'
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False),
+    ("", False),
+    ('"0123456789abcdef"', True),
+    ('W/"0123456789abcdef"', True),
+    ('"aaaa", W/"0123456789abcdef" ', True),
+    ('*', True),
+    ('"0123456789abcde"', False),  # A prefix of the ETag
+    ('"0123456789abcdef0"', False),  # The ETag as a substring
+    ('0123456789abcdef', False),  # Unquoted
+])
+def test_etag_matches(header, matches):
+    assert app.etag_matches(header, ETAG) is matches
@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import app
+
+TODAY = date.today()
+
+
+def register(dtype):
+    """An equipment register as load_fleet_frame leaves it, with its expiry dates as `dtype`."""
+    df = pd.DataFrame({
+        'PALTE NO.': ["ABC-1", "", "XYZ 2"],
+        'ASSET CODE': ["AC-1", "AC-2", ""],
+        'T.P EXPIRY DATE': ["01-Jan-2020", "", "15-Mar-2031"],
+        'INSURANCE EXPIRY DATE': [(TODAY + timedelta(days=5)).strftime("%d-%b-%Y"), "bad", ""],
+    }, index=[2, 3, 4])
+    for col in ['T.P EXPIRY DATE', 'INSURANCE EXPIRY DATE']:
+        df[col] = app.parse_dates(df[col])
+        if dtype == "date32":
+            df[col] = df[col].astype("date32[pyarrow]")
+    return df
+
+
+@pytest.mark.parametrize("dtype", ["datetime64", "date32"])
+def test_compliance_state_handles_both_date_types(dtype):
+    assert app.compliance_state(register(dtype), "equipment") == {
+        "ABC1": {'T.P EXPIRY DATE': "2020-01-01", 'INSURANCE EXPIRY DATE': (TODAY + timedelta(days=5)).isoformat()},
+        "AC2": {'T.P EXPIRY DATE': None, 'INSURANCE EXPIRY DATE': None},
+        "XYZ2": {'T.P EXPIRY DATE': "2031-03-15", 'INSURANCE EXPIRY DATE': None},
+    }
+
+
+@pytest.mark.parametrize("dtype", ["datetime64", "date32"])
+def test_badge_expiry_handles_both_date_types(dtype):
+    badges = register(dtype)['INSURANCE EXPIRY DATE'].apply(app.badge_expiry, expiry_days=30).tolist()
+    assert badges[0].startswith("⚠️ Expires Soon")
+    assert badges[1:] == ["⚪ Not Set", "⚪ Not Set"]
+    assert app.badge_expiry(pd.Timestamp("2020-01-01")) == "🚨 Expired (01-Jan-2020)"
+    assert app.badge_expiry(date(2099, 1, 1)) == "✅ Valid (01-Jan-2099)"
+
+
+def test_compliance_replay(monkeypatch):
+    deltas = [
+        {"date": "2026-01-01", "set": {"A": {"TP": "2026-01-20"}, "B": {"TP": "2026-06-01"}}, "drop": []},
+        {"date": "2026-01-15", "set": {"A": {"TP": "2027-01-20"}}, "drop": []},
+        {"date": "2026-02-01", "set": {}, "drop": ["B"]},
+    ]
+    monkeypatch.setattr(app, "load_compliance_deltas", lambda dataset: deltas)
+    trend = app.compliance_trend("equipment", [date(2025, 12, 31), date(2026, 1, 1), date(2026, 1, 25), date(2026, 2, 1)])
+    assert trend.values.tolist() == [
+        [pd.Timestamp("2026-01-01"), "TP", 0, 1, 2], # A expires within 30 days
+        [pd.Timestamp("2026-01-25"), "TP", 0, 0, 2], # A renewed before it lapsed
+        [pd.Timestamp("2026-02-01"), "TP", 0, 0, 1], # B dropped from the register
+    ]
@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def equipment(monkeypatch):
+    frame = pd.DataFrame({
+        'PALTE NO.': ["ABC-1", "XYZ 2"],
+        'ASSET CODE': ["AC-1", "AC-2"],
+        'T.P INSPECTION DATE': ["11-Jul-2026", "01-Aug-2026"],
+        'IQAMA NO': ["2411", "2411"],
+    }, index=[2, 3])
+    index = app.KeyIndex(app.DUPLICATE_KEYS["equipment"])
+    monkeypatch.setattr(app, "current_project", lambda: "test")
+    monkeypatch.setattr(app, "load_sheet_frame", lambda sheet, project, dataset: frame)
+    monkeypatch.setattr(app, "get_key_index", lambda project, dataset: index)
+    return frame
+
+
+def test_normalize_key():
+    assert app.normalize_key(" abc-1234 ") == app.normalize_key("ABC 1234") == "ABC1234"
+
+
+def test_same_inspection_is_a_duplicate(equipment):
+    record = {'PALTE NO.': "abc 1", 'ASSET CODE': "", 'T.P INSPECTION DATE': "11-Jul-2026"}
+    assert app.find_duplicates(None, "equipment", record) == [('PALTE NO.', "abc 1", [2])]
+
+
+def test_reinspection_on_another_date_is_new(equipment):
+    record = {'PALTE NO.': "ABC-1", 'ASSET CODE': "AC-1", 'T.P INSPECTION DATE': "19-Oct-2026"}
+    assert app.find_duplicates(None, "equipment", record) == []
+
+
+def test_iqama_repeats_are_not_duplicates(equipment):
+    record = {'PALTE NO.': "NEW-9", 'ASSET CODE': "AC-9", 'IQAMA NO': "2411", 'T.P INSPECTION DATE': "11-Jul-2026"}
+    assert app.find_duplicates(None, "equipment", record) == []
@@ -0,0 +1,43 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def canonicalizer(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "NAMES_FILE", str(tmp_path / "canonical_names.json"))
+    return app.NameCanonicalizer()
+
+
+@pytest.mark.parametrize("value, namespace, key", [
+    ("ABC Co. ", "owner", "abc"),
+    ("abc  CO", "owner", "abc"),
+    ("ABC Trading W.L.L.", "owner", "abc trading"),
+    ("Trading ABC", "owner", "abc trading"),
+    ("Co", "owner", "co"),
+    ("Caterpillar Inc", "make", "caterpillar inc"),
+    ("José  Ali", "person", "jose ali"),
+    ("AHMED, Ali", "person", "ahmed ali"),
+    ("Ali Ahmed", "person", "ali ahmed"),
+])
+def test_name_key(value, namespace, key):
+    assert app.name_key(value, namespace) == key
+
+
+def test_person_names_keep_word_order(canonicalizer):
+    names = canonicalizer.resolve("person", ["Ali Ahmed", "ALI AHMED ", "Ahmed Ali"])
+    assert names == {"Ali Ahmed": "Ali Ahmed", "ALI AHMED ": "Ali Ahmed", "Ahmed Ali": "Ahmed Ali"}
+    assert canonicalizer.suggestions() == [("person", "ahmed ali", "Ahmed Ali", "ali ahmed", "Ali Ahmed")]
+
+
+def test_confirmed_merge_applies_to_later_spellings(canonicalizer):
+    canonicalizer.resolve("person", ["Ali Ahmed", "Ahmed Ali"])
+    canonicalizer.merge("person", "ahmed ali", "ali ahmed")
+    assert canonicalizer.resolve("person", ["AHMED ALI", "Ahmed Ali"]) == {"AHMED ALI": "Ali Ahmed", "Ahmed Ali": "Ali Ahmed"}
+    assert canonicalizer.suggestions() == []
+
+
+def test_owner_typo_is_suggested_not_merged(canonicalizer):
+    names = canonicalizer.resolve("owner", ["ABC Trading Co.", "ABD Trading"])
+    assert names == {"ABC Trading Co.": "ABC Trading Co.", "ABD Trading": "ABD Trading"}
+    assert [row[1:4:2] for row in canonicalizer.suggestions()] == [("abd trading", "abc trading")]
@@ -0,0 +1,34 @@
+import pandas as pd
+
+import app
+
+
+def indexed(columns, df):
+    index = app.KeyIndex(columns)
+    index.sync_frame(df)
+    return index
+
+
+def test_unique_key_columns():
+    assert app.unique_key_columns("permit") == ["PERMIT NO"]
+    assert app.unique_key_columns("vehicle") == [app.RECORD_ID_COLUMN]
+    assert app.unique_key_columns("observation") == [app.RECORD_ID_COLUMN]
+
+
+def test_duplicate_keys_reports_repeats_after_the_first_row():
+    df = pd.DataFrame({'PERMIT NO': ["P-1", "p 1", "P-2", "P-1", ""]}, index=[2, 3, 4, 5, 6])
+    report = app.duplicate_keys(indexed(["PERMIT NO"], df))
+    assert report["ROW"].tolist() == [3, 5]
+    assert set(report["RULE"]) == {"Duplicate key"}
+
+
+def test_fleet_repeats_are_not_duplicates():
+    # One operator (Iqama) on two vehicles and a re-inspected plate are legitimate
+    df = pd.DataFrame({
+        'PLATE NO': ["ABC 1", "ABC 1", "XYZ 2"],
+        'IQAMA NO': ["2411", "2411", "2411"],
+        app.RECORD_ID_COLUMN: ["VEH-1", "VEH-2", "VEH-3"],
+    }, index=[2, 3, 4])
+    assert app.duplicate_keys(indexed(app.unique_key_columns("vehicle"), df)).empty
+    df.loc[4, app.RECORD_ID_COLUMN] = "VEH-1" # A row copied by hand
+    assert app.duplicate_keys(indexed(app.unique_key_columns("vehicle"), df))["ROW"].tolist() == [4]
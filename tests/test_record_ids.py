@@ -0,0 +1,31 @@
+import pandas as pd
+
+import app
+
+COLUMNS = ['DATE', 'WELL NO', 'CLASSIFICATION', 'STATUS', app.RECORD_ID_COLUMN]
+
+
+def test_record_key_prefers_record_id():
+    df = pd.DataFrame({app.RECORD_ID_COLUMN: [" OBS-1 ", "", None]}, index=[5, 6, 7])
+    assert app.record_key(df, 5) == "OBS-1"
+    assert app.record_key(df, 6) == 6
+    assert app.record_key(df, 7) == 7
+
+
+def test_record_key_without_id_column():
+    df = pd.DataFrame({'STATUS': ["Open"]}, index=[3])
+    assert app.record_key(df, 3) == 3
+
+
+def test_row_matches_by_record_id():
+    cached = {'STATUS': "Open", app.RECORD_ID_COLUMN: "OBS-1"}
+    assert app.row_matches("observation", "OBS-1", cached, ["1-Jan-2026", "7", "POSITIVE", "OPEN", "OBS-1"], COLUMNS)
+    assert not app.row_matches("observation", "OBS-1", cached, ["1-Jan-2026", "7", "POSITIVE", "OPEN", "OBS-2"], COLUMNS)
+    assert not app.row_matches("observation", "OBS-1", cached, [], COLUMNS)
+
+
+def test_row_matches_by_cells_without_record_id():
+    cached = {'DATE': pd.Timestamp("2026-01-01"), 'WELL NO': "7", 'CLASSIFICATION': "POSITIVE", 'STATUS': "Open"}
+    # Cells are compared as the cache holds them (upper-cased classification, capitalised status)
+    assert app.row_matches("observation", None, cached, ["01/01/2026", "7", " positive", "OPEN"], COLUMNS)
+    assert not app.row_matches("observation", None, cached, ["01/01/2026", "8", "POSITIVE", "OPEN"], COLUMNS)
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def index():
+    index = app.SearchIndex()
+    index.sync_frame(pd.DataFrame({
+        'OBSERVATION DETAILS': [
+            "Scaffold ladder missing guard rail",
+            "Worker without harness on scaffold",
+            "Harness harness harness inspection overdue",
+            "Guard rail damaged near cellar",
+        ],
+        'RECOMMENDED ACTION': ["Fix the guard", "Stop work", "", "Replace rail"],
+    }, index=[2, 3, 4, 5]))
+    return index
+
+
+def rows(index, query):
+    return sorted(index.search(query).index)
+
+
+def test_tokenize():
+    assert app.tokenize("Guard-rail, 2x SCAFFOLD!") == ["guard", "rail", "2x", "scaffold"]
+
+
+def test_terms_are_anded(index):
+    assert rows(index, "scaffold harness ") == [3]
+    assert rows(index, "guard rail ") == [2, 5]
+
+
+def test_phrase(index):
+    assert rows(index, '"guard rail"') == [2, 5]
+    assert rows(index, '"rail guard"') == []
+    assert rows(index, '"missing guard" scaffold') == [2]
+
+
+def test_prefixes(index):
+    assert rows(index, "harn*") == [3, 4]
+    assert rows(index, "scaff") == [2, 3] # The last bare term is a prefix while typing
+    assert rows(index, "scaff ") == [] # ... but not once it is followed by a space
+    assert rows(index, "scaff* guard") == [2]
+
+
+def test_empty_query_and_no_match(index):
+    assert index.search("").empty
+    assert index.search("   ").empty
+    assert index.search("crane ").empty
+
+
+def test_bm25_ranks_frequent_terms_first(index):
+    assert list(index.search("harness ").index) == [4, 3]
+
+
+def test_edited_rows_are_reindexed(index):
+    index.update_rows(pd.DataFrame({'OBSERVATION DETAILS': ["Crane outrigger pads missing"], 'RECOMMENDED ACTION': [""]}, index=[2]))
+    assert rows(index, "crane ") == [2]
+    assert rows(index, "ladder ") == []
@@ -0,0 +1,36 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("shard, sheet_row", [(0, 2), (0, 9_999_999), (1, 2), (3, 50_001)])
+def test_row_keys_round_trip(shard, sheet_row):
+    row = shard * app.SHARD_ROW_STRIDE + sheet_row
+    assert app.split_row(row) == (shard, sheet_row)
+
+
+def test_first_shard_keys_are_sheet_rows():
+    assert app.split_row(1858) == (0, 1858)
+    assert app.row_label("observation", 1858) == "1858"
+
+
+def test_rows_to_frame_indexes_by_row_key():
+    first = 2 * app.SHARD_ROW_STRIDE + 2
+    df = app.rows_to_frame([" date ", "Well No"], [["01-Jan-2026", "7"], ["02-Jan-2026"]], first)
+    assert list(df.columns) == ["DATE", "WELL NO"]
+    assert [app.split_row(row) for row in df.index] == [(2, 2), (2, 3)]
+    assert df.loc[first + 1, "WELL NO"] == ""
+
+
+def test_shard_title_avoids_taken_titles(monkeypatch):
+    today = date.today()
+    monkeypatch.setattr(app, "SHARD_PERIOD", "quarter")
+    title = f"Permit {today.year}-Q{(today.month - 1) // 3 + 1}"
+    assert app.shard_title("permit", [SimpleNamespace(title="Sheet1")]) == title
+    taken = [SimpleNamespace(title=t) for t in ("Sheet1", title, f"{title} (2)")]
+    assert app.shard_title("permit", taken) == f"{title} (3)"
+    monkeypatch.setattr(app, "SHARD_PERIOD", "year")
+    assert app.shard_title("observation", []) == f"Observation {today.year}"
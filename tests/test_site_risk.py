@@ -0,0 +1,30 @@
+from datetime import date
+
+import pandas as pd
+
+import app
+
+
+def permit_frame(types):
+    return pd.DataFrame({
+        'DATE': pd.to_datetime(["2026-03-02"] * len(types)),
+        'DRILL SITE': [" 1858"] * len(types),
+        'TYPE OF PERMIT': types,
+    })
+
+
+def test_site_day_index_normalises_permit_types():
+    index = app.SiteDayIndex(*app.SITE_DAY_COLUMNS["permit"])
+    for row, doc in index._docs(permit_frame(["Hot", " HOT ", "hot", "cse", "Cold"])).items():
+        index._add(row, doc)
+    assert index.snapshot() == {("1858", date(2026, 3, 2)): {"HOT": 3, "CSE": 1, "COLD": 1}}
+
+
+def test_join_site_days_counts_types_ignoring_case():
+    day = date(2026, 3, 2)
+    obs = {("1858", day): {"UNSAFE ACT": 2, "POSITIVE": 1}}
+    permits = {("1858", day): {"HOT": 3, "CSE": 1, "EOLB": 1, "COLD": 4}, ("2433", day): {"COLD": 1}}
+    df = app.join_site_days(obs, permits, ["Hot", "Cold", "CSE"]).set_index("SITE")
+    assert df.loc["1858", ["OBSERVATIONS", "UNSAFE", "PERMITS", "HIGH RISK PERMITS"]].tolist() == [3, 2, 9, 5]
+    assert df.loc["1858", ["Hot", "Cold", "CSE"]].tolist() == [3, 4, 1]
+    assert df.loc["2433", ["OBSERVATIONS", "HIGH RISK PERMITS", "Cold"]].tolist() == [0, 0, 1]
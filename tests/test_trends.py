@@ -0,0 +1,59 @@
+import random
+
+import pandas as pd
+import pytest
+
+import app
+
+
+def brute(counts):
+    sums, level, ewma = [0], 0.0, []
+    for x in counts:
+        sums.append(sums[-1] + x)
+        level += app.ANOMALY_EWMA_ALPHA * (x - level)
+        ewma.append(level)
+    return sums, ewma
+
+
+def test_prefix_sums_and_ewma_match_a_full_recompute():
+    rng = random.Random(7)
+    series = app.DailySeries(1000)
+    for step in range(200):
+        series.add(rng.randint(950, 1100), rng.randint(1, 3)) # Days arrive out of order, some before `first`
+        if step % 10 == 0:
+            series.refresh()
+            sums, ewma = brute(series.counts)
+            assert series.sums == sums
+            assert series.ewma == pytest.approx(ewma)
+    series.refresh()
+    assert series.squares[-1] == sum(x * x for x in series.counts)
+
+
+def test_window_and_total():
+    series = app.DailySeries(10)
+    for day, n in [(10, 2), (11, 4), (13, 6)]:
+        series.add(day, n)
+    series.refresh()
+    assert series.counts == [2, 4, 0, 6]
+    assert series.window(3, 2) == (2.0, 4.0) # Days 11-12: counts 4, 0
+    assert series.total(11, 13) == 10
+    assert series.total(0, 100) == 12
+    assert series.total(20, 30) == 0
+
+
+def test_check_flags_a_spike():
+    series = app.DailySeries(0)
+    for day in range(40):
+        series.add(day, 1)
+    series.add(40, 12)
+    series.refresh()
+    assert series.check(39) is None
+    assert series.check(40)[5] == "Spike"
+
+
+def test_read_segment_reads_only_present_columns(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "_archive_path", lambda dataset, filename: str(tmp_path / filename))
+    pd.DataFrame({'DATE': pd.to_datetime(["2026-01-01"]), 'STATUS': ["Open"], 'WELL NO': ["7"]}, index=[42]).to_parquet(tmp_path / "seg.parquet")
+    part = app.read_segment("observation", "seg.parquet", ['DATE', 'WELL NO', 'WELL NO', app.RECORD_ID_COLUMN])
+    assert list(part.columns) == ['DATE', 'WELL NO']
+    assert part.index.tolist() == [42]